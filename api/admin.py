@@ -1,4 +1,9 @@
 from django.contrib import admin
+from django.contrib.admin.exceptions import NotRegistered
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Count, Prefetch, Q
+from django.utils.functional import cached_property
 from django.utils.safestring import mark_safe
 
 # Register your models here.
@@ -14,9 +19,145 @@ from .models import (
     ShippingAddress,
     OrderItem,
     Payment,
-    ContractForm
+    ContractForm,
+    InventoryMovement,
 )
 from django.contrib.auth.admin import UserAdmin
+from .derivatives import thumbnail_url
+from .inventory import record_movement
+
+
+class LazyRelatedFieldListFilter(admin.RelatedFieldListFilter):
+    """
+    A related-field filter for tables too big to list in the sidebar: it shows
+    the first `max_choices` rows in the related admin's ordering, plus the
+    selected ones, rather than the whole table. Search narrows the rest.
+    """
+
+    max_choices = 30
+
+    def field_choices(self, field, request, model_admin):
+        related_model = field.remote_field.model
+        queryset = related_model._default_manager.all()
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        try:
+            related_admin = model_admin.admin_site.get_model_admin(related_model)
+        except NotRegistered:
+            pass
+        else:
+            # Whatever its __str__ needs.
+            if isinstance(related_admin.list_select_related, (list, tuple)):
+                queryset = queryset.select_related(*related_admin.list_select_related)
+        choices = list(queryset[: self.max_choices])
+        shown = {obj.pk for obj in choices}
+        selected = [pk for pk in self.lookup_val or [] if pk.isdigit() and int(pk) not in shown]
+        if selected:
+            choices += queryset.filter(pk__in=selected)
+        return [(obj.pk, str(obj)) for obj in choices]
+
+
+def estimated_row_count(model, using):
+    """
+    The row count of `model`'s table from the database's statistics, or None
+    where there are none. It can be off by a fair margin on InnoDB.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == "mysql":
+        sql = (
+            "SELECT TABLE_ROWS FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"
+        )
+    elif connection.vendor == "postgresql":
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass"
+    elif connection.vendor == "sqlite":
+        # Only there once ANALYZE has run. Every row of a table starts with
+        # its row count.
+        sql = "SELECT CAST(stat AS INTEGER) FROM sqlite_stat1 WHERE tbl = %s LIMIT 1"
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts an unfiltered changelist from table statistics once they put it
+    over `threshold` rows, instead of a COUNT(*) that scans the table. The
+    last pages may then be short or empty. Filtered changelists are counted
+    exactly.
+    """
+
+    threshold = 50000
+    estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, "query") and not queryset.query.has_filters():
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.threshold:
+                self.estimated = True
+                return estimate
+        return super().count
+
+
+class LargeTableAdminMixin:
+    """
+    For changelists of big tables: estimated counts past
+    `estimated_count_threshold` rows, no second count for the "N total" link
+    (set show_full_result_count back to True to have it), and exact,
+    indexed searches on the integer columns in `id_search_fields`.
+    """
+
+    paginator = EstimatedCountPaginator
+    estimated_count_threshold = EstimatedCountPaginator.threshold
+    show_full_result_count = False
+    id_search_fields = ()
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        paginator = super().get_paginator(
+            request, queryset, per_page, orphans, allow_empty_first_page
+        )
+        paginator.threshold = self.estimated_count_threshold
+        return paginator
+
+    def get_search_results(self, request, queryset, search_term):
+        if not self.id_search_fields or not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        # icontains on an integer column casts every row; match ids exactly,
+        # and only for terms that are ids.
+        text_fields = [
+            field for field in self.get_search_fields(request)
+            if field not in self.id_search_fields
+        ]
+        for bit in search_term.split():
+            lookups = [(f"{field}__icontains", bit) for field in text_fields]
+            if bit.isdigit() and len(bit) <= 18:
+                lookups += [(field, int(bit)) for field in self.id_search_fields]
+            if not lookups:
+                return queryset.none(), False
+            queryset = queryset.filter(Q.create(lookups, connector=Q.OR))
+        return queryset, False
+
+
+def image_tags(images, size):
+    """<img> thumbnails for `images`, prefetched by the admin's get_queryset."""
+    tags = "".join(
+        f'<img src="{thumbnail_url(image.image, image.derivatives, size * 2)}" '
+        f'width="{size}" height="{size}" />&nbsp;'
+        for image in images
+    )
+    return mark_safe(tags or "No Images")
 
 
 class ImageInline(admin.TabularInline):
@@ -31,6 +172,19 @@ class OrderItemInline(admin.TabularInline):
 class VariantInline(admin.TabularInline):
     model = Variant
     extra = 0  # Set to 0 to remove the empty extra row
+    # Stock changes are recorded as inventory movements.
+    readonly_fields = ("quantity",)
+
+
+class StockAdminMixin:
+    """
+    `quantity` can be set when a product or variant is added, as its opening
+    stock; later changes are recorded as inventory movements.
+    """
+
+    def get_readonly_fields(self, request, obj=None):
+        readonly = super().get_readonly_fields(request, obj)
+        return readonly if obj is None else (*readonly, "quantity")
 
 
 
@@ -45,7 +199,7 @@ class PaymentInline(admin.TabularInline):
     extra = 0  # Set to 0 to remove the empty extra row
 
 
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(StockAdminMixin, admin.ModelAdmin):
     list_display = (
         "name",
         "get_categories",
@@ -56,8 +210,13 @@ class ProductAdmin(admin.ModelAdmin):
         "image_display",
         "is_active",
     )
-    list_filter = ("category", "subcategory", "is_active")
+    list_filter = (
+        ("category", LazyRelatedFieldListFilter),
+        ("subcategory", LazyRelatedFieldListFilter),
+        "is_active",
+    )
     search_fields = ["name", "description"]
+    autocomplete_fields = ["category", "subcategory", "discount"]
     inlines = [
         VariantInline,
         ImageInline
@@ -72,54 +231,93 @@ class ProductAdmin(admin.ModelAdmin):
         return obj.discounted_price
     get_categories.short_description = 'Categories'
     get_subcategories.short_description = 'Subcategories'
+    discounted_price.admin_order_field = "effective_price"
+
+    def get_queryset(self, request):
+        # One query per relation for the whole page, not one per row.
+        return (
+            super()
+            .get_queryset(request)
+            .with_effective_price()
+            .prefetch_related(
+                Prefetch("category", Category.objects.only("name")),
+                Prefetch("subcategory", SubCategory.objects.only("name")),
+                Prefetch("images", Image.objects.only("product", "image", "derivatives")),
+            )
+        )
     def image_display(self, obj):
-        images_html = ""
-        if (
-            obj.images.exists()
-        ):  # Assuming 'images' is the related_name for the Image model
-            for image in obj.images.all():
-                images_html += (
-                    f'<img src="{image.image.url}" width="40" height="40" />&nbsp;'
-                )
-        else:
-            images_html = "No Images"
-        return mark_safe(images_html)
+        return image_tags(obj.images.all(), 40)
 
     image_display.short_description = "Images"  # Changed to plural 'Images'
 
 
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ("name", "description", "image_display", "is_active")
+    list_display = (
+        "name",
+        "description",
+        "subcategory_count",
+        "product_count",
+        "image_display",
+        "is_active",
+    )
     list_filter = ("is_active",)
     search_fields = ["name", "description"]
     inlines = [ImageInline]
     list_per_page = 20  # Number of items per page
     ordering = ("-id",)  # Sort by ID in descending order
 
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(
+                subcategory_count=Count("subcategories", distinct=True),
+                product_count=Count("products_in_category", distinct=True),
+            )
+            .prefetch_related(
+                Prefetch("images", Image.objects.only("category", "image", "derivatives"))
+            )
+        )
+
+    def subcategory_count(self, obj):
+        return obj.subcategory_count
+
+    def product_count(self, obj):
+        return obj.product_count
+
+    subcategory_count.short_description = "Subcategories"
+    subcategory_count.admin_order_field = "subcategory_count"
+    product_count.short_description = "Products"
+    product_count.admin_order_field = "product_count"
+
     def image_display(self, obj):
-        images_html = ""
-        if (
-            obj.images.exists()
-        ):  # Assuming 'images' is the related_name for the Image model
-            for image in obj.images.all():
-                images_html += (
-                    f'<img src="{image.image.url}" width="50" height="50" />&nbsp;'
-                )
-        else:
-            images_html = "No Images"
-        return mark_safe(images_html)
+        return image_tags(obj.images.all(), 50)
 
     image_display.short_description = "Images"
 
 
 class SubCategoryAdmin(admin.ModelAdmin):
-    list_display = ("name", "category", "description", "is_active")
-    list_filter = ("category", "is_active")
+    list_display = ("name", "category", "description", "product_count", "is_active")
+    list_filter = (("category", LazyRelatedFieldListFilter), "is_active")
+    # Also what __str__ needs, for the filters listing subcategories.
+    list_select_related = ("category",)
     search_fields = ["name", "description"]
+    autocomplete_fields = ["category"]
     inlines = [ImageInline]
     list_per_page = 20  # Number of items per page
     ordering = ("-id",)  # Sort by ID in descending order
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            product_count=Count("products_in_subcategory")
+        )
+
+    def product_count(self, obj):
+        return obj.product_count
+
+    product_count.short_description = "Products"
+    product_count.admin_order_field = "product_count"
+
 
 class DiscountAdmin(admin.ModelAdmin):
     list_display = (
@@ -129,13 +327,13 @@ class DiscountAdmin(admin.ModelAdmin):
         "end_date",
         "is_active",
     )
-    list_filter = ("is_active", "end_date", "start_date", "product")
+    list_filter = ("is_active", "end_date", "start_date", ("product", LazyRelatedFieldListFilter))
     search_fields = ["description", "end_date", "start_date"]
     list_per_page = 20  # Number of items per page
     ordering = ("-id",)  # Sort by ID in descending order
 
 
-class VariantAdmin(admin.ModelAdmin):
+class VariantAdmin(StockAdminMixin, admin.ModelAdmin):
     list_display = (
         "product",
         "discount",
@@ -144,7 +342,9 @@ class VariantAdmin(admin.ModelAdmin):
         "quantity",
         "is_active",
     )
-    list_filter = ("is_active", "product")
+    list_filter = ("is_active", ("product", LazyRelatedFieldListFilter))
+    list_select_related = ("product", "discount")
+    autocomplete_fields = ["product", "discount"]
     # search_fields = ['end_date','start_date']
     list_per_page = 20  # Number of items per page
     ordering = ("-id",)  # Sort by ID in descending order
@@ -176,10 +376,12 @@ class CustomUserAdmin(UserAdmin):
     )
 
 
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ("id", "user", "created_at")
+    list_select_related = ("user",)
     inlines = [OrderItemInline, ShippingAddressInline, PaymentInline]
     search_fields = ["id"]
+    id_search_fields = ["id"]
     ordering = ("-id",)
     list_per_page = 20
 
@@ -190,7 +392,7 @@ class ContractFormAdmin(admin.ModelAdmin):
     list_per_page = 20
 
 
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = (
         "id",
         "product",
@@ -198,13 +400,15 @@ class OrderItemAdmin(admin.ModelAdmin):
         "price",
         "quantity",
     )
-    list_filter = ("is_active", "product")
+    list_filter = ("is_active", ("product", LazyRelatedFieldListFilter))
+    list_select_related = ("product", "variant__product")
     search_fields = ["id", "order"]
+    id_search_fields = ["id", "order"]
     list_per_page = 20  # Number of items per page
     ordering = ("-id",)  # Sort by ID in descending order
 
 
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = (
         "id",
         "order",
@@ -214,12 +418,47 @@ class PaymentAdmin(admin.ModelAdmin):
         "transaction_id",
     )
     search_fields = ["transaction_id", "id"]
+    id_search_fields = ["id"]
     list_filter = ("is_active",)
+    list_select_related = ("order",)
     # search_fields = ['end_date','start_date']
     list_per_page = 20  # Number of items per page
     ordering = ("-id",)  # Sort by ID in descending order
 
 
+class InventoryMovementAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = (
+        "id",
+        "kind",
+        "product",
+        "variant",
+        "quantity",
+        "order_item",
+        "user",
+        "created_at",
+    )
+    list_filter = ("kind", ("product", LazyRelatedFieldListFilter))
+    list_select_related = ("product", "variant__product", "order_item", "user")
+    fields = ("kind", "product", "variant", "quantity", "order_item", "note")
+    autocomplete_fields = ["product"]
+    raw_id_fields = ["variant", "order_item"]
+    search_fields = ["id", "order_item"]
+    id_search_fields = ["id", "order_item"]
+    list_per_page = 20
+    ordering = ("-id",)
+
+    # The ledger is append-only: movements are added, never edited.
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def save_model(self, request, obj, form, change):
+        obj.user = request.user
+        record_movement(obj)
+
+
 class ImageAdmin(admin.ModelAdmin):
     search_fields = ["id"]
     ordering = ("-id",)
@@ -238,4 +477,5 @@ admin.site.register(OrderItem, OrderItemAdmin)
 admin.site.register(Payment, PaymentAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(ContractForm, ContractFormAdmin)
+admin.site.register(InventoryMovement, InventoryMovementAdmin)
 
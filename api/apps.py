@@ -4,3 +4,18 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Connect the signal receivers that keep derived data up to date.
+        from . import (
+            caching,
+            conditional,
+            derivatives,
+            facets,
+            instrumentation,
+            inventory,
+            nplusone,
+            rollups,
+            search,
+            snapshots,
+        )
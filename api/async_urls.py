@@ -0,0 +1,66 @@
+from django.urls import path, re_path
+
+from .async_views import async_view
+from .views import (
+    CategoryDetailView,
+    CategoryDetailViewSlag,
+    CategoryListView,
+    ProductViewSet,
+    SubCategoryDetailView,
+    SubCategoryDetailViewSlag,
+    SubCategoryListView,
+)
+
+# The read-only catalog routes of api/urls.py, served by async views under
+# ASGI (see mistrytech/async_urls.py). Names and paths match the sync ones.
+urlpatterns = [
+    re_path(
+        r"^product/$",
+        async_view(
+            ProductViewSet,
+            "list",
+            {"get": "list", "post": "create"},
+            basename="product",
+            detail=False,
+        ),
+        name="product-list",
+    ),
+    re_path(
+        r"^product/(?P<pk>[^/.]+)/$",
+        async_view(
+            ProductViewSet,
+            "retrieve",
+            {
+                "get": "retrieve",
+                "put": "update",
+                "patch": "partial_update",
+                "delete": "destroy",
+            },
+            basename="product",
+            detail=True,
+        ),
+        name="product-detail",
+    ),
+    path("category/", async_view(CategoryListView, "list"), name="category-list"),
+    path(
+        "category/<int:pk>/",
+        async_view(CategoryDetailView, "retrieve"),
+        name="category-detail",
+    ),
+    path("subcategory/", async_view(SubCategoryListView, "list"), name="subcategory-list"),
+    path(
+        "category/slug/<slug:slug>/",
+        async_view(CategoryDetailViewSlag, "list"),
+        name="category-detail",
+    ),
+    path(
+        "subcategory/<int:pk>/",
+        async_view(SubCategoryDetailView, "retrieve"),
+        name="subcategory-detail",
+    ),
+    path(
+        "subcategory/slug/<slug:slug>/",
+        async_view(SubCategoryDetailViewSlag, "list"),
+        name="subcategory-detail-slug",
+    ),
+]
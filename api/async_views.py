@@ -0,0 +1,94 @@
+"""
+Native async views for the read-only catalog routes.
+
+Under ASGI, requests are resolved against `mistrytech.async_urls`, where
+these views serve the same URLs as their DRF views, mostly without leaving
+the event loop. Each one instantiates its DRF view for the querysets,
+serializer, paginator and cache settings and runs the view's `initial()`
+(content negotiation, authentication, permissions, throttles) in one
+sync_to_async call. It then calls the view's `alist` / `aretrieve` chain
+(see AsyncReadMixin), which does its I/O through the async ORM and cache
+API, and finishes the response with the view's `finalize_response()`,
+so that its body and headers are the DRF ones. Anything that chain can't
+reproduce, like authenticated requests, `?format=`, fields a Plan can't
+render or 404s, is handed to the DRF view in a single sync_to_async call.
+"""
+
+from contextlib import nullcontext
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.viewsets import ViewSetMixin
+
+from .fastpath import AsyncUnsupported
+
+
+def must_delegate(request):
+    return (
+        request.method != "GET"
+        or "HTTP_AUTHORIZATION" in request.META
+        or "format" in request.GET
+    )
+
+
+def async_view(view_class, action, actions=None, **initkwargs):
+    """
+    An async view function for the `action` ("list" or "retrieve") of the DRF
+    `view_class`, which is given `initkwargs` like its as_view() would be. A
+    viewset also takes the `actions` its router maps the URL's methods to.
+    """
+    if issubclass(view_class, ViewSetMixin):
+        sync_view = view_class.as_view(dict(actions), **initkwargs)
+        actions = {"head": actions["get"], **actions}
+    else:
+        sync_view = view_class.as_view(**initkwargs)
+    fallback = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if must_delegate(request):
+            return await fallback(request, *args, **kwargs)
+
+        drf_view = view_class(**initkwargs)
+        if actions:
+            # Bound as ViewSetMixin.as_view() binds them, for `Allow` too.
+            drf_view.action_map = actions
+            for method, name in actions.items():
+                setattr(drf_view, method, getattr(drf_view, name))
+        drf_view.setup(request, *args, **kwargs)
+        drf_view.request = drf_view.initialize_request(request, *args, **kwargs)
+        drf_view.headers = drf_view.default_response_headers
+        try:
+            # Content negotiation, authentication, permissions and throttles,
+            # as APIView.dispatch() runs them.
+            await sync_to_async(drf_view.initial)(drf_view.request, *args, **kwargs)
+        except Exception as exc:
+            response = drf_view.handle_exception(exc)
+        else:
+            replica_reads = getattr(drf_view, "replica_reads", nullcontext)
+            try:
+                with replica_reads(request):
+                    response = await getattr(drf_view, f"a{action}")(
+                        drf_view.request, *args, **kwargs
+                    )
+            except (AsyncUnsupported, Http404):
+                return await fallback(request, *args, **kwargs)
+
+        # Allow, Vary: Accept and anything else dispatch() would add.
+        response = drf_view.finalize_response(drf_view.request, response, *args, **kwargs)
+        if isinstance(response, Response):
+            rendered = HttpResponse(
+                JSONRenderer().render(response.data),
+                status=response.status_code,
+                content_type="application/json",
+            )
+            for header, value in response.items():
+                if header.lower() != "content-type":
+                    rendered[header] = value
+            response = rendered
+        return response
+
+    view.csrf_exempt = True
+    view.view_class = view_class
+    return view
@@ -0,0 +1,9 @@
+from django.db.backends.mysql import base
+
+from ..pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    def check_pooled_connection(self, connection):
+        # A round trip without a result set; raises once the server is gone.
+        connection.ping()
@@ -0,0 +1,330 @@
+"""
+Process-wide database connection pools.
+
+Django keeps one connection per thread and alias, opens it on first use and,
+with `CONN_MAX_AGE = 0`, closes it when the request finishes. The backends in
+this package (`api.backends.mysql`, `api.backends.sqlite3`) hand that close
+to a pool instead, which keeps the physical connection for the next request
+on any thread. That matters most under ASGI, where every request runs its
+ORM calls on a fresh thread, so persistent connections would pile up.
+
+Configured per alias in `OPTIONS["pool"]`:
+
+    "OPTIONS": {
+        "pool": {
+            "min_size": 2,        # opened on first use and kept open
+            "max_size": 10,       # connections in use and idle, at most
+            "timeout": 10,        # seconds to wait for a free connection
+            "max_lifetime": 1800, # seconds before a connection is replaced
+            "max_idle": 300,      # seconds an idle connection above min_size is kept
+            "check_after": 30,    # idle seconds after which it is checked before reuse
+        },
+    },
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+DEFAULTS = {
+    "min_size": 0,
+    "max_size": 10,
+    "timeout": 10,
+    "max_lifetime": 1800,
+    "max_idle": 300,
+    "check_after": 30,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    __slots__ = ("connection", "created_at", "released_at", "initialized")
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.released_at = self.created_at
+        self.initialized = False
+
+
+class ConnectionPool:
+    """
+    A bounded LIFO pool of DB-API connections made by `connect()` and checked
+    with `check(connection)`, which raises when the connection is unusable.
+    """
+
+    def __init__(self, connect, check, min_size=0, max_size=10, timeout=10,
+                 max_lifetime=1800, max_idle=300, check_after=30):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("The pool needs 0 <= min_size <= max_size and max_size >= 1.")
+        self.connect = connect
+        self.check = check
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.pid = os.getpid()
+        self.idle = deque()
+        self.in_use = {}
+        self.size = 0
+        self.filled = False
+        self.condition = threading.Condition()
+        self.stats = {
+            "acquired": 0,
+            "created": 0,
+            "closed": 0,
+            "waited": 0,
+            "timeouts": 0,
+            "failed_checks": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+        }
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                **self.stats,
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": len(self.in_use),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+            }
+
+    def _open(self):
+        # Called with a slot already reserved in self.size.
+        try:
+            pooled = PooledConnection(self.connect())
+        except BaseException:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.stats["created"] += 1
+        return pooled
+
+    def _discard(self, pooled):
+        try:
+            pooled.connection.close()
+        except Exception:
+            pass
+        with self.condition:
+            self.size -= 1
+            self.stats["closed"] += 1
+            self.condition.notify()
+
+    def _is_stale(self, pooled, now):
+        return now - pooled.created_at >= self.max_lifetime
+
+    def fill(self):
+        """Open connections up to min_size."""
+        with self.condition:
+            missing = max(0, self.min_size - self.size)
+            self.size += missing
+            self.filled = True
+        for _ in range(missing):
+            pooled = self._open()
+            with self.condition:
+                self.idle.append(pooled)
+                self.condition.notify()
+
+    def acquire(self):
+        """
+        Return `(connection, initialized)` for a healthy connection, waiting
+        up to `timeout` seconds for one to be released.
+        """
+        if not self.filled:
+            self.fill()
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        while True:
+            pooled = None
+            with self.condition:
+                while not self.idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._record_wait(started, waited)
+                        self.stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"No database connection was released within {self.timeout}s "
+                            f"({self.max_size} in use)."
+                        )
+                    waited = True
+                    self.condition.wait(remaining)
+                if self.idle:
+                    # Most recently used first: it is the least likely to
+                    # have been dropped by the server.
+                    pooled = self.idle.pop()
+                else:
+                    self.size += 1
+            if pooled is None:
+                pooled = self._open()
+            else:
+                now = time.monotonic()
+                if self._is_stale(pooled, now):
+                    self._discard(pooled)
+                    continue
+                if now - pooled.released_at >= self.check_after:
+                    try:
+                        self.check(pooled.connection)
+                    except Exception:
+                        with self.condition:
+                            self.stats["failed_checks"] += 1
+                        self._discard(pooled)
+                        continue
+            break
+
+        with self.condition:
+            self.in_use[id(pooled.connection)] = pooled
+            self.stats["acquired"] += 1
+            self._record_wait(started, waited)
+        return pooled.connection, pooled.initialized
+
+    def _record_wait(self, started, waited):
+        # Called with the condition held.
+        wait_ms = (time.monotonic() - started) * 1000
+        if waited:
+            self.stats["waited"] += 1
+        self.stats["wait_ms_total"] += wait_ms
+        self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], wait_ms)
+
+    def mark_initialized(self, connection):
+        with self.condition:
+            pooled = self.in_use.get(id(connection))
+            if pooled is not None:
+                pooled.initialized = True
+
+    def release(self, connection, reusable=True):
+        with self.condition:
+            pooled = self.in_use.pop(id(connection), None)
+        if pooled is None:
+            # Not ours (e.g. opened before a fork); just close it.
+            connection.close()
+            return
+        now = time.monotonic()
+        if not reusable or self._is_stale(pooled, now):
+            self._discard(pooled)
+            return
+        pooled.released_at = now
+        with self.condition:
+            self.idle.append(pooled)
+            # Shrink back towards min_size, oldest idle connections first.
+            expired = []
+            while (
+                len(self.idle) > 1
+                and self.size - len(expired) > self.min_size
+                and now - self.idle[0].released_at >= self.max_idle
+            ):
+                expired.append(self.idle.popleft())
+            self.condition.notify()
+        for pooled in expired:
+            self._discard(pooled)
+
+    def close_idle(self):
+        with self.condition:
+            idle, self.idle = list(self.idle), deque()
+        for pooled in idle:
+            self._discard(pooled)
+
+
+def get_pool(alias, options, connect, check):
+    """
+    The pool for `alias` in this process. A forked worker starts its own
+    pool rather than sharing its parent's sockets.
+    """
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None or pool.pid != os.getpid():
+            pool = _pools[alias] = ConnectionPool(connect, check, **{**DEFAULTS, **options})
+        return pool
+
+
+def get_pool_stats():
+    with _pools_lock:
+        pools = dict(_pools)
+    return {alias: pool.get_stats() for alias, pool in pools.items() if pool.pid == os.getpid()}
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    DatabaseWrapper side of the pool: new connections come from the pool and
+    closing one returns it. Connections that saw an unrecoverable error, or
+    were closed inside a transaction, are rolled back or dropped rather than
+    reused as they are.
+    """
+
+    def get_pool_options(self):
+        options = self.settings_dict["OPTIONS"].get("pool")
+        if options is True:
+            return {}
+        return options or None
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop("pool", None)
+        return params
+
+    def check_pooled_connection(self, connection):
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        finally:
+            cursor.close()
+
+    @property
+    def pool(self):
+        options = self.get_pool_options()
+        if options is None:
+            return None
+        return get_pool(
+            self.alias,
+            options,
+            lambda: super(PooledDatabaseWrapperMixin, self).get_new_connection(
+                self.get_connection_params()
+            ),
+            self.check_pooled_connection,
+        )
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        try:
+            connection, self.pool_initialized = pool.acquire()
+        except PoolTimeout as exc:
+            raise self.Database.OperationalError(str(exc)) from exc
+        return connection
+
+    def init_connection_state(self):
+        # Session settings survive in the pool; only new connections need them.
+        if getattr(self, "pool_initialized", False):
+            return
+        super().init_connection_state()
+        pool = self.pool
+        if pool is not None:
+            pool.mark_initialized(self.connection)
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        reusable = not self.errors_occurred
+        with self.wrap_database_errors:
+            if reusable and (self.in_atomic_block or not self.autocommit):
+                try:
+                    self.connection.rollback()
+                except self.Database.Error:
+                    reusable = False
+            pool.release(self.connection, reusable=reusable)
@@ -0,0 +1,11 @@
+from django.db.backends.sqlite3 import base
+
+from ..pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    def get_pool_options(self):
+        # Closing an in-memory database destroys it, so it is never pooled.
+        if self.is_in_memory_db():
+            return None
+        return super().get_pool_options()
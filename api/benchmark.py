@@ -0,0 +1,429 @@
+"""
+Route benchmarks.
+
+Every route in `api/urls.py` is requested in-process through the Django test
+client, authenticated with a JWT for a throwaway staff user. Routes that serve
+GET are benchmarked with GET; POST-only routes (checkout, tokens) are posted a
+valid payload and their writes rolled back. The whole run happens inside a
+transaction that is rolled back at the end, so the database is left as found.
+"""
+
+import asyncio
+import json
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from io import BytesIO
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import django
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import urls
+from .models import Category, Order, Product, SubCategory, User
+
+BENCH_PASSWORD = "bench-password"
+PERCENTILES = (50, 90, 95, 99)
+
+# Extra query parameters for routes that need them to do real work.
+ROUTE_PARAMS = {
+    "product-search": {"q": "drill"},
+}
+
+# Router regexes are shown like path() routes: (?P<pk>[^/.]+) becomes <pk>.
+_GROUP_RE = re.compile(r"\(\?P<(\w+)>[^)]*\)")
+_PARAM_RE = re.compile(r"<(?:\w+:)?(\w+)>")
+
+
+def discover_routes(patterns=None, prefix="/api/"):
+    """
+    Yield `(route, name, view_class, allowed_methods)` for the URL patterns of the
+    api app, skipping the `.json`-style format suffix duplicates.
+    """
+    for pattern in urls.urlpatterns if patterns is None else patterns:
+        route = prefix + _GROUP_RE.sub(r"<\1>", str(pattern.pattern).lstrip("^").rstrip("$"))
+        if hasattr(pattern, "url_patterns"):
+            yield from discover_routes(pattern.url_patterns, route)
+            continue
+        if "format" in pattern.pattern.regex.groupindex:
+            continue
+        callback = pattern.callback
+        view_class = getattr(callback, "cls", None) or getattr(callback, "view_class", None)
+        actions = getattr(callback, "actions", None)
+        if actions:
+            methods = {method.upper() for method in actions}
+        else:
+            methods = {
+                method.upper()
+                for method in view_class.http_method_names
+                if hasattr(view_class, method) and method != "options"
+            }
+        yield route, pattern.name, view_class, methods
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class RouteBenchmark:
+    def __init__(self, iterations=50, warmup=5, host="localhost"):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.host = host
+
+    def setup(self):
+        self.user = User.objects.create_user(
+            username=f"bench-{time.time_ns()}",
+            email=f"bench-{time.time_ns()}@example.com",
+            password=BENCH_PASSWORD,
+            is_staff=True,
+            is_superuser=True,
+        )
+        self.refresh = RefreshToken.for_user(self.user)
+        self.client = Client(
+            HTTP_HOST=self.host,
+            HTTP_AUTHORIZATION=f"Bearer {self.refresh.access_token}",
+        )
+        self.product = (
+            Product.objects.filter(is_active=True, quantity__gt=0).order_by("-pk").first()
+        )
+
+    def fill(self, route, view_class):
+        model = getattr(getattr(view_class, "queryset", None), "model", None)
+
+        def value(match):
+            name = match.group(1)
+            if model is None:
+                return "0"
+            if name == "slug":
+                return model.objects.exclude(slug=None).order_by("-pk").values_list(
+                    "slug", flat=True
+                ).first() or "missing"
+            return str(model.objects.order_by("-pk").values_list("pk", flat=True).first() or 0)
+
+        return _PARAM_RE.sub(value, route)
+
+    def payload(self, name, view_class):
+        if name.endswith("-bulk"):
+            # A one-row upsert that rewrites the newest row as it is.
+            serializer_class = view_class.bulk_serializer_class
+            instance = serializer_class.Meta.model.objects.order_by("-pk").first()
+            if instance is None:
+                return None
+            return [serializer_class(instance).data]
+        if name == "checkout":
+            if self.product is None:
+                return None
+            return {
+                "items": [{"product": self.product.pk, "quantity": 1}],
+                "shipping_address": {
+                    "full_address": "House 1, Road 1",
+                    "city": "Dhaka",
+                    "zip_code": "1200",
+                },
+            }
+        if name == "token_obtain_pair":
+            return {"email": self.user.email, "password": BENCH_PASSWORD}
+        if name == "token_refresh":
+            return {"refresh": str(self.refresh)}
+        return None
+
+    def request(self, method, url, params):
+        if method == "GET":
+            response = self.client.get(url, params)
+        else:
+            # Keep the rows (and stock) a POST would change as they were.
+            with transaction.atomic():
+                response = self.client.post(url, params, content_type="application/json")
+                transaction.set_rollback(True)
+        if response.streaming:
+            # Exports do their work while the body is read.
+            return response, b"".join(response.streaming_content)
+        return response, response.content
+
+    def measure(self, method, url, params):
+        started = time.perf_counter()
+        response, body = self.request(method, url, params)
+        first_ms = (time.perf_counter() - started) * 1000
+
+        for _ in range(self.warmup):
+            self.request(method, url, params)
+
+        timings = []
+        for _ in range(self.iterations):
+            started = time.perf_counter()
+            self.request(method, url, params)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        # Query counting and tracemalloc slow requests down, so they get a
+        # pass of their own.
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                self.request(method, url, params)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        result = {
+            "status": response.status_code,
+            "bytes": len(body),
+            "first_ms": round(first_ms, 3),
+            "mean_ms": round(sum(timings) / len(timings), 3),
+            "max_ms": round(max(timings), 3),
+            "queries": len(queries.captured_queries),
+            "peak_kib": round(peak / 1024, 1),
+        }
+        for pct in PERCENTILES:
+            result[f"p{pct}_ms"] = round(percentile(timings, pct), 3)
+        return result
+
+    def run(self, only=None, log=None):
+        results = {}
+        with transaction.atomic():
+            self.setup()
+            for route, name, view_class, methods in discover_routes():
+                if only and not any(part in route for part in only):
+                    continue
+                url = self.fill(route, view_class)
+                if "GET" in methods:
+                    method, params = "GET", ROUTE_PARAMS.get(name, {})
+                else:
+                    method, params = "POST", self.payload(name, view_class)
+                    if params is None:
+                        continue
+                key = f"{method} {route}"
+                results[key] = self.measure(method, url, params)
+                if log:
+                    row = results[key]
+                    log(
+                        f"{key:<45} {row['status']}  p50 {row['p50_ms']:>8.2f} ms  "
+                        f"p99 {row['p99_ms']:>8.2f} ms  {row['queries']:>3} queries  "
+                        f"{row['peak_kib']:>8.1f} KiB"
+                    )
+            transaction.set_rollback(True)
+        return {"meta": self.meta(), "routes": results}
+
+    def meta(self):
+        return {
+            "revision": git_revision(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "iterations": self.iterations,
+            "warmup": self.warmup,
+            "rows": {
+                model._meta.model_name: model.objects.count()
+                for model in (Category, SubCategory, Product, Order)
+            },
+        }
+
+
+def compare_reports(baseline, current):
+    """
+    Yield `(route, metric, before, after)` for the headline numbers of every
+    route present in both reports.
+    """
+    for route, row in current["routes"].items():
+        before = baseline["routes"].get(route)
+        if before is None:
+            continue
+        for metric in ("p50_ms", "p99_ms", "queries", "peak_kib"):
+            yield route, metric, before.get(metric), row.get(metric)
+
+
+def write_report(report, path):
+    with open(path, "w") as fh:
+        json.dump(report, fh, indent=2, sort_keys=True)
+        fh.write("\n")
+
+
+# Requests per second, WSGI against ASGI
+
+
+def wsgi_get(application, path, query="", host="localhost"):
+    """GET `path` from a WSGI application; return `(status, body)`."""
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "SCRIPT_NAME": "",
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "SERVER_NAME": host,
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "HTTP_HOST": host,
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": BytesIO(),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    started = []
+    result = application(environ, lambda status, headers, exc_info=None: started.append(status))
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return int(started[0].split()[0]), body
+
+
+async def asgi_get(application, path, query="", host="localhost"):
+    """GET `path` from an ASGI application; return `(status, body)`."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(b"host", host.encode())],
+        "client": ("127.0.0.1", 0),
+        "server": (host, 80),
+    }
+    received = []
+    messages = []
+
+    async def receive():
+        if received:
+            # The client stays connected until the handler is done with it.
+            await asyncio.Future()
+        received.append(True)
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    status = next(m["status"] for m in messages if m["type"] == "http.response.start")
+    body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+    return status, body
+
+
+def http_get(base_url, path, query=""):
+    """GET `path` from a running server at `base_url`; return `(status, body)`."""
+    url = base_url.rstrip("/") + path + (f"?{query}" if query else "")
+    try:
+        with urlopen(url) as response:
+            return response.status, response.read()
+    except HTTPError as exc:
+        return exc.code, exc.read()
+
+
+class ThroughputBenchmark:
+    """
+    Requests per second for the async catalog routes (api/async_urls.py),
+    served once through the WSGI application and once through the ASGI one,
+    `concurrency` requests in flight at a time. In-process by default, which
+    measures the handlers alone; pass `wsgi_url` / `asgi_url` to load real
+    servers instead (e.g. gunicorn and uvicorn on the same database).
+    """
+
+    def __init__(self, requests=200, concurrency=8, host="localhost", wsgi_url=None, asgi_url=None):
+        self.requests = requests
+        self.concurrency = concurrency
+        self.host = host
+        self.wsgi_url = wsgi_url
+        self.asgi_url = asgi_url
+
+    def routes(self):
+        from . import async_urls
+
+        filler = RouteBenchmark()
+        for route, _, view_class, _ in discover_routes(async_urls.urlpatterns):
+            yield route, filler.fill(route, view_class)
+
+    def wsgi_rps(self, path):
+        if self.wsgi_url:
+            get = lambda: http_get(self.wsgi_url, path)
+        else:
+            from mistrytech.wsgi import application
+
+            get = lambda: wsgi_get(application, path, host=self.host)
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            started = time.perf_counter()
+            statuses = list(pool.map(lambda _: get()[0], range(self.requests)))
+            elapsed = time.perf_counter() - started
+        return self.requests / elapsed, statuses
+
+    def asgi_rps(self, path):
+        if self.asgi_url:
+            with ThreadPoolExecutor(self.concurrency) as pool:
+                started = time.perf_counter()
+                statuses = list(
+                    pool.map(lambda _: http_get(self.asgi_url, path)[0], range(self.requests))
+                )
+                return self.requests / (time.perf_counter() - started), statuses
+
+        from mistrytech.asgi import application
+
+        async def run():
+            slots = asyncio.Semaphore(self.concurrency)
+
+            async def one():
+                async with slots:
+                    status, _ = await asgi_get(application, path, host=self.host)
+                    return status
+
+            started = time.perf_counter()
+            statuses = await asyncio.gather(*(one() for _ in range(self.requests)))
+            return self.requests / (time.perf_counter() - started), statuses
+
+        return asyncio.run(run())
+
+    def run(self, log=None):
+        results = {}
+        for route, path in self.routes():
+            wsgi, wsgi_statuses = self.wsgi_rps(path)
+            asgi, asgi_statuses = self.asgi_rps(path)
+            results[route] = {
+                "path": path,
+                "wsgi_rps": round(wsgi, 1),
+                "asgi_rps": round(asgi, 1),
+                "ratio": round(asgi / wsgi, 3),
+                "statuses": sorted(set(wsgi_statuses) | set(asgi_statuses)),
+            }
+            if log:
+                row = results[route]
+                log(
+                    f"{route:<35} wsgi {row['wsgi_rps']:>8.1f} req/s  "
+                    f"asgi {row['asgi_rps']:>8.1f} req/s  x{row['ratio']:.2f}"
+                )
+        return {
+            "meta": {
+                "revision": git_revision(),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "requests": self.requests,
+                "concurrency": self.concurrency,
+                "wsgi": self.wsgi_url or "in-process",
+                "asgi": self.asgi_url or "in-process",
+            },
+            "routes": results,
+        }
@@ -0,0 +1,319 @@
+"""
+Bulk writes for catalog syncs.
+
+    POST   /api/<resource>/bulk/   [{...}, ...]   create or update each row
+    DELETE /api/<resource>/bulk/   [key, ...]     delete the rows with these keys
+
+Rows are matched on the viewset's `bulk_lookup_field`: a natural key such as
+the product slug upserts (unknown keys are created), the primary key only
+updates (rows without one are created). Every row is validated by the
+viewset's `bulk_serializer_class`; valid rows are then written
+`bulk_chunk_size` at a time with `bulk_create` / `bulk_update`, one
+transaction per chunk. The response reports what happened to each row, by
+its index in the request.
+
+Since bulk writes skip `Model.save()`, the written rows are announced through
+`catalog_bulk_changed` (and new image files queued for derivatives). Stock
+goes through the inventory ledger: the quantity of a new row is recorded as
+its opening stock, a new quantity for an existing row as an adjustment.
+"""
+
+from collections import defaultdict
+
+from django.db import DatabaseError, connections, router, transaction
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .derivatives import IMAGE_FIELDS, pending as pending_derivatives
+from .inventory import STOCK_FIELDS, record_opening_stock, set_stock_levels
+from .nplusone import allow_repeated_queries
+from .signals import catalog_bulk_changed
+
+
+class BulkRowSerializer(serializers.ModelSerializer):
+    """
+    One row of a bulk write. Foreign keys are taken as raw ids and checked for
+    a whole chunk at once by BulkMixin, instead of one query per row.
+    """
+
+    def build_relational_field(self, field_name, relation_info):
+        model_field = relation_info.model_field
+        if relation_info.to_many or model_field is None:
+            return super().build_relational_field(field_name, relation_info)
+        kwargs = {"source": model_field.attname, "required": False}
+        if model_field.null:
+            kwargs["allow_null"] = True
+        return serializers.IntegerField, kwargs
+
+
+def fill_pks(model, objs, fields):
+    """
+    Set the primary keys of `objs`, just inserted with `bulk_create`, on
+    MySQL, whose INSERT returns none. Auto-increment values need not be
+    consecutive (interleaved lock mode, `auto_increment_increment`), so the
+    rows from LAST_INSERT_ID(), the first of them, on are read back and
+    matched to `objs` on `fields`. Objects equal in all of `fields` are
+    interchangeable.
+    """
+    if not objs or objs[0].pk is not None:
+        return
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor != "mysql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT LAST_INSERT_ID()")
+        first = cursor.fetchone()[0]
+    fields = [model._meta.get_field(name) for name in fields]
+
+    def key(values):
+        return tuple(field.get_prep_value(value) for field, value in zip(fields, values))
+
+    unmatched = defaultdict(list)
+    for obj in objs:
+        unmatched[key(getattr(obj, field.attname) for field in fields)].append(obj)
+    rows = (
+        model._default_manager.using(connection.alias)
+        .filter(pk__gte=first)
+        .order_by("pk")
+        .values_list("pk", *(field.attname for field in fields))
+    )
+    for pk, *values in rows:
+        matches = unmatched.get(key(values))
+        if matches:
+            matches.pop(0).pk = pk
+
+
+class BulkRow:
+    def __init__(self, index, data):
+        self.index = index
+        self.data = data
+        self.key = None
+        self.instance = None
+        self.validated = None
+        self.status = None
+        self.errors = None
+
+    def fail(self, errors):
+        self.status = "error"
+        self.errors = errors
+
+    def report(self, lookup):
+        result = {"index": self.index, "status": self.status}
+        if self.instance is not None and self.instance.pk is not None:
+            result["id"] = self.instance.pk
+        if lookup != "id" and self.key is not None:
+            result[lookup] = self.key
+        if self.errors:
+            result["errors"] = self.errors
+        return result
+
+
+class BulkMixin:
+    bulk_serializer_class = None
+    bulk_lookup_field = "id"
+    bulk_chunk_size = 500
+    bulk_max_rows = 5000
+
+    @action(detail=False, methods=["post", "delete"], url_path="bulk")
+    def bulk(self, request):
+        if request.method == "POST":
+            # Upserts change rows as well as add them.
+            opts = self.bulk_serializer_class.Meta.model._meta
+            if not request.user.has_perm(f"{opts.app_label}.change_{opts.model_name}"):
+                self.permission_denied(request)
+
+        data = request.data
+        if not isinstance(data, list):
+            raise ValidationError({"non_field_errors": ["Expected a list."]})
+        if len(data) > self.bulk_max_rows:
+            raise ValidationError(
+                {"non_field_errors": [f"At most {self.bulk_max_rows} rows per request."]}
+            )
+
+        rows = [BulkRow(index, item) for index, item in enumerate(data)]
+        seen = set()
+        # The same few queries run once per chunk, by design.
+        with allow_repeated_queries():
+            for start in range(0, len(rows), self.bulk_chunk_size):
+                chunk = rows[start : start + self.bulk_chunk_size]
+                if request.method == "POST":
+                    self.bulk_write(chunk, seen)
+                else:
+                    self.bulk_delete(chunk)
+
+        lookup = self.bulk_lookup_field
+        summary = defaultdict(int)
+        for row in rows:
+            summary[row.status] += 1
+        return Response(
+            {
+                **{name: summary[name] for name in ("created", "updated", "deleted", "error")},
+                "results": [row.report(lookup) for row in rows],
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    def get_bulk_key(self, row):
+        return row.get(self.bulk_lookup_field)
+
+    def is_bulk_upsert(self, model):
+        return self.bulk_lookup_field not in ("pk", model._meta.pk.name)
+
+    def get_bulk_existing(self, model, keys):
+        existing = defaultdict(list)
+        lookup = self.bulk_lookup_field
+        for instance in model._default_manager.filter(**{f"{lookup}__in": keys}):
+            existing[getattr(instance, lookup)].append(instance)
+        return existing
+
+    def resolve_bulk_keys(self, chunk, key_field, seen):
+        for row in chunk:
+            if not isinstance(row.data, dict):
+                row.fail({"non_field_errors": ["Expected an object."]})
+                continue
+            key = self.get_bulk_key(row.data)
+            if key in (None, ""):
+                continue
+            try:
+                row.key = key_field.to_internal_value(key)
+            except ValidationError as exc:
+                row.fail({self.bulk_lookup_field: exc.detail})
+                continue
+            if row.key in seen:
+                row.fail({self.bulk_lookup_field: ["Appears more than once in this request."]})
+            seen.add(row.key)
+
+    def bulk_write(self, chunk, seen):
+        serializer_class = self.bulk_serializer_class
+        model = serializer_class.Meta.model
+        lookup = self.bulk_lookup_field
+        context = self.get_serializer_context()
+        self.resolve_bulk_keys(chunk, serializer_class(context=context).fields[lookup], seen)
+
+        keyed = [row for row in chunk if row.status is None and row.key is not None]
+        existing = self.get_bulk_existing(model, [row.key for row in keyed])
+        for row in chunk:
+            if row.status is not None:
+                continue
+            matches = existing.get(row.key, []) if row.key is not None else []
+            if len(matches) > 1:
+                row.fail({lookup: [f"Matches {len(matches)} rows."]})
+                continue
+            if not matches and row.key is not None and not self.is_bulk_upsert(model):
+                row.fail({lookup: ["Not found."]})
+                continue
+            row.instance = matches[0] if matches else None
+            serializer = serializer_class(
+                data=row.data, partial=row.instance is not None, context=context
+            )
+            if not serializer.is_valid():
+                row.fail(serializer.errors)
+                continue
+            row.validated = serializer.validated_data
+            if row.instance is not None:
+                row.validated.pop(lookup, None)
+            elif row.key is not None:
+                row.validated.setdefault(lookup, row.key)
+
+        valid = [row for row in chunk if row.status is None]
+        self.check_bulk_references(model, valid)
+        valid = [row for row in chunk if row.status is None]
+        if not valid:
+            return
+
+        created = [row for row in valid if row.instance is None]
+        updated = [row for row in valid if row.instance is not None]
+        try:
+            with transaction.atomic(using=router.db_for_write(model)):
+                for row in created:
+                    row.instance = model(**row.validated)
+                objs = [row.instance for row in created]
+                model._default_manager.bulk_create(objs)
+                fill_pks(model, objs, {name for row in created for name in row.validated})
+                stocked = model in STOCK_FIELDS
+                if stocked:
+                    record_opening_stock(objs, user=self.request.user)
+
+                now = timezone.now()
+                groups = defaultdict(list)
+                levels = {}
+                for row in updated:
+                    if stocked and "quantity" in row.validated:
+                        levels[row.instance.pk] = row.validated.pop("quantity")
+                    for name, value in row.validated.items():
+                        setattr(row.instance, name, value)
+                    row.instance.updated_at = now
+                    groups[tuple(sorted(row.validated))].append(row.instance)
+                for fields, objs in groups.items():
+                    model._default_manager.bulk_update(objs, [*fields, "updated_at"])
+                if levels:
+                    set_stock_levels(model, levels, user=self.request.user)
+
+                pks = [row.instance.pk for row in valid]
+                catalog_bulk_changed.send(sender=model, pks=pks)
+                if model in IMAGE_FIELDS:
+                    pending_derivatives[model].add(
+                        row.instance.pk for row in valid if IMAGE_FIELDS[model] in row.validated
+                    )
+        except DatabaseError as exc:
+            for row in valid:
+                if row in created:
+                    row.instance = None
+                row.fail({"non_field_errors": [str(exc)]})
+            return
+        for row in created:
+            row.status = "created"
+        for row in updated:
+            row.status = "updated"
+
+    def check_bulk_references(self, model, rows):
+        ids = defaultdict(set)
+        for row in rows:
+            for attname, value in row.validated.items():
+                field = model._meta.get_field(attname)
+                if field.is_relation and value is not None:
+                    ids[field].add(value)
+        for field, values in ids.items():
+            found = set(
+                field.related_model._default_manager.filter(pk__in=values).values_list(
+                    "pk", flat=True
+                )
+            )
+            for row in rows:
+                value = row.validated.get(field.attname)
+                if value is not None and value not in found:
+                    row.fail({field.name: [f'Invalid pk "{value}" - object does not exist.']})
+
+    def bulk_delete(self, chunk):
+        model = self.bulk_serializer_class.Meta.model
+        lookup = self.bulk_lookup_field
+        key_field = self.bulk_serializer_class().fields[lookup]
+        for row in chunk:
+            try:
+                row.key = key_field.to_internal_value(row.data)
+            except ValidationError as exc:
+                row.fail({lookup: exc.detail})
+
+        keyed = [row for row in chunk if row.status is None]
+        existing = self.get_bulk_existing(model, [row.key for row in keyed])
+        for row in keyed:
+            if row.key not in existing:
+                row.fail({lookup: ["Not found."]})
+        doomed = [row for row in keyed if row.status is None]
+        if not doomed:
+            return
+        pks = [instance.pk for row in doomed for instance in existing[row.key]]
+        try:
+            with transaction.atomic(using=router.db_for_write(model)):
+                # delete() sends pre/post_delete for every row itself.
+                model._default_manager.filter(pk__in=pks).delete()
+        except DatabaseError as exc:
+            for row in doomed:
+                row.fail({"non_field_errors": [str(exc)]})
+            return
+        for row in doomed:
+            row.instance = existing[row.key][0]
+            row.status = "deleted"
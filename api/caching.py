@@ -0,0 +1,220 @@
+"""
+Response cache for the read-only catalog views.
+
+Entries are keyed by the absolute URL (query parameters sorted) plus the
+current version of every tag the view depends on. Saving or deleting a tagged
+model moves its tag to a new version once the write commits, so stale entries
+are never looked up again and simply age out of the LRU-bounded cache.
+
+A response read from a replica may predate writes the primary has already
+committed. It is not cached until the newest of its tags is older than the
+lag a replica is allowed, so the replica's stale copy can't be stored under
+the new version.
+"""
+
+import hashlib
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+
+from .deferred import CommitBatch
+
+from .models import (
+    Category,
+    CategorySnapshot,
+    Discount,
+    Image,
+    Product,
+    SubCategory,
+    Variant,
+)
+from .routers import replica_settle_seconds
+from .signals import catalog_bulk_changed
+
+TAGGED_MODELS = (
+    Category,
+    CategorySnapshot,
+    Discount,
+    Image,
+    Product,
+    SubCategory,
+    Variant,
+)
+
+_stats = defaultdict(Counter)
+_stats_lock = threading.Lock()
+
+
+def get_config():
+    return getattr(settings, "API_RESPONSE_CACHE", {})
+
+
+def get_cache():
+    return caches[get_config().get("ALIAS", "default")]
+
+
+def get_cache_stats():
+    with _stats_lock:
+        return {name: dict(counter) for name, counter in _stats.items()}
+
+
+def _record(name, outcome):
+    with _stats_lock:
+        _stats[name][outcome] += 1
+
+
+def _tag_key(tag):
+    return f"api:tag:{tag}"
+
+
+def _missing_tag_versions(keys, versions):
+    # Evicted tags restart from the clock, never from an old version.
+    return {key: time.time_ns() for key in keys if key not in versions}
+
+
+def get_tag_versions(tags, cache=None):
+    cache = cache or get_cache()
+    keys = [_tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = _missing_tag_versions(keys, versions)
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+async def aget_tag_versions(tags, cache=None):
+    cache = cache or get_cache()
+    keys = [_tag_key(tag) for tag in tags]
+    if not keys:
+        return []
+    versions = await cache.aget_many(keys)
+    missing = _missing_tag_versions(keys, versions)
+    if missing:
+        await cache.aset_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def invalidate_tags(*tags):
+    cache = get_cache()
+    cache.set_many({_tag_key(tag): time.time_ns() for tag in tags}, timeout=None)
+
+
+def _response_key(request, versions):
+    query = sorted(request.GET.lists())
+    raw = f"{request.build_absolute_uri(request.path)}?{query}:{versions}"
+    return "api:response:" + hashlib.md5(raw.encode()).hexdigest()
+
+
+stale_tags = CommitBatch(lambda tags: invalidate_tags(*tags))
+
+
+class CachedResponseMixin:
+    """
+    Cache successful `list`/`retrieve` responses until their TTL expires or
+    one of `cache_tags` is invalidated. TTLs are read per view class from
+    `API_RESPONSE_CACHE["TIMEOUTS"]`.
+    """
+
+    cache_tags = ()
+
+    def get_cache_timeout(self):
+        config = get_config()
+        return config.get("TIMEOUTS", {}).get(
+            type(self).__name__, config.get("DEFAULT_TIMEOUT", 300)
+        )
+
+    def should_cache(self, versions):
+        """
+        Whether a response built after reading tag `versions` may be cached.
+        """
+        settle = replica_settle_seconds()
+        if not settle or not versions:
+            return True
+        return time.time_ns() - max(versions) >= settle * 1_000_000_000
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.acached_response(super().alist, request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.acached_response(super().aretrieve, request, *args, **kwargs)
+
+    def hit(self, content):
+        _record(type(self).__name__, "hits")
+        response = HttpResponse(content, content_type="application/json")
+        response["X-Cache"] = "HIT"
+        return response
+
+    def miss(self, response):
+        """
+        Return `(response, content to cache or None)` for a freshly built
+        response.
+        """
+        _record(type(self).__name__, "misses")
+        content = None
+        if response.status_code == 200:
+            if hasattr(response, "data"):
+                content = JSONRenderer().render(response.data)
+                response = HttpResponse(content, content_type="application/json")
+            else:
+                content = response.content
+        response["X-Cache"] = "MISS"
+        return response, content
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        cache = get_cache()
+        versions = get_tag_versions(self.cache_tags, cache)
+        key = _response_key(request, versions)
+        content = cache.get(key)
+        if content is not None:
+            return self.hit(content)
+        response, content = self.miss(handler(request, *args, **kwargs))
+        if content is not None and self.should_cache(versions):
+            cache.set(key, content, self.get_cache_timeout())
+        return response
+
+    async def acached_response(self, handler, request, *args, **kwargs):
+        cache = get_cache()
+        versions = await aget_tag_versions(self.cache_tags, cache)
+        key = _response_key(request, versions)
+        content = await cache.aget(key)
+        if content is not None:
+            return self.hit(content)
+        response, content = self.miss(await handler(request, *args, **kwargs))
+        if content is not None and self.should_cache(versions):
+            await cache.aset(key, content, self.get_cache_timeout())
+        return response
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_model_tag(sender, raw=False, **kwargs):
+    if not raw and sender in TAGGED_MODELS:
+        stale_tags.add([sender._meta.model_name])
+
+
+@receiver(catalog_bulk_changed)
+def invalidate_bulk_tag(sender, **kwargs):
+    if sender in TAGGED_MODELS:
+        stale_tags.add([sender._meta.model_name])
+
+
+@receiver(m2m_changed, sender=Product.category.through)
+@receiver(m2m_changed, sender=Product.subcategory.through)
+def invalidate_membership_tags(sender, action, **kwargs):
+    if action.startswith("post_"):
+        stale_tags.add(["product", "category", "subcategory"])
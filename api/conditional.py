@@ -0,0 +1,240 @@
+"""
+Conditional GET for catalog resources.
+
+Validators are computed before anything is serialized, from the database
+alone, so every process and every restart agrees on them:
+
+    detail          the row's `updated_at`
+    cursor page     the ids and `updated_at` of the rows on the page (and the
+                    total, when the client asked for `?count=true`)
+    unpaged list    `max(updated_at)` and the row count of the list
+
+plus, for each model nested in the response, `max(updated_at)` and the row
+count of its table, which catch nested rows that changed or went without
+touching the parent. Adding a row to or removing it from a category or
+subcategory touches both sides (see `touch_membership`). The nested values
+ride along as scalar subqueries of the root query.
+
+Every method has an `a`-prefixed twin for the async read path.
+"""
+
+import hashlib
+
+from django.db.models import Count, Max, Subquery, Value
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import Product
+from .prefetch import get_nested_models
+
+
+def nested_versions(models):
+    """
+    Scalar subqueries for the newest `updated_at` and the row count of each
+    of `models`, keyed `nested_<n>_updated` / `nested_<n>_count`.
+    """
+    versions = {}
+    for index, model in enumerate(models):
+        rows = model._default_manager.order_by().annotate(one=Value(1)).values("one")
+        versions[f"nested_{index}_updated"] = Subquery(
+            rows.annotate(value=Max("updated_at")).values("value")
+        )
+        versions[f"nested_{index}_count"] = Subquery(
+            rows.annotate(value=Count("pk")).values("value")
+        )
+    return versions
+
+
+class ConditionalGetMixin:
+    def get_nested_versions(self):
+        return nested_versions(get_nested_models(self.get_serializer()))
+
+    def get_validator_queryset(self):
+        """
+        The queryset validators are computed from. Override to leave out
+        what only serialization needs, such as annotations and their joins.
+        """
+        return self.get_queryset()
+
+    def get_root_queryset(self, many):
+        queryset = self.filter_queryset(self.get_validator_queryset())
+        if many:
+            return queryset
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return queryset.order_by().filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+
+    def get_page_rows(self, queryset, nested):
+        """
+        The `(pk, updated_at, *nested)` rows of the requested page as a lazy
+        queryset, or None when the view is not cursor paginated.
+        """
+        if self.pagination_class is None:
+            return None
+        paginator = self.pagination_class()
+        if not hasattr(paginator, "get_page_queryset"):
+            return None
+        rows = queryset.annotate(**nested).values_list("pk", "updated_at", *nested)
+        page = paginator.get_page_queryset(rows, self.request, view=self)
+        if page is None:
+            return None
+        wants_count = getattr(paginator, "wants_count", lambda request: False)
+        return page, wants_count(self.request)
+
+    def get_root_validators(self, many):
+        """
+        Return `(last_modified, extra)` for the rows the response is built
+        from, or None when there is nothing to describe (e.g. a 404).
+        """
+        queryset = self.get_root_queryset(many)
+        nested = self.get_nested_versions()
+        if not many:
+            row = queryset.annotate(**nested).values_list("updated_at", *nested).first()
+            return None if row is None else self.describe_rows([row], None)
+        page = self.get_page_rows(queryset, nested)
+        if page is None:
+            return self.describe_totals(self.aggregate_list(queryset, nested))
+        rows, wants_count = page
+        rows = list(rows)
+        return self.describe_rows(rows, queryset.count() if wants_count else None, pks=True)
+
+    async def aget_root_validators(self, many):
+        queryset = self.get_root_queryset(many)
+        nested = self.get_nested_versions()
+        if not many:
+            row = await queryset.annotate(**nested).values_list("updated_at", *nested).afirst()
+            return None if row is None else self.describe_rows([row], None)
+        page = self.get_page_rows(queryset, nested)
+        if page is None:
+            return self.describe_totals(await self.aaggregate_list(queryset, nested))
+        rows, wants_count = page
+        rows = [row async for row in rows]
+        count = await queryset.acount() if wants_count else None
+        return self.describe_rows(rows, count, pks=True)
+
+    def list_aggregates(self, nested):
+        return {
+            "last_modified": Max("updated_at"),
+            "count": Count("pk"),
+            **{name: Max(version) for name, version in nested.items()},
+        }
+
+    def aggregate_list(self, queryset, nested):
+        return queryset.order_by().values("pk").aggregate(**self.list_aggregates(nested))
+
+    async def aaggregate_list(self, queryset, nested):
+        return await queryset.order_by().values("pk").aaggregate(
+            **self.list_aggregates(nested)
+        )
+
+    def describe_rows(self, rows, count, pks=False):
+        # Rows are (pk, updated_at, *nested) with `pks`, else (updated_at, *nested).
+        if pks:
+            ids = [row[0] for row in rows]
+            rows = [row[1:] for row in rows]
+        else:
+            ids = None
+        nested = rows[0][1:] if rows else ()
+        timestamps = [row[0] for row in rows] + list(nested[::2])
+        return self.newest(timestamps), (ids, count, nested)
+
+    def describe_totals(self, totals):
+        last_modified, count = totals.pop("last_modified"), totals.pop("count")
+        nested = tuple(totals.values())
+        return self.newest([last_modified, *nested[::2]]), (count, nested)
+
+    def newest(self, timestamps):
+        return max((moment for moment in timestamps if moment is not None), default=None)
+
+    def make_validators(self, root):
+        if root is None:
+            return None, None
+        last_modified, extra = root
+        raw = f"{self.request.get_full_path()}|{last_modified}|{extra}"
+        etag = '"%s"' % hashlib.md5(raw.encode()).hexdigest()
+        if last_modified is None:
+            return etag, int(timezone.now().timestamp())
+        return etag, int(last_modified.timestamp())
+
+    def get_validators(self, many):
+        return self.make_validators(self.get_root_validators(many))
+
+    async def aget_validators(self, many):
+        return self.make_validators(await self.aget_root_validators(many))
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, True, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, False, request, *args, **kwargs
+        )
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.aconditional_response(
+            super().alist, True, request, *args, **kwargs
+        )
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.aconditional_response(
+            super().aretrieve, False, request, *args, **kwargs
+        )
+
+    def not_modified(self, request, etag, last_modified):
+        """
+        The 304/412 response for these validators, or None if the handler
+        has to run.
+        """
+        headers = HttpResponse()
+        headers["ETag"] = etag
+        headers["Last-Modified"] = http_date(last_modified)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified, response=headers
+        )
+        return None if response is headers else response
+
+    def add_validators(self, response, etag, last_modified):
+        if response.status_code == 200:
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+        return response
+
+    def conditional_response(self, handler, many, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(many)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+        not_modified = self.not_modified(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        response = handler(request, *args, **kwargs)
+        return self.add_validators(response, etag, last_modified)
+
+    async def aconditional_response(self, handler, many, request, *args, **kwargs):
+        etag, last_modified = await self.aget_validators(many)
+        if etag is None:
+            return await handler(request, *args, **kwargs)
+        not_modified = self.not_modified(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        response = await handler(request, *args, **kwargs)
+        return self.add_validators(response, etag, last_modified)
+
+
+@receiver(m2m_changed, sender=Product.category.through)
+@receiver(m2m_changed, sender=Product.subcategory.through)
+def touch_membership(sender, instance, action, model, pk_set, **kwargs):
+    """
+    Bump `updated_at` on both sides of a membership change, which the
+    validators of either side would otherwise miss.
+    """
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    now = timezone.now()
+    type(instance)._default_manager.filter(pk=instance.pk).update(updated_at=now)
+    if pk_set:
+        model._default_manager.filter(pk__in=pk_set).update(updated_at=now)
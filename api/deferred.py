@@ -0,0 +1,29 @@
+import threading
+
+from django.db import transaction
+
+
+class CommitBatch:
+    """
+    Collect keys marked during a transaction and hand them to `callback`
+    once, after commit. Outside a transaction the callback runs right away.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.local = threading.local()
+
+    def add(self, keys):
+        keys = {key for key in keys if key is not None}
+        if not keys:
+            return
+        if getattr(self.local, "keys", None) is None:
+            self.local.keys = set()
+        self.local.keys.update(keys)
+        transaction.on_commit(self.flush)
+
+    def flush(self):
+        keys = getattr(self.local, "keys", None)
+        self.local.keys = set()
+        if keys:
+            self.callback(sorted(keys))
@@ -0,0 +1,175 @@
+"""
+Thumbnails and WebP/AVIF copies of uploaded images.
+
+Saving an Image, Variant or SubCategory with a new file schedules its
+derivatives after commit. Rendering happens in a process pool (see
+api/imaging.py) rather than in the upload request; the result is written to
+the row's `derivatives` with a queryset update and announced through
+`catalog_bulk_changed`, so cached responses and snapshots pick it up.
+"""
+
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+from django.conf import settings
+from django.db import connections
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .deferred import CommitBatch
+from .imaging import render_derivatives
+from .models import Image, SubCategory, Variant
+from .signals import catalog_bulk_changed
+
+logger = logging.getLogger(__name__)
+
+# Model -> name of its image field.
+IMAGE_FIELDS = {Image: "image", Variant: "image", SubCategory: "bannerImage"}
+
+DEFAULTS = {
+    "SIZES": [160, 320, 640, 1280],
+    "FORMATS": ["jpeg", "webp", "avif"],
+    "QUALITY": 80,
+    "WORKERS": 2,
+    # Render in the calling thread instead of the pool (tests, scripts).
+    "INLINE": False,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "IMAGE_DERIVATIVES", {})}
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned, not forked: forking a threaded server copies its locks
+            # and open connections into the worker.
+            _executor = ProcessPoolExecutor(
+                max_workers=get_config()["WORKERS"],
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    return _executor
+
+
+def is_current(instance):
+    field = getattr(instance, IMAGE_FIELDS[type(instance)])
+    return not field or (instance.derivatives or {}).get("source") == field.name
+
+
+def store_derivatives(model, pk, name, result):
+    result = dict(result, source=name)
+    # Only if the row still points at the file that was rendered.
+    updated = model._default_manager.filter(
+        pk=pk, **{IMAGE_FIELDS[model]: name}
+    ).update(derivatives=result)
+    if updated:
+        catalog_bulk_changed.send(sender=model, pks=[pk])
+
+
+def _store_when_done(model, pk, name, submitter, future):
+    try:
+        result = future.result()
+    except Exception:
+        logger.exception("Rendering derivatives of %s #%s failed", model.__name__, pk)
+        return
+    try:
+        store_derivatives(model, pk, name, result)
+    finally:
+        # Done callbacks normally run on the pool's management thread, whose
+        # connection would otherwise stay open.
+        if threading.current_thread() is not submitter:
+            connections.close_all()
+
+
+def build_derivatives(model, pks, force=False, wait=False):
+    """
+    Render derivatives for the `model` rows in `pks` whose file has none yet
+    (all of them with `force`). With `wait` (or INLINE) results are stored
+    before returning; otherwise they are stored as the pool finishes them.
+    Returns the number of images submitted.
+    """
+    config = get_config()
+    field = model._meta.get_field(IMAGE_FIELDS[model])
+    options = {
+        "sizes": config["SIZES"],
+        "formats": config["FORMATS"],
+        "quality": config["QUALITY"],
+    }
+    jobs = []
+    for instance in model._default_manager.filter(pk__in=pks).only(
+        "pk", field.name, "derivatives"
+    ):
+        file = getattr(instance, field.name)
+        if not file or (is_current(instance) and not force):
+            continue
+        if not field.storage.exists(file.name):
+            logger.warning("%s #%s: %s is missing", model.__name__, instance.pk, file.name)
+            continue
+        try:
+            path = field.storage.path(file.name)
+        except NotImplementedError:
+            logger.warning("Derivatives need a local file storage, skipping %s", file.name)
+            continue
+        jobs.append((instance.pk, file.name, (path, field.storage.location)))
+
+    if config["INLINE"]:
+        for pk, name, args in jobs:
+            try:
+                result = render_derivatives(*args, **options)
+            except Exception:
+                logger.exception("Rendering derivatives of %s #%s failed", model.__name__, pk)
+                continue
+            store_derivatives(model, pk, name, result)
+        return len(jobs)
+
+    executor = get_executor()
+    futures = {}
+    for pk, name, args in jobs:
+        future = executor.submit(render_derivatives, *args, **options)
+        if wait:
+            futures[future] = (pk, name)
+        else:
+            future.add_done_callback(
+                partial(_store_when_done, model, pk, name, threading.current_thread())
+            )
+    for future in as_completed(futures):
+        pk, name = futures[future]
+        _store_when_done(model, pk, name, threading.current_thread(), future)
+    return len(jobs)
+
+
+def thumbnail_url(file, derivatives, width):
+    """
+    URL of the smallest derivative at least `width` pixels wide (the largest
+    one if none is), falling back to the original file.
+    """
+    files = (derivatives or {}).get("files", {})
+    for name in ("webp", "jpeg"):
+        if files.get(name):
+            widths = sorted(files[name], key=int)
+            chosen = next((w for w in widths if int(w) >= width), widths[-1])
+            return file.storage.url(files[name][chosen])
+    return file.url if file else None
+
+
+# Scheduling
+
+
+pending = {
+    model: CommitBatch(partial(build_derivatives, model)) for model in IMAGE_FIELDS
+}
+
+
+@receiver(post_save)
+def schedule_derivatives(sender, instance, raw=False, **kwargs):
+    if raw or sender not in IMAGE_FIELDS or is_current(instance):
+        return
+    pending[sender].add({instance.pk})
@@ -0,0 +1,414 @@
+"""
+Faceted filtering for product listings.
+
+A product's filter attributes are precomputed into a FacetDocument and
+refreshed from save signals, like the search index. They are its categories
+and subcategories, the colors and sizes of its active variants, whether it or
+one of those variants is in stock, and its price and discount. Every process
+keeps the documents in memory as posting lists: for each facet value, the set
+of ids of the products that have it. Sizes and prices are also kept sorted,
+for ranges.
+
+    ?category=3,4&color=red&min_size=8&max_size=10&in_stock=true
+
+is answered by intersecting posting lists. Values of one facet are OR-ed and
+facets are AND-ed. Facets describe the product, not one variant: a product
+with a red variant and a size 10 one matches the example above.
+
+`facet_counts()` counts each facet's values over the products matching the
+rest of the selection, so every alternative shows how many products picking
+it would give.
+
+The in-memory index reads the documents written since its last refresh, at
+most every `REFRESH_INTERVAL` seconds, so filters may lag writes by that
+much. Each refresh re-reads the last `SETTLE` to pick up transactions that
+committed late.
+"""
+
+import bisect
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import connections, router
+from django.db.models import Prefetch
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .deferred import CommitBatch
+from .models import Category, Discount, FacetDocument, Product, SubCategory, Variant
+from .signals import catalog_bulk_changed
+
+FACETS = ("category", "subcategory", "color", "size", "price", "in_stock")
+VALUE_FACETS = ("category", "subcategory", "color", "size")
+INDEX_BATCH_SIZE = 500
+REFRESH_INTERVAL = 5
+SETTLE = timedelta(seconds=60)
+
+
+def product_facets(product):
+    variants = product.variants.all()
+    discount = product.discount
+    if discount is not None and discount.is_active and discount.discount_value is not None:
+        discount = [
+            str(discount.discount_value),
+            discount.start_date and discount.start_date.isoformat(),
+            discount.end_date and discount.end_date.isoformat(),
+        ]
+    else:
+        discount = None
+    return {
+        "category": sorted(category.pk for category in product.category.all()),
+        "subcategory": sorted(subcategory.pk for subcategory in product.subcategory.all()),
+        "color": sorted({variant.color.strip().lower() for variant in variants if variant.color}),
+        "size": sorted({variant.size for variant in variants if variant.size is not None}),
+        "in_stock": (product.quantity or 0) > 0
+        or any((variant.quantity or 0) > 0 for variant in variants),
+        "price": None if product.price is None else str(product.price),
+        "discount": discount,
+    }
+
+
+def _conflict_target():
+    # MySQL's ON DUPLICATE KEY UPDATE takes no conflict target; the only
+    # unique key besides the primary key is the product's.
+    connection = connections[router.db_for_write(FacetDocument)]
+    if connection.features.supports_update_conflicts_with_target:
+        return {"unique_fields": ["product"]}
+    return {}
+
+
+def index_products(product_ids):
+    product_ids = sorted(set(product_ids))
+    for start in range(0, len(product_ids), INDEX_BATCH_SIZE):
+        batch = product_ids[start:start + INDEX_BATCH_SIZE]
+        products = (
+            Product.objects.filter(pk__in=batch)
+            .select_related("discount")
+            .prefetch_related(
+                "category",
+                "subcategory",
+                Prefetch("variants", Variant.objects.filter(is_active=True)),
+            )
+        )
+        data = {product.pk: product_facets(product) for product in products}
+        # Products that are gone keep a document with no data.
+        FacetDocument.objects.bulk_create(
+            [FacetDocument(product_id=pk, data=data.get(pk)) for pk in batch],
+            update_conflicts=True,
+            update_fields=["data", "updated_at"],
+            **_conflict_target(),
+        )
+
+
+class Entry:
+    __slots__ = ("data", "price", "discount")
+
+    def __init__(self, data):
+        self.data = data
+        self.price = None if data["price"] is None else Decimal(data["price"])
+        self.discount = None
+        if data["discount"]:
+            value, start, end = data["discount"]
+            self.discount = (
+                Decimal(value),
+                start and datetime.fromisoformat(start),
+                end and datetime.fromisoformat(end),
+            )
+
+    def price_at(self, at):
+        """The price after discount at `at`, as DiscountedQuerySet computes it."""
+        if self.price is None or self.discount is None:
+            return self.price
+        value, start, end = self.discount
+        if (start is None or start <= at) and (end is None or end >= at):
+            return self.price - self.price * value / Decimal(100)
+        return self.price
+
+
+class SortedValues:
+    """(value, product id) pairs in value order, for range lookups."""
+
+    def __init__(self, pairs):
+        pairs = sorted(pairs)
+        self.values = [value for value, _ in pairs]
+        self.ids = [pk for _, pk in pairs]
+
+    def between(self, low, high):
+        start = 0 if low is None else bisect.bisect_left(self.values, low)
+        end = len(self.values) if high is None else bisect.bisect_right(self.values, high)
+        return set(self.ids[start:end])
+
+
+class FacetIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.entries = {}
+        self.postings = {facet: defaultdict(set) for facet in VALUE_FACETS}
+        self.in_stock = set()
+        self.checked_at = None
+        self.watermark = None
+        self.sizes = None
+        self.prices = None
+        self.prices_until = None
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < REFRESH_INTERVAL:
+            return
+        started = timezone.now()
+        documents = FacetDocument.objects.all()
+        if self.watermark is not None:
+            documents = documents.filter(updated_at__gte=self.watermark - SETTLE)
+        for product_id, data in documents.values_list("product_id", "data").iterator():
+            self.update(product_id, data)
+        self.watermark = started
+        self.checked_at = now
+
+    def update(self, product_id, data):
+        entry = self.entries.get(product_id)
+        if entry is not None and entry.data == data:
+            return
+        if entry is not None:
+            for facet in VALUE_FACETS:
+                for value in entry.data[facet]:
+                    postings = self.postings[facet][value]
+                    postings.discard(product_id)
+                    if not postings:
+                        del self.postings[facet][value]
+            self.in_stock.discard(product_id)
+            del self.entries[product_id]
+        if data is not None:
+            self.entries[product_id] = Entry(data)
+            for facet in VALUE_FACETS:
+                for value in data[facet]:
+                    self.postings[facet][value].add(product_id)
+            if data["in_stock"]:
+                self.in_stock.add(product_id)
+        old = entry.data if entry is not None else {}
+        new = data or {}
+        if old.get("size") != new.get("size"):
+            self.sizes = None
+        if (old.get("price"), old.get("discount")) != (new.get("price"), new.get("discount")):
+            self.prices = None
+
+    def get_sizes(self):
+        if self.sizes is None:
+            self.sizes = SortedValues(
+                (size, pk) for size, pks in self.postings["size"].items() for pk in pks
+            )
+        return self.sizes
+
+    def get_prices(self, at):
+        """Current prices, recomputed when a discount starts or ends."""
+        if self.prices is None or (self.prices_until is not None and at > self.prices_until):
+            boundaries = [
+                moment
+                for entry in self.entries.values()
+                if entry.discount is not None
+                for moment in entry.discount[1:]
+                if moment is not None and moment >= at
+            ]
+            self.prices = SortedValues(
+                (price, pk)
+                for pk, entry in self.entries.items()
+                if (price := entry.price_at(at)) is not None
+            )
+            self.prices_until = min(boundaries, default=None)
+        return self.prices
+
+    def selected_sets(self, selection):
+        """The products matching each selected facet on its own."""
+        sets = {}
+        for facet in ("category", "subcategory", "color"):
+            if facet in selection:
+                postings = self.postings[facet]
+                sets[facet] = set().union(*(postings.get(value, ()) for value in selection[facet]))
+        if "size" in selection:
+            sets["size"] = self.get_sizes().between(*selection["size"])
+        if "price" in selection:
+            sets["price"] = self.get_prices(timezone.now()).between(*selection["price"])
+        if "in_stock" in selection:
+            sets["in_stock"] = (
+                self.in_stock if selection["in_stock"] else set(self.entries) - self.in_stock
+            )
+        return sets
+
+    def intersect(self, sets):
+        """Products in all of `sets`; None (everything) when there are none."""
+        if not sets:
+            return None
+        smallest, *rest = sorted(sets, key=len)
+        return smallest.intersection(*rest)
+
+    def match(self, selection):
+        with self.lock:
+            self.refresh()
+            matches = self.intersect(list(self.selected_sets(selection).values()))
+            return set(self.entries) if matches is None else matches
+
+    def counts(self, selection):
+        with self.lock:
+            self.refresh()
+            sets = self.selected_sets(selection)
+            matches = self.intersect(list(sets.values()))
+            result = {"count": len(self.entries) if matches is None else len(matches)}
+            for facet in FACETS:
+                base = self.intersect([ids for name, ids in sets.items() if name != facet])
+                result[facet] = self.count_facet(facet, base)
+            return result
+
+    def count_facet(self, facet, base):
+        if facet in VALUE_FACETS:
+            counts = [
+                (value, len(ids) if base is None else len(base.intersection(ids)))
+                for value, ids in self.postings[facet].items()
+            ]
+            return [
+                {"value": value, "count": count}
+                for value, count in sorted(counts, key=lambda item: (-item[1], item[0]))
+                if count
+            ]
+        if facet == "in_stock":
+            total = len(self.entries) if base is None else len(base)
+            in_stock = len(self.in_stock) if base is None else len(base & self.in_stock)
+            return {"true": in_stock, "false": total - in_stock}
+        now = timezone.now()
+        if base is None:
+            values = self.get_prices(now).values
+            low, high = (values[0], values[-1]) if values else (None, None)
+        else:
+            prices = [
+                price
+                for pk in base
+                if (price := self.entries[pk].price_at(now)) is not None
+            ]
+            low, high = min(prices, default=None), max(prices, default=None)
+        return {
+            "min": None if low is None else str(round(low, 2)),
+            "max": None if high is None else str(round(high, 2)),
+        }
+
+
+facet_index = FacetIndex()
+
+
+# Query parameters
+
+def _ids(param, value):
+    try:
+        return {int(part) for part in value.split(",") if part.strip()}
+    except ValueError:
+        raise ValidationError({param: ["Enter comma-separated ids."]})
+
+
+def _number(param, value, parse):
+    if not value:
+        return None
+    try:
+        return parse(value)
+    except (InvalidOperation, ValueError):
+        raise ValidationError({param: ["A valid number is required."]})
+
+
+def parse_selection(params, facets=FACETS):
+    """The facet selection in query `params`, limited to `facets`."""
+    selection = {}
+    for facet in ("category", "subcategory"):
+        if facet in facets and params.get(facet):
+            selection[facet] = _ids(facet, params[facet])
+    if "color" in facets and params.get("color"):
+        selection["color"] = {
+            part.strip().lower() for part in params["color"].split(",") if part.strip()
+        }
+    for facet, parse in (("size", float), ("price", Decimal)):
+        if facet not in facets:
+            continue
+        bounds = tuple(
+            _number(param, params.get(param), parse)
+            for param in (f"min_{facet}", f"max_{facet}")
+        )
+        if bounds != (None, None):
+            selection[facet] = bounds
+    if "in_stock" in facets and params.get("in_stock"):
+        value = params["in_stock"].lower()
+        if value not in ("true", "false", "1", "0"):
+            raise ValidationError({"in_stock": ["Must be true or false."]})
+        selection["in_stock"] = value in ("true", "1")
+    return selection
+
+
+def facet_counts(params):
+    return facet_index.counts(parse_selection(params))
+
+
+# Incremental indexing
+
+stale_products = CommitBatch(index_products)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def reindex_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        stale_products.add({instance.pk})
+
+
+@receiver(post_save, sender=Variant)
+@receiver(post_delete, sender=Variant)
+def reindex_variant_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        stale_products.add({instance.product_id})
+
+
+@receiver(post_save, sender=Discount)
+def reindex_discounted_products(sender, instance, raw=False, **kwargs):
+    if not raw:
+        stale_products.add(instance.product.values_list("pk", flat=True))
+
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=SubCategory)
+def reindex_group_products(sender, instance, **kwargs):
+    # Deleting the group drops its membership rows without m2m_changed.
+    if sender is Category:
+        products = instance.products_in_category
+    else:
+        products = instance.products_in_subcategory
+    stale_products.add(products.values_list("pk", flat=True))
+
+
+@receiver(m2m_changed, sender=Product.category.through)
+@receiver(m2m_changed, sender=Product.subcategory.through)
+def reindex_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        stale_products.add({instance.pk})
+    elif action == "pre_clear":
+        if sender is Product.category.through:
+            products = instance.products_in_category
+        else:
+            products = instance.products_in_subcategory
+        stale_products.add(products.values_list("pk", flat=True))
+    else:
+        stale_products.add(pk_set)
+
+
+@receiver(catalog_bulk_changed, sender=Product)
+def reindex_bulk_products(sender, pks, **kwargs):
+    stale_products.add(pks)
+
+
+@receiver(catalog_bulk_changed, sender=Variant)
+def reindex_bulk_variant_products(sender, pks, **kwargs):
+    stale_products.add(
+        Variant.objects.filter(pk__in=pks).values_list("product_id", flat=True)
+    )
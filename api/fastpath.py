@@ -0,0 +1,372 @@
+"""
+Read-only fast path for catalog list endpoints.
+
+DRF renders each row by dispatching through every field (`get_attribute`,
+`to_representation`, a `reverse()` per hyperlink). For lists, the view's
+serializer is instead compiled once per request into a plan of column getters:
+rows come from `.values()`, hyperlinks from a URL template reversed once, and
+nested serializers from one `.values()` query per level. The plan follows the
+serializer's bound fields, so sparse fieldsets and expansions apply, and any
+field it doesn't know how to reproduce exactly makes the view fall back to
+the serializer.
+
+The same plans back the async read path (`alist` / `aretrieve`, see
+api/async_views.py), with every query run through the async ORM.
+"""
+
+import asyncio
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F
+from django.urls import NoReverseMatch
+from rest_framework import fields as drf_fields
+from rest_framework import relations, serializers
+from rest_framework.response import Response
+
+from .instrumentation import timed_serialization
+from .prefetch import active_queryset
+from .serializers import SrcsetField
+
+# Stands in for the lookup value when URL templates are reversed; digits so
+# it also fits <int:pk> routes.
+URL_SENTINEL = "918273645546372819"
+
+PARENT = "fastpath_parent"
+
+# Fields whose to_representation() returns database values unchanged.
+PASSTHROUGH_FIELDS = (
+    drf_fields.CharField,
+    drf_fields.SlugField,
+    drf_fields.EmailField,
+    drf_fields.IntegerField,
+    drf_fields.BooleanField,
+    drf_fields.ReadOnlyField,
+)
+
+# Fields whose to_representation() only depends on the column value.
+CONVERTED_FIELDS = (
+    drf_fields.DecimalField,
+    drf_fields.FloatField,
+    drf_fields.DateTimeField,
+    drf_fields.DateField,
+)
+
+
+class Unsupported(Exception):
+    pass
+
+
+def _model_field(model, field):
+    if field.write_only or field.source == "*" or len(field.source_attrs) != 1:
+        raise Unsupported(field)
+    try:
+        return model._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        raise Unsupported(field)
+
+
+def _url_template(field, request):
+    if field.lookup_field != "pk":
+        raise Unsupported(field)
+    try:
+        url = field.reverse(
+            field.view_name,
+            kwargs={field.lookup_url_kwarg: URL_SENTINEL},
+            request=request,
+            format=None,
+        )
+    except NoReverseMatch:
+        raise Unsupported(field)
+    if url.count(URL_SENTINEL) != 1:
+        raise Unsupported(field)
+    return url.split(URL_SENTINEL)
+
+
+def _absolute_url(request):
+    if request is None:
+        return lambda url: url
+    prefix = request.build_absolute_uri("/")[:-1]
+
+    def build(url):
+        # Same shortcut HttpRequest.build_absolute_uri() takes.
+        if url.startswith("/") and not url.startswith("//") and "/./" not in url and "/../" not in url:
+            return prefix + url
+        return request.build_absolute_uri(url)
+
+    return build
+
+
+class Plan:
+    """
+    The columns to select for a serializer's model and how to turn a
+    `.values()` row into the serializer's output.
+    """
+
+    def __init__(self, serializer, request):
+        self.model = serializer.Meta.model
+        self.columns = ["pk"]
+        self.getters = []
+        self.nested = []
+        absolute = _absolute_url(request)
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            nested = field.child if isinstance(field, serializers.ListSerializer) else field
+
+            if isinstance(nested, serializers.BaseSerializer):
+                self.add_nested(name, field, nested, request)
+            elif isinstance(field, relations.HyperlinkedIdentityField):
+                head, tail = _url_template(field, request)
+                self.getters.append((name, lambda row, h=head, t=tail: f"{h}{row['pk']}{t}"))
+            elif isinstance(field, relations.HyperlinkedRelatedField):
+                model_field = _model_field(self.model, field)
+                if not model_field.many_to_one:
+                    raise Unsupported(field)
+                head, tail = _url_template(field, request)
+                self.add_column(
+                    name, model_field.attname, lambda value, h=head, t=tail: f"{h}{value}{t}"
+                )
+            elif isinstance(field, relations.RelatedField) or isinstance(
+                field, relations.ManyRelatedField
+            ):
+                raise Unsupported(field)
+            elif isinstance(field, drf_fields.FileField):
+                model_field = _model_field(self.model, field)
+                if not getattr(field, "use_url", True):
+                    raise Unsupported(field)
+                storage = model_field.storage
+                self.add_column(
+                    name,
+                    model_field.attname,
+                    lambda value, s=storage: absolute(s.url(value)) if value else None,
+                    skip_none=False,
+                )
+            elif isinstance(field, SrcsetField):
+                model_field = _model_field(self.model, field)
+                self.add_column(name, model_field.attname, field.to_representation)
+            elif type(field) in PASSTHROUGH_FIELDS:
+                self.add_column(name, _model_field(self.model, field).attname, None)
+            elif type(field) in CONVERTED_FIELDS:
+                model_field = _model_field(self.model, field)
+                self.add_column(name, model_field.attname, field.to_representation)
+            else:
+                raise Unsupported(field)
+
+    def add_column(self, name, column, convert, skip_none=True):
+        if column not in self.columns:
+            self.columns.append(column)
+        if convert is None:
+            getter = lambda row, c=column: row[c]
+        elif skip_none:
+            def getter(row, c=column, convert=convert):
+                value = row[c]
+                return None if value is None else convert(value)
+        else:
+            getter = lambda row, c=column, convert=convert: convert(row[c])
+        self.getters.append((name, getter))
+
+    def add_nested(self, name, field, nested, request):
+        if not isinstance(nested, serializers.ModelSerializer):
+            raise Unsupported(field)
+        model_field = _model_field(self.model, field)
+        plan = Plan(nested, request)
+        if model_field.many_to_many or model_field.one_to_many:
+            if not isinstance(field, serializers.ListSerializer):
+                raise Unsupported(field)
+            step = ManyStep(plan, model_field.remote_field.name)
+            self.getters.append((name, lambda row, s=step: s.groups.get(row["pk"], [])))
+        elif model_field.many_to_one or (model_field.one_to_one and model_field.concrete):
+            if model_field.attname not in self.columns:
+                self.columns.append(model_field.attname)
+            step = ForeignKeyStep(plan, model_field.attname)
+            self.getters.append(
+                (name, lambda row, s=step: s.rows.get(row[s.column]))
+            )
+        else:
+            raise Unsupported(field)
+        self.nested.append(step)
+
+    def fetch(self, queryset, extra=None):
+        rows = list(queryset.values(*self.columns, **(extra or {})))
+        for step in self.nested:
+            step.load(rows)
+        return rows
+
+    async def afetch(self, queryset, extra=None):
+        rows = [row async for row in queryset.values(*self.columns, **(extra or {}))]
+        # Each nested level only depends on these rows, not on its siblings.
+        await asyncio.gather(*(step.aload(rows) for step in self.nested))
+        return rows
+
+    def render(self, row):
+        return {name: getter(row) for name, getter in self.getters}
+
+    def render_pks(self, pks):
+        rows = {
+            row["pk"]: row
+            for row in self.fetch(self.model._default_manager.filter(pk__in=pks))
+        }
+        with timed_serialization():
+            return [self.render(rows[pk]) for pk in pks if pk in rows]
+
+    async def arender_pks(self, pks):
+        rows = {
+            row["pk"]: row
+            for row in await self.afetch(self.model._default_manager.filter(pk__in=pks))
+        }
+        with timed_serialization():
+            return [self.render(rows[pk]) for pk in pks if pk in rows]
+
+
+class ForeignKeyStep:
+    # A nested serializer on a forward foreign key, like select_related.
+
+    def __init__(self, plan, column):
+        self.plan = plan
+        self.column = column
+        self.rows = {}
+
+    def queryset(self, parent_rows):
+        ids = {row[self.column] for row in parent_rows} - {None}
+        return self.plan.model._default_manager.filter(pk__in=ids)
+
+    def load(self, parent_rows):
+        rows = self.plan.fetch(self.queryset(parent_rows))
+        self.rows = {row["pk"]: self.plan.render(row) for row in rows}
+
+    async def aload(self, parent_rows):
+        rows = await self.plan.afetch(self.queryset(parent_rows))
+        self.rows = {row["pk"]: self.plan.render(row) for row in rows}
+
+
+class ManyStep:
+    # A nested list over a reverse foreign key or many-to-many, like
+    # PrefetchSerializerMixin's Prefetch of the active rows in pk order.
+
+    def __init__(self, plan, path):
+        self.plan = plan
+        self.path = path
+        self.groups = {}
+
+    def queryset(self, parent_rows):
+        return active_queryset(self.plan.model).filter(
+            **{f"{self.path}__in": [row["pk"] for row in parent_rows]}
+        )
+
+    def group(self, rows):
+        self.groups = {}
+        for row in rows:
+            self.groups.setdefault(row[PARENT], []).append(self.plan.render(row))
+
+    def load(self, parent_rows):
+        self.group(self.plan.fetch(self.queryset(parent_rows), {PARENT: F(self.path)}))
+
+    async def aload(self, parent_rows):
+        self.group(await self.plan.afetch(self.queryset(parent_rows), {PARENT: F(self.path)}))
+
+
+def compile_plan(serializer, request):
+    """Return a Plan for `serializer`, or None if it can't be reproduced exactly."""
+    if serializer.context.get("format"):
+        return None
+    try:
+        return Plan(serializer, request)
+    except Unsupported:
+        return None
+
+
+class PlanPageMixin:
+    # The page query shared by the sync and async plan-backed lists.
+
+    def get_page_queryset(self, request):
+        # The page query only needs the keys (and whatever the paginator
+        # orders by); the plan loads the rest.
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.prefetch_related(None).select_related(None)
+        return queryset.only(*self.get_page_columns(request, queryset))
+
+    def get_page_columns(self, request, queryset):
+        columns = {queryset.model._meta.pk.name}
+        get_ordering = getattr(self.paginator, "get_ordering", None)
+        ordering = get_ordering(request, queryset, self) if get_ordering else queryset.query.order_by
+        for term in ordering:
+            name = str(term).lstrip("-")
+            try:
+                queryset.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            columns.add(name)
+        return columns
+
+
+class FastListMixin(PlanPageMixin):
+    """
+    Serve `list` through a compiled Plan instead of the serializer when the
+    serializer allows it. List it below ConditionalGetMixin and
+    CachedResponseMixin so they wrap it.
+    """
+
+    fast_list = True
+
+    def list(self, request, *args, **kwargs):
+        plan = compile_plan(self.get_serializer(), request) if self.fast_list else None
+        if plan is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.get_page_queryset(request)
+        page = self.paginate_queryset(queryset)
+        objects = list(queryset) if page is None else page
+        data = plan.render_pks([obj.pk for obj in objects])
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+
+class AsyncUnsupported(Exception):
+    """The async path can't reproduce this response; serve it synchronously."""
+
+
+class AsyncReadMixin(PlanPageMixin):
+    """
+    `alist` / `aretrieve`: the view's `list` / `retrieve` for async views,
+    rendered through a Plan with the async ORM. They raise AsyncUnsupported
+    for anything only the serializer can do. The mixins above it in the MRO
+    (ConditionalGetMixin, CachedResponseMixin, CategorySnapshotMixin) have
+    async twins that wrap these the way their sync methods wrap the DRF ones.
+    """
+
+    def get_plan(self, request):
+        plan = compile_plan(self.get_serializer(), request)
+        if plan is None:
+            raise AsyncUnsupported
+        return plan
+
+    async def alist(self, request, *args, **kwargs):
+        plan = self.get_plan(request)
+        queryset = self.get_page_queryset(request)
+        page = None
+        if self.paginator is not None:
+            if not hasattr(self.paginator, "apaginate_queryset"):
+                raise AsyncUnsupported
+            page = await self.paginator.apaginate_queryset(queryset, request, view=self)
+        objects = [obj async for obj in queryset] if page is None else page
+        data = await plan.arender_pks([obj.pk for obj in objects])
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        plan = self.get_plan(request)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        pk = await (
+            self.filter_queryset(self.get_queryset())
+            .filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+            .values_list("pk", flat=True)
+            .afirst()
+        )
+        if pk is None:
+            # Left to DRF, for its exact 404.
+            raise AsyncUnsupported
+        (data,) = await plan.arender_pks([pk])
+        return Response(data)
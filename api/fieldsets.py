@@ -0,0 +1,122 @@
+"""
+Sparse fieldsets for read requests.
+
+    ?fields=name,slug,variants.price   only these fields (dotted for nested)
+    ?omit=images,variants.discount     everything but these
+    ?expand=category                   add fields listed in Meta.expandable_fields
+
+The root serializer reads the query parameters and hands each nested
+serializer its part of the tree. Fields are filtered before DRF copies the
+declared fields, so nested serializers that weren't asked for are never built,
+and PrefetchSerializerMixin plans its queries from the same pruned tree.
+"""
+
+from collections import namedtuple
+
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+from .instrumentation import timed_serialization
+
+FIELDSET_PARAMS = ("fields", "omit", "expand")
+
+Fieldset = namedtuple("Fieldset", FIELDSET_PARAMS)
+
+
+def parse_paths(value):
+    """
+    "a,b.c,b.d" -> {"a": {}, "b": {"c": {}, "d": {}}}
+    """
+    tree = {}
+    for path in (value or "").split(","):
+        node = tree
+        for part in path.strip().split("."):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def has_fieldset_params(request):
+    return any(request.GET.get(param) for param in FIELDSET_PARAMS)
+
+
+def fieldset_from_request(request):
+    if request is None or getattr(request, "method", "GET") not in SAFE_METHODS:
+        # Never narrow what a write accepts.
+        return None
+    trees = [parse_paths(request.GET.get(param)) for param in FIELDSET_PARAMS]
+    if not any(trees):
+        return None
+    return Fieldset(trees[0] or None, trees[1], trees[2])
+
+
+class FieldsetSerializerMixin:
+    """
+    Serializer side of `?fields=`, `?omit=` and `?expand=`. Expandable fields
+    are declared as `Meta.expandable_fields = {name: (serializer, kwargs)}`,
+    the serializer given as a class or a dotted path.
+    """
+
+    def is_root(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    def get_fieldset(self):
+        if hasattr(self, "_fieldset"):
+            return self._fieldset
+        if not self.is_root():
+            return None
+        return fieldset_from_request(self.context.get("request"))
+
+    def to_representation(self, instance):
+        if not self.is_root():
+            return super().to_representation(instance)
+        with timed_serialization():
+            return super().to_representation(instance)
+
+    def is_wanted(self, name, fieldset):
+        if fieldset.fields is not None and name not in fieldset.fields:
+            return False
+        return fieldset.omit.get(name) != {}
+
+    def get_field_names(self, declared_fields, info):
+        names = super().get_field_names(declared_fields, info)
+        fieldset = self.get_fieldset()
+        if fieldset is None:
+            return names
+        return [name for name in names if self.is_wanted(name, fieldset)]
+
+    def get_fields(self):
+        fieldset = self.get_fieldset()
+        if fieldset is None:
+            return super().get_fields()
+
+        # Shadow the class attribute so only wanted fields are deep-copied.
+        self._declared_fields = {
+            name: field
+            for name, field in type(self)._declared_fields.items()
+            if self.is_wanted(name, fieldset)
+        }
+        fields = super().get_fields()
+
+        expandable = getattr(self.Meta, "expandable_fields", {})
+        for name in fieldset.expand:
+            if name in expandable and fieldset.omit.get(name) != {}:
+                serializer_class, kwargs = expandable[name]
+                if isinstance(serializer_class, str):
+                    serializer_class = import_string(serializer_class)
+                fields[name] = serializer_class(**kwargs)
+
+        for name, field in fields.items():
+            nested = field.child if isinstance(field, serializers.ListSerializer) else field
+            if isinstance(nested, FieldsetSerializerMixin):
+                subset = Fieldset(
+                    (fieldset.fields or {}).get(name) or None,
+                    fieldset.omit.get(name, {}),
+                    fieldset.expand.get(name, {}),
+                )
+                nested._fieldset = subset if any(subset) else None
+        return fields
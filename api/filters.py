@@ -0,0 +1,127 @@
+import asyncio
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+from .facets import facet_index, parse_selection
+from .fastpath import AsyncUnsupported
+
+
+def with_effective_price(queryset):
+    # Validator querysets leave the annotation out unless a filter needs it
+    # (see ConditionalGetMixin.get_validator_queryset).
+    if "effective_price" in queryset.query.annotations:
+        return queryset
+    return queryset.with_effective_price()
+
+
+class PriceRangeFilter(BaseFilterBackend):
+    """
+    `?min_price=` / `?max_price=` on the SQL-computed `effective_price`
+    (see DiscountedQuerySet.with_effective_price).
+    """
+
+    lookups = {
+        "min_price": "effective_price__gte",
+        "max_price": "effective_price__lte",
+    }
+
+    def filter_queryset(self, request, queryset, view):
+        for param, lookup in self.lookups.items():
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            try:
+                value = Decimal(value)
+            except InvalidOperation:
+                raise ValidationError({param: ["A valid number is required."]})
+            queryset = with_effective_price(queryset).filter(**{lookup: value})
+        return queryset
+
+
+class FacetFilter(BaseFilterBackend):
+    """
+    `?category=` / `?subcategory=` / `?color=` (comma-separated, any of),
+    `?min_size=` / `?max_size=` and `?in_stock=`, answered from the facet
+    index (see api/facets.py). Prices are left to PriceRangeFilter.
+    """
+
+    facets = ("category", "subcategory", "color", "size", "in_stock")
+
+    def filter_queryset(self, request, queryset, view):
+        selection = parse_selection(request.query_params, self.facets)
+        if not selection:
+            return queryset
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            # Refreshing the index queries the database synchronously.
+            raise AsyncUnsupported
+        return queryset.filter(pk__in=sorted(facet_index.match(selection)))
+
+
+class PriceOrderingFilter(OrderingFilter):
+    # Clients sort on what they pay: ?ordering=price means effective_price.
+    aliases = {"price": "effective_price"}
+
+    def remove_invalid_fields(self, queryset, fields, view, request):
+        fields = [
+            ("-" if term.startswith("-") else "")
+            + self.aliases.get(term.lstrip("-"), term.lstrip("-"))
+            for term in fields
+        ]
+        return super().remove_invalid_fields(queryset, fields, view, request)
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.get_ordering(request, queryset, view)
+        if any(term.lstrip("-") == "effective_price" for term in ordering or []):
+            queryset = with_effective_price(queryset)
+        return super().filter_queryset(request, queryset, view)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view) or [])
+        # Break ties on the primary key so pages never shuffle equal prices.
+        if ordering and not any(term.lstrip("-") in ("id", "pk") for term in ordering):
+            ordering.append("-id")
+        return ordering
+
+
+class CreatedAtRangeFilter(BaseFilterBackend):
+    """
+    `?created_after=` (inclusive) / `?created_before=` (exclusive) on
+    `created_at`, as ISO dates or datetimes; dates mean midnight in the
+    current time zone, so `?created_after=2024-01-01&created_before=2024-02-01`
+    is January.
+    """
+
+    lookups = {
+        "created_after": "created_at__gte",
+        "created_before": "created_at__lt",
+    }
+
+    def parse(self, param, value):
+        try:
+            moment = parse_datetime(value)
+            if moment is None:
+                day = parse_date(value)
+                moment = day and datetime.combine(day, time.min)
+        except ValueError:
+            moment = None
+        if moment is None:
+            raise ValidationError({param: ["Enter a valid date or datetime."]})
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+
+    def filter_queryset(self, request, queryset, view):
+        for param, lookup in self.lookups.items():
+            value = request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{lookup: self.parse(param, value)})
+        return queryset
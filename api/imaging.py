@@ -0,0 +1,76 @@
+"""
+Pillow side of the image derivative pipeline.
+
+Runs in worker processes, so it only deals with files and plain data and must
+not import Django.
+"""
+
+import hashlib
+import os
+
+from PIL import Image, ImageOps
+
+# Pillow format name and file extension per derivative format.
+FORMATS = {
+    "jpeg": ("JPEG", "jpg"),
+    "webp": ("WEBP", "webp"),
+    "avif": ("AVIF", "avif"),
+}
+
+
+def available_formats(formats):
+    """
+    `formats` minus the ones this Pillow build can't write (AVIF needs
+    pillow-avif-plugin before Pillow 11.3).
+    """
+    Image.init()
+    return [name for name in formats if FORMATS[name][0] in Image.SAVE]
+
+
+def content_hash(path, options):
+    digest = hashlib.sha256(repr(sorted(options.items())).encode())
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def render_derivatives(source_path, media_root, sizes, formats, quality=80, prefix="derivatives"):
+    """
+    Write resized copies of `source_path` for every width in `sizes` that is
+    narrower than the original (or the original width if none is) in every
+    format, under `media_root/prefix/<hash>/`. The directory name hashes the
+    source bytes and options, so identical uploads share their files and
+    URLs can be cached forever.
+
+    Returns `{"width": w, "height": h, "hash": ..., "files": {format: {width: name}}}`
+    with names relative to `media_root`.
+    """
+    formats = available_formats(formats)
+    options = {"sizes": sorted(sizes), "formats": formats, "quality": quality}
+    digest = content_hash(source_path, options)
+    directory = os.path.join(prefix, digest[:2], digest)
+    os.makedirs(os.path.join(media_root, directory), exist_ok=True)
+
+    with Image.open(source_path) as original:
+        original = ImageOps.exif_transpose(original)
+        width, height = original.size
+        widths = sorted({size for size in sizes if size < width}) or [width]
+        files = {name: {} for name in formats}
+        for target in widths:
+            resized = original.copy()
+            resized.thumbnail((target, round(height * target / width)), Image.LANCZOS)
+            for name in formats:
+                pil_format, extension = FORMATS[name]
+                relative = os.path.join(directory, f"{target}.{extension}")
+                path = os.path.join(media_root, relative)
+                if not os.path.exists(path):
+                    image = resized
+                    if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+                        image = image.convert("RGB")
+                    # Write aside and rename so readers never see half a file.
+                    partial = f"{path}.{os.getpid()}.tmp"
+                    image.save(partial, pil_format, quality=quality)
+                    os.replace(partial, path)
+                files[name][str(target)] = relative.replace(os.sep, "/")
+    return {"width": width, "height": height, "hash": digest, "files": files}
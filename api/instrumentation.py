@@ -0,0 +1,238 @@
+"""
+Per-view request timings.
+
+PerformanceMiddleware measures every request that resolves to a view: wall
+time, the number and total duration of its database queries, time spent
+serializing and the response size. With `SERVER_TIMING` on (by default
+only when DEBUG is), each response gets a `Server-Timing` header, e.g.
+
+    Server-Timing: db;dur=4.1;desc="3 queries", serialize;dur=1.9, total;dur=8.0
+
+and the numbers are added to in-memory histograms per `<method> <view name>`,
+which `GET /api/perf/` (admin users only) reports as p50/p95/p99.
+
+Queries are counted by an execute_wrapper installed on every connection as it
+is opened. It reports to the stats of the request in the current context, so
+queries run by the async views' sync_to_async threads are counted too.
+Serializer time covers the root serializer's to_representation(), including
+any queries it triggers, and rendering rows from the compiled Plans of
+api/fastpath.py.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+DEFAULTS = {
+    # None follows DEBUG: the header tells clients about the backend.
+    "SERVER_TIMING": None,
+}
+
+_current = ContextVar("request_stats", default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "API_PERFORMANCE", {})}
+
+
+class RequestStats:
+    __slots__ = ("started", "queries", "db", "serialize", "serializing")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.serializing = False
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def install_on_connect(sender, connection, **kwargs):
+    # Wrappers outlive the connection they were added on; add it once.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def timed_serialization():
+    """Count the enclosed block as serializer time, unless already inside one."""
+    stats = _current.get()
+    if stats is None or stats.serializing:
+        yield
+        return
+    stats.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serialize += time.perf_counter() - started
+        stats.serializing = False
+
+
+class Histogram:
+    """
+    Counts of durations in geometric buckets 10% wide, from 0.1 ms to about
+    5 minutes. Percentiles are interpolated within a bucket, so they are
+    accurate to a few percent whatever the number of samples.
+    """
+
+    BOUNDS = [0.0] + [0.1 * 1.1**i for i in range(160)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, pct):
+        if not self.total:
+            return None
+        rank = pct / 100 * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.BOUNDS[index - 1] if index else 0.0
+                high = self.BOUNDS[index] if index < len(self.BOUNDS) else self.max
+                value = low + (high - low) * (rank - seen) / count
+                return round(min(value, self.max), 2)
+            seen += count
+        return round(self.max, 2)
+
+    def summary(self):
+        return {
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": round(self.max, 2),
+        }
+
+
+class ViewStats:
+    TIMINGS = ("wall_ms", "db_ms", "serialize_ms")
+
+    def __init__(self):
+        self.count = 0
+        self.histograms = {name: Histogram() for name in self.TIMINGS}
+        self.queries = 0
+        self.max_queries = 0
+        self.bytes = 0
+        self.max_bytes = 0
+
+    def add(self, timings, queries, size):
+        self.count += 1
+        for name, value in timings.items():
+            self.histograms[name].add(value)
+        self.queries += queries
+        self.max_queries = max(self.max_queries, queries)
+        self.bytes += size
+        self.max_bytes = max(self.max_bytes, size)
+
+    def summary(self):
+        return {
+            "count": self.count,
+            **{name: hist.summary() for name, hist in self.histograms.items()},
+            "queries": {"mean": round(self.queries / self.count, 2), "max": self.max_queries},
+            "bytes": {"mean": round(self.bytes / self.count), "max": self.max_bytes},
+        }
+
+
+_views = {}
+_views_lock = threading.Lock()
+
+
+def record(key, timings, queries, size):
+    with _views_lock:
+        stats = _views.get(key)
+        if stats is None:
+            stats = _views[key] = ViewStats()
+        stats.add(timings, queries, size)
+
+
+def get_view_stats():
+    with _views_lock:
+        return {key: stats.summary() for key, stats in sorted(_views.items())}
+
+
+def reset_view_stats():
+    with _views_lock:
+        _views.clear()
+
+
+class PerformanceMiddleware:
+    """List it first in MIDDLEWARE, so that its wall time covers the others."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = get_config()["SERVER_TIMING"]
+        if self.server_timing is None:
+            self.server_timing = settings.DEBUG
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats)
+
+    def finish(self, request, response, stats):
+        wall = (time.perf_counter() - stats.started) * 1000
+        db = stats.db * 1000
+        serialize = stats.serialize * 1000
+        if self.server_timing:
+            response["Server-Timing"] = (
+                f'db;dur={db:.1f};desc="{stats.queries} queries", '
+                f"serialize;dur={serialize:.1f}, total;dur={wall:.1f}"
+            )
+        match = request.resolver_match
+        if match is not None and match.view_name:
+            record(
+                f"{request.method} {match.view_name}",
+                {"wall_ms": wall, "db_ms": db, "serialize_ms": serialize},
+                stats.queries,
+                # Unknown until a streaming response has been sent.
+                0 if response.streaming else len(response.content),
+            )
+        return response
@@ -0,0 +1,221 @@
+"""
+Stock ledger.
+
+Every change to the stock of a product or variant is an InventoryMovement
+with a signed quantity:
+
+    receipt      goods in
+    sale         one per OrderItem, recorded at checkout
+    return       goods back from a customer
+    adjustment   counts, corrections, and the opening stock of new items
+
+Movements are only ever added. `quantity` on the product or variant caches
+their running total, and the transaction that records a movement also runs
+`UPDATE ... SET quantity = quantity + <delta>` on the cache. Concurrent
+writers add up instead of overwriting each other, and reading stock is still
+a read of one column. Saving a loaded row leaves `quantity` out
+(StockCacheMixin), and `set_stock()` records the difference to a new level as
+an adjustment.
+
+The ledger is summed from snapshots. `take_snapshots()`, which the
+`snapshot_inventory` command runs periodically, records each moved item's
+stock as of a position in the ledger. `ledger_quantity()` adds to the latest
+snapshot the movements recorded after it. `snapshot_inventory --check`
+compares the result with the cache.
+"""
+
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Max, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import InventoryMovement, InventorySnapshot, Product, Variant
+from .signals import catalog_bulk_changed
+
+# The ledger field of each model with stock.
+STOCK_FIELDS = {Product: "product", Variant: "variant"}
+
+# Snapshots leave out the newest movements. Auto-increment ids are handed out
+# when a row is inserted, not when it is committed, so a movement numbered
+# below the newest one might still be in flight; give transactions this long
+# to commit.
+SNAPSHOT_SETTLE = timedelta(minutes=5)
+
+
+def _update_cache(movements):
+    deltas = defaultdict(Counter)
+    for movement in movements:
+        for model, field in STOCK_FIELDS.items():
+            pk = getattr(movement, f"{field}_id")
+            if pk is not None:
+                deltas[model][pk] += movement.quantity
+    now = timezone.now()
+    for model, changes in deltas.items():
+        pks = sorted(changes)
+        model._default_manager.filter(pk__in=pks).update(
+            quantity=Coalesce(F("quantity"), 0)
+            + Case(
+                *(When(pk=pk, then=Value(changes[pk])) for pk in pks),
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+            updated_at=now,
+        )
+        # update() skips Model.save(); let caches and snapshots catch up.
+        catalog_bulk_changed.send(sender=model, pks=pks)
+
+
+def record_movement(movement):
+    """Save the unsaved `movement` and apply it to the stock cache."""
+    with transaction.atomic():
+        movement.save()
+        _update_cache([movement])
+    return movement
+
+
+def record_movements(movements):
+    """
+    Insert the unsaved `movements` and apply them to the stock cache, with
+    one UPDATE per model. On MySQL the movements get no primary keys.
+    """
+    movements = [movement for movement in movements if movement.quantity]
+    if not movements:
+        return movements
+    with transaction.atomic():
+        InventoryMovement.objects.bulk_create(movements)
+        _update_cache(movements)
+    return movements
+
+
+def set_stock_levels(model, levels, user=None, note=""):
+    """
+    Bring the stock of `model` rows to `levels` ({pk: quantity}), recording
+    the differences as adjustments.
+    """
+    field = STOCK_FIELDS[model]
+    with transaction.atomic():
+        current = (
+            model._default_manager.select_for_update()
+            .filter(pk__in=sorted(levels))
+            .order_by("pk")
+            .values_list("pk", "quantity")
+        )
+        record_movements(
+            InventoryMovement(
+                kind=InventoryMovement.Kind.ADJUSTMENT,
+                **{f"{field}_id": pk},
+                quantity=(levels[pk] or 0) - (quantity or 0),
+                user=user,
+                note=note,
+            )
+            for pk, quantity in current
+        )
+
+
+def set_stock(item, quantity, user=None, note=""):
+    set_stock_levels(type(item), {item.pk: quantity}, user=user, note=note)
+    item.quantity = quantity
+
+
+def record_opening_stock(items, user=None):
+    """
+    Record the stock new `items` were created with as adjustments, leaving
+    the cache as it is.
+    """
+    movements = [
+        InventoryMovement(
+            kind=InventoryMovement.Kind.ADJUSTMENT,
+            **{STOCK_FIELDS[type(item)]: item},
+            quantity=item.quantity,
+            user=user,
+            note="Opening stock",
+        )
+        for item in items
+        if item.quantity
+    ]
+    InventoryMovement.objects.bulk_create(movements)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Variant)
+def open_stock(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        record_opening_stock([instance])
+
+
+def with_ledger_quantity(queryset, position=None):
+    """
+    Annotate `queryset` of products or variants with `ledger_quantity`, their
+    stock as summed from the ledger (up to movement `position` if given).
+    """
+    field = STOCK_FIELDS[queryset.model]
+    snapshots = InventorySnapshot.objects.filter(**{field: OuterRef("pk")})
+    if position is not None:
+        snapshots = snapshots.filter(movement_id__lte=position)
+    snapshots = snapshots.order_by("-movement_id")
+    movements = InventoryMovement.objects.filter(
+        **{field: OuterRef("pk")}, id__gt=OuterRef("ledger_position")
+    )
+    if position is not None:
+        movements = movements.filter(id__lte=position)
+    movements = movements.values(field).annotate(total=Sum("quantity")).values("total")
+    return queryset.annotate(
+        ledger_position=Coalesce(Subquery(snapshots.values("movement_id")[:1]), 0)
+    ).annotate(
+        ledger_quantity=Coalesce(Subquery(snapshots.values("quantity")[:1]), 0)
+        + Coalesce(Subquery(movements), 0)
+    )
+
+
+def ledger_quantity(item):
+    model = type(item)
+    return (
+        with_ledger_quantity(model._default_manager.filter(pk=item.pk))
+        .values_list("ledger_quantity", flat=True)
+        .get()
+    )
+
+
+def take_snapshots(settle=SNAPSHOT_SETTLE):
+    """
+    Snapshot the stock of every item moved since the last snapshots, as of
+    the newest movement at least `settle` old. Returns the number taken.
+    """
+    with transaction.atomic():
+        position = InventoryMovement.objects.filter(
+            created_at__lte=timezone.now() - settle
+        ).aggregate(position=Max("id"))["position"]
+        previous = InventorySnapshot.objects.aggregate(position=Max("movement_id"))[
+            "position"
+        ]
+        if position is None or position <= (previous or 0):
+            return 0
+        snapshots = []
+        for model, field in STOCK_FIELDS.items():
+            moved = InventoryMovement.objects.filter(
+                id__gt=previous or 0, id__lte=position, **{f"{field}__isnull": False}
+            ).values(field)
+            items = with_ledger_quantity(
+                model._default_manager.filter(pk__in=moved), position=position
+            )
+            snapshots += [
+                InventorySnapshot(**{f"{field}_id": pk}, quantity=quantity, movement_id=position)
+                for pk, quantity in items.values_list("pk", "ledger_quantity").iterator()
+            ]
+        InventorySnapshot.objects.bulk_create(snapshots, batch_size=1000)
+    return len(snapshots)
+
+
+def find_drift(model):
+    """Rows of `model` whose cached stock differs from the ledger's."""
+    return (
+        with_ledger_quantity(model._default_manager.all())
+        .exclude(ledger_quantity=Coalesce(F("quantity"), 0))
+        .order_by("pk")
+        .values_list("pk", "quantity", "ledger_quantity")
+    )
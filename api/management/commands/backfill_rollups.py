@@ -0,0 +1,63 @@
+from argparse import ArgumentTypeError
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+from rest_framework.exceptions import ValidationError
+
+from api.models import Order, Payment, RollupPeriod
+from api.filters import CreatedAtRangeFilter
+from api.rollups import ceil, floor, refresh
+
+
+def moment(value):
+    # ISO dates or datetimes, naive ones in the current time zone.
+    try:
+        return CreatedAtRangeFilter().parse("datetime", value)
+    except ValidationError:
+        raise ArgumentTypeError(f"not a date or datetime: {value!r}")
+
+
+class Command(BaseCommand):
+    help = "Rebuild the hourly and daily sales rollups from orders and payments"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--start",
+            type=moment,
+            help="ISO date or datetime to start from (default: the first order or payment)",
+        )
+        parser.add_argument(
+            "--end",
+            type=moment,
+            help="ISO date or datetime to stop at (default: the last order or payment)",
+        )
+        parser.add_argument(
+            "--chunk-days",
+            type=int,
+            default=1,
+            help="Days rebuilt per transaction",
+        )
+
+    def handle(self, *args, **options):
+        bounds = [
+            model.objects.aggregate(first=Min("created_at"), last=Max("created_at"))
+            for model in (Order, Payment)
+        ]
+        firsts = [bound["first"] for bound in bounds if bound["first"]]
+        lasts = [bound["last"] for bound in bounds if bound["last"]]
+        start = options["start"] or (min(firsts) if firsts else None)
+        end = options["end"] or (max(lasts) + timedelta(seconds=1) if lasts else None)
+        if start is None or end is None:
+            self.stdout.write("Nothing to backfill")
+            return
+        # Whole days, so each chunk rebuilds its days from complete hours.
+        start, end = floor(start, RollupPeriod.DAY), ceil(end, RollupPeriod.DAY)
+        chunk = timedelta(days=options["chunk_days"])
+        chunk_start = start
+        while chunk_start < end:
+            chunk_end = min(chunk_start + chunk, end)
+            refresh(chunk_start, chunk_end)
+            self.stdout.write(f"Rolled up to {chunk_end:%Y-%m-%d}")
+            chunk_start = chunk_end
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {start:%Y-%m-%d} to {end:%Y-%m-%d}"))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from api.benchmark import ThroughputBenchmark, write_report
+
+
+class Command(BaseCommand):
+    help = "Compare requests/sec of the catalog routes under WSGI and ASGI"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Requests per route and server")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--host", default="localhost", help="Host header to send")
+        parser.add_argument(
+            "--wsgi-url",
+            help="Base URL of a running WSGI server (e.g. gunicorn) instead of in-process",
+        )
+        parser.add_argument(
+            "--asgi-url",
+            help="Base URL of a running ASGI server (e.g. uvicorn) instead of in-process",
+        )
+        parser.add_argument("--output", default="bench-asgi.json", help="Where to write the report")
+
+    def handle(self, *args, **options):
+        benchmark = ThroughputBenchmark(
+            requests=options["requests"],
+            concurrency=options["concurrency"],
+            host=options["host"],
+            wsgi_url=options["wsgi_url"],
+            asgi_url=options["asgi_url"],
+        )
+        report = benchmark.run(log=self.stdout.write)
+        write_report(report, options["output"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
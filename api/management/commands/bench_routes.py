@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.benchmark import RouteBenchmark, compare_reports, write_report
+
+
+class Command(BaseCommand):
+    help = "Benchmark every api route in-process and write a JSON report"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--host", default="localhost", help="Host header to send")
+        parser.add_argument(
+            "--only",
+            action="append",
+            metavar="TEXT",
+            help="Only routes containing TEXT (repeatable)",
+        )
+        parser.add_argument(
+            "--output", default="bench-report.json", help="Where to write the report"
+        )
+        parser.add_argument(
+            "--baseline", help="A previous report to print the differences against"
+        )
+
+    def handle(self, *args, **options):
+        benchmark = RouteBenchmark(
+            iterations=options["iterations"],
+            warmup=options["warmup"],
+            host=options["host"],
+        )
+        report = benchmark.run(only=options["only"], log=self.stdout.write)
+        write_report(report, options["output"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if options["baseline"]:
+            with open(options["baseline"]) as fh:
+                baseline = json.load(fh)
+            for route, metric, before, after in compare_reports(baseline, report):
+                if before == after or not before:
+                    continue
+                change = (after - before) / before * 100
+                self.stdout.write(
+                    f"{route:<45} {metric:<9} {before:>10} -> {after:<10} ({change:+.1f}%)"
+                )
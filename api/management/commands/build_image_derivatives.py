@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from api.derivatives import IMAGE_FIELDS, build_derivatives
+
+MODELS = {model._meta.model_name: model for model in IMAGE_FIELDS}
+
+
+class Command(BaseCommand):
+    help = "Render thumbnails and WebP/AVIF copies for images that don't have them yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--model",
+            action="append",
+            choices=sorted(MODELS),
+            help="Only these models (default: all)",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Re-render up to date images too, e.g. after changing the sizes",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        for name in options["model"] or sorted(MODELS):
+            model = MODELS[name]
+            pks = list(model._default_manager.order_by("pk").values_list("pk", flat=True))
+            rendered = 0
+            for start in range(0, len(pks), options["batch_size"]):
+                rendered += build_derivatives(
+                    model,
+                    pks[start:start + options["batch_size"]],
+                    force=options["force"],
+                    wait=True,
+                )
+            self.stdout.write(f"{model.__name__}: {rendered} image(s) rendered")
+        self.stdout.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,106 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.models import Category, Image, Payment, Product, SubCategory, User, Variant
+from api.seeding import SCALES, seed_catalog
+
+# Meta.indexes added for the query shapes below (migration 0008).
+HOT_INDEXES = {
+    Product: ["product_slug_active_idx", "product_active_id_idx"],
+    Image: [
+        "image_product_active_idx",
+        "image_category_active_idx",
+        "image_subcat_active_idx",
+    ],
+    Variant: ["variant_product_active_idx"],
+    Payment: ["payment_transaction_idx"],
+    User: ["user_email_idx"],
+}
+
+
+def _latest(model, field):
+    return model.objects.order_by("-pk").values_list(field, flat=True).first() or ""
+
+
+def hot_queries():
+    product_ids = list(Product.objects.order_by("-id").values_list("pk", flat=True)[:20])
+    category_id = Category.objects.values_list("pk", flat=True).first() or 0
+    subcategory_id = SubCategory.objects.values_list("pk", flat=True).first() or 0
+    return {
+        "product by slug": Product.objects.filter(
+            slug=_latest(Product, "slug"), is_active=True
+        ),
+        "active products, newest first": Product.objects.filter(is_active=True).order_by(
+            "-id"
+        )[:20],
+        "images of a product page": Image.objects.filter(
+            product_id__in=product_ids, is_active=True
+        ),
+        "images of a category": Image.objects.filter(
+            category_id=category_id, is_active=True
+        ),
+        "images of a subcategory": Image.objects.filter(
+            subcategory_id=subcategory_id, is_active=True
+        ),
+        "variants of a product page": Variant.objects.filter(
+            product_id__in=product_ids, is_active=True
+        ),
+        "payment by transaction id": Payment.objects.filter(
+            transaction_id=_latest(Payment, "transaction_id")
+        ),
+        "user by email": User.objects.filter(email=_latest(User, "email")),
+    }
+
+
+class Command(BaseCommand):
+    help = "Print the query plans of the hot catalog queries, optionally without their indexes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            metavar="N",
+            help="First insert N products with the small seed_catalog dataset",
+        )
+        parser.add_argument(
+            "--compare",
+            action="store_true",
+            help="Also show the plans with the hot query indexes dropped. "
+            "Drops and re-creates the indexes; don't run against production.",
+        )
+
+    def handle(self, *args, **options):
+        if options["seed"]:
+            sizes = dict(SCALES["small"], products=options["seed"])
+            seed_catalog(**sizes, refresh=False, log=self.stdout.write)
+        if options["compare"]:
+            self.drop_indexes()
+            try:
+                self.print_plans("without indexes")
+            finally:
+                self.create_indexes()
+        self.print_plans("with indexes")
+
+    def print_plans(self, title):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Query plans {title}"))
+        for name, queryset in hot_queries().items():
+            self.stdout.write(self.style.MIGRATE_LABEL(f"  {name}"))
+            for line in queryset.explain().splitlines():
+                self.stdout.write(f"    {line}")
+
+    def indexes(self):
+        for model, names in HOT_INDEXES.items():
+            for index in model._meta.indexes:
+                if index.name in names:
+                    yield model, index
+
+    def drop_indexes(self):
+        with connection.schema_editor() as editor:
+            for model, index in self.indexes():
+                editor.remove_index(model, index)
+
+    def create_indexes(self):
+        with connection.schema_editor() as editor:
+            for model, index in self.indexes():
+                editor.add_index(model, index)
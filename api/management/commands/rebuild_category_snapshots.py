@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Category
+from api.snapshots import rebuild_category_snapshots
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized category snapshots served by the category detail views"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "category_ids",
+            nargs="*",
+            type=int,
+            help="Only rebuild these categories (default: all)",
+        )
+
+    def handle(self, *args, **options):
+        category_ids = options["category_ids"] or list(
+            Category.objects.order_by("pk").values_list("pk", flat=True)
+        )
+        snapshots = rebuild_category_snapshots(category_ids)
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt {len(snapshots)} category snapshot(s)")
+        )
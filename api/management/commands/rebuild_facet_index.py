@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.facets import index_products
+from api.models import FacetDocument, Product
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product facet index"
+
+    def handle(self, *args, **options):
+        product_ids = list(Product.objects.order_by("pk").values_list("pk", flat=True))
+        # Also drops the documents left by deleted products.
+        FacetDocument.objects.exclude(product_id__in=product_ids).delete()
+        index_products(product_ids)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {len(product_ids)} product(s)"))
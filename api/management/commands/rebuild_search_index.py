@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Product
+from api.search import index_products
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product search index"
+
+    def handle(self, *args, **options):
+        product_ids = list(Product.objects.order_by("pk").values_list("pk", flat=True))
+        index_products(product_ids)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {len(product_ids)} product(s)"))
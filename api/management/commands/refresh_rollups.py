@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.rollups import refresh_changed
+
+
+class Command(BaseCommand):
+    help = "Recompute the sales rollups of the hours orders and payments changed in"
+
+    def handle(self, *args, **options):
+        count = refresh_changed()
+        self.stdout.write(self.style.SUCCESS(f"Handled {count} change(s)"))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from api.seeding import SCALES, seed_catalog
+
+
+class Command(BaseCommand):
+    help = "Insert a synthetic catalog with orders, for benchmarks (use a scratch database)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale",
+            choices=sorted(SCALES),
+            default="small",
+            help="Preset sizes; the options below override single values",
+        )
+        for name, help_text in (
+            ("categories", "Number of categories"),
+            ("subcategories", "Subcategories per category"),
+            ("products", "Number of products"),
+            ("variants", "Variants per product"),
+            ("images", "Images per product"),
+            ("orders", "Number of orders"),
+            ("items", "Items per order"),
+            ("users", "Number of users"),
+        ):
+            parser.add_argument(f"--{name}", type=int, help=help_text)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=0, help="Random seed")
+        parser.add_argument(
+            "--no-refresh",
+            action="store_false",
+            dest="refresh",
+            help="Don't rebuild category snapshots and the search index",
+        )
+
+    def handle(self, *args, **options):
+        sizes = {
+            name: value if options[name] is None else options[name]
+            for name, value in SCALES[options["scale"]].items()
+        }
+        counts = seed_catalog(
+            **sizes,
+            batch_size=options["batch_size"],
+            seed=options["seed"],
+            refresh=options["refresh"],
+            log=self.stdout.write,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"Seeded {sum(counts.values())} row(s)")
+        )
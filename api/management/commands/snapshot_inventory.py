@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.inventory import STOCK_FIELDS, find_drift, take_snapshots
+
+
+class Command(BaseCommand):
+    help = "Snapshot stock levels from the inventory ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Instead, report products and variants whose cached quantity "
+            "differs from the ledger",
+        )
+
+    def handle(self, *args, **options):
+        if not options["check"]:
+            count = take_snapshots()
+            self.stdout.write(self.style.SUCCESS(f"Took {count} snapshot(s)"))
+            return
+        drifted = 0
+        for model, field in STOCK_FIELDS.items():
+            for pk, quantity, ledger in find_drift(model):
+                drifted += 1
+                self.stdout.write(f"{field} #{pk}: quantity {quantity}, ledger {ledger}")
+        if drifted:
+            raise CommandError(f"{drifted} item(s) differ from the ledger")
+        self.stdout.write(self.style.SUCCESS("Stock matches the ledger"))
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.4 on 2026-10-18 07:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_contractform'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategorySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('schema_version', models.PositiveIntegerField(default=1)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('payload', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot', to='api.category')),
+            ],
+        ),
+    ]
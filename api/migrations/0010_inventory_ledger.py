@@ -0,0 +1,76 @@
+# Generated by Django 5.0.4 on 2026-10-18 08:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def snapshot_opening_stock(apps, schema_editor):
+    # Existing stock becomes the ledger's starting point: a snapshot at
+    # position 0 that later movements add to.
+    InventorySnapshot = apps.get_model("api", "InventorySnapshot")
+    for model_name in ("product", "variant"):
+        model = apps.get_model("api", model_name)
+        rows = model.objects.exclude(quantity=None).exclude(quantity=0)
+        InventorySnapshot.objects.bulk_create(
+            (
+                InventorySnapshot(**{f"{model_name}_id": pk}, quantity=quantity, movement_id=0)
+                for pk, quantity in rows.values_list("pk", "quantity").iterator()
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventorySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('movement_id', models.PositiveBigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='inventory_snapshots', to='api.product')),
+                ('variant', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='inventory_snapshots', to='api.variant')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InventoryMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'Receipt'), ('sale', 'Sale'), ('return', 'Return'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('quantity', models.IntegerField()),
+                ('note', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='inventory_movements', to='api.orderitem')),
+                ('product', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='inventory_movements', to='api.product')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('variant', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='inventory_movements', to='api.variant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'id'], name='movement_product_id_idx'), models.Index(fields=['variant', 'id'], name='movement_variant_id_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='inventorymovement',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('product__isnull', False), ('variant__isnull', True)), models.Q(('product__isnull', True), ('variant__isnull', False)), _connector='OR'), name='inventory_movement_one_item'),
+        ),
+        migrations.AddIndex(
+            model_name='inventorysnapshot',
+            index=models.Index(fields=['product', 'movement_id'], name='snapshot_product_pos_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventorysnapshot',
+            index=models.Index(fields=['variant', 'movement_id'], name='snapshot_variant_pos_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='inventorysnapshot',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('product__isnull', False), ('variant__isnull', True)), models.Q(('product__isnull', True), ('variant__isnull', False)), _connector='OR'), name='inventory_snapshot_one_item'),
+        ),
+        migrations.RunPython(snapshot_opening_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.4 on 2026-10-18 08:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_inventory_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.JSONField(null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('product', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='api.product')),
+            ],
+        ),
+    ]
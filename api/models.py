@@ -1,4 +1,7 @@
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
 from django.utils.text import slugify
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
@@ -28,6 +31,8 @@ class SubCategory(models.Model):
         Category, on_delete=models.CASCADE, related_name="subcategories"
     )
     bannerImage = models.ImageField(null=True, blank=True)
+    # Thumbnails and WebP/AVIF copies, see api/derivatives.py
+    derivatives = models.JSONField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
@@ -49,14 +54,84 @@ class Discount(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
+    def is_current(self, at=None):
+        at = at or timezone.now()
+        return (
+            self.is_active
+            and self.discount_value is not None
+            and (self.start_date is None or self.start_date <= at)
+            and (self.end_date is None or self.end_date >= at)
+        )
+
     def __str__(self):
         return f"{self.discount_value}% discount"
 
 
-class Product(models.Model):
+class DiscountedQuerySet(models.QuerySet):
+    def with_effective_price(self):
+        """
+        Annotate `effective_price`: the price after the row's discount, when
+        that discount is active and inside its start/end window.
+        """
+        now = timezone.now()
+        current_discount = (
+            Q(discount__is_active=True, discount__discount_value__isnull=False)
+            & (Q(discount__start_date__isnull=True) | Q(discount__start_date__lte=now))
+            & (Q(discount__end_date__isnull=True) | Q(discount__end_date__gte=now))
+        )
+        return self.annotate(
+            effective_price=Case(
+                When(
+                    current_discount,
+                    then=F("price")
+                    - F("price") * F("discount__discount_value") / Value(Decimal(100)),
+                ),
+                default=F("price"),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2),
+            )
+        )
+
+
+class DiscountedPriceMixin:
+    @property
+    def discounted_price(self):
+        # Prefer the value annotated by DiscountedQuerySet.with_effective_price().
+        if hasattr(self, "effective_price"):
+            return self.effective_price
+        if self.price is not None and self.discount and self.discount.is_current():
+            discount_amount = self.price * (self.discount.discount_value / Decimal(100))
+            return self.price - discount_amount
+        return self.price
+
+
+class StockCacheMixin:
+    """
+    `quantity` caches the stock recorded in the inventory ledger and changes
+    only through api/inventory.py. Saving a row that was read earlier leaves
+    it out, because the value read with the row may be stale by the time the
+    row is saved.
+    """
+
+    def save(self, *args, **kwargs):
+        if (
+            not self._state.adding
+            and self.pk is not None
+            and kwargs.get("update_fields") is None
+            and not kwargs.get("force_insert")
+        ):
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "quantity"
+            ]
+        super().save(*args, **kwargs)
+
+
+class Product(StockCacheMixin, DiscountedPriceMixin, models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(null=True, blank=True)
-    slug = models.SlugField(null=True, blank=True)
+    # Indexed through product_slug_active_idx below.
+    slug = models.SlugField(null=True, blank=True, db_index=False)
     category = models.ManyToManyField(
         Category,
         related_name="products_in_category",
@@ -80,15 +155,14 @@ class Product(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
-    @property
-    def discounted_price(self):
-        if self.discount:
-            discount_value = self.discount.discount_value
-            if discount_value is not None:
-                discount_amount = self.price * (discount_value / Decimal(100))
-                discounted_price = self.price - discount_amount
-                return discounted_price
-        return self.price
+    objects = DiscountedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["slug", "is_active"], name="product_slug_active_idx"),
+            models.Index(fields=["is_active", "-id"], name="product_active_id_idx"),
+            models.Index(fields=["updated_at"], name="product_updated_idx"),
+        ]
 
     def __str__(self):
         return self.name
@@ -109,15 +183,25 @@ class Image(models.Model):
         blank=True,
     )
     image = models.ImageField(upload_to="images/")
+    # Thumbnails and WebP/AVIF copies, see api/derivatives.py
+    derivatives = models.JSONField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["product", "is_active"], name="image_product_active_idx"),
+            models.Index(fields=["category", "is_active"], name="image_category_active_idx"),
+            models.Index(fields=["subcategory", "is_active"], name="image_subcat_active_idx"),
+            models.Index(fields=["updated_at"], name="image_updated_idx"),
+        ]
+
     def __str__(self):
         return f"Image id #{self.id}"
 
 
-class Variant(models.Model):
+class Variant(StockCacheMixin, DiscountedPriceMixin, models.Model):
     product = models.ForeignKey(
         Product,
         on_delete=models.CASCADE,
@@ -133,6 +217,8 @@ class Variant(models.Model):
         blank=True,
     )
     image = models.ImageField(null=True, blank=True)
+    # Thumbnails and WebP/AVIF copies, see api/derivatives.py
+    derivatives = models.JSONField(null=True, blank=True, editable=False)
     size = models.FloatField(null=True, blank=True)
     color = models.CharField(null=True, blank=True,max_length=10)
     price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
@@ -141,15 +227,13 @@ class Variant(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
-    @property
-    def discounted_price(self):
-        if self.discount:
-            discount_value = self.discount.discount_value
-            if discount_value is not None:
-                discount_amount = self.price * (discount_value / Decimal(100))
-                discounted_price = self.price - discount_amount
-                return discounted_price
-        return self.price
+    objects = DiscountedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["product", "is_active"], name="variant_product_active_idx"),
+            models.Index(fields=["updated_at"], name="variant_updated_idx"),
+        ]
 
     def __str__(self):
         return f"Variant of {self.product.name if self.product else 'price'}"
@@ -158,6 +242,10 @@ class Variant(models.Model):
 class User(AbstractUser):
     phone_number = models.CharField(max_length=15, blank=True, null=True)
 
+    class Meta(AbstractUser.Meta):
+        # EmailAuthBackend looks users up by email.
+        indexes = [models.Index(fields=["email"], name="user_email_idx")]
+
     def __str__(self):
         return self.username
 
@@ -183,6 +271,10 @@ class Order(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        # Sales rollups aggregate orders an hour at a time.
+        indexes = [models.Index(fields=["created_at"], name="order_created_idx")]
+
     def __str__(self):
         return f"Order Id #{self.id}"
 
@@ -244,10 +336,138 @@ class Payment(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["transaction_id"], name="payment_transaction_idx"),
+            models.Index(fields=["created_at"], name="payment_created_idx"),
+        ]
+
     def __str__(self):
         return self.payment_status
 
 
+class InventoryMovement(models.Model):
+    # Append-only stock ledger, see api/inventory.py
+    class Kind(models.TextChoices):
+        RECEIPT = "receipt"
+        SALE = "sale"
+        RETURN = "return"
+        ADJUSTMENT = "adjustment"
+
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    # Exactly one of product and variant. Indexed through the indexes below.
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name="inventory_movements",
+        null=True,
+        blank=True,
+        db_index=False,
+    )
+    variant = models.ForeignKey(
+        Variant,
+        on_delete=models.CASCADE,
+        related_name="inventory_movements",
+        null=True,
+        blank=True,
+        db_index=False,
+    )
+    # Signed: receipts and returns add stock, sales take it away.
+    quantity = models.IntegerField()
+    order_item = models.ForeignKey(
+        OrderItem,
+        on_delete=models.SET_NULL,
+        related_name="inventory_movements",
+        null=True,
+        blank=True,
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, related_name="+", null=True, blank=True
+    )
+    note = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=Q(product__isnull=False, variant__isnull=True)
+                | Q(product__isnull=True, variant__isnull=False),
+                name="inventory_movement_one_item",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["product", "id"], name="movement_product_id_idx"),
+            models.Index(fields=["variant", "id"], name="movement_variant_id_idx"),
+        ]
+
+    @property
+    def item(self):
+        return self.variant if self.variant_id else self.product
+
+    def clean(self):
+        if (self.product_id is None) == (self.variant_id is None):
+            raise ValidationError("Choose either a product or a variant.")
+        if self.quantity is None:
+            return
+        if self.kind in (self.Kind.RECEIPT, self.Kind.RETURN) and self.quantity <= 0:
+            raise ValidationError({"quantity": "Receipts and returns add stock."})
+        if self.kind == self.Kind.SALE and self.quantity >= 0:
+            raise ValidationError({"quantity": "Sales take stock away."})
+        if self.quantity == 0:
+            raise ValidationError({"quantity": "Nothing to record."})
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Inventory movements can't be changed; record another one.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Inventory movements can't be deleted; record another one.")
+
+    def __str__(self):
+        return f"{self.get_kind_display()} of {self.quantity:+d} for {self.item}"
+
+
+class InventorySnapshot(models.Model):
+    # Stock of a product or variant as of ledger position `movement_id`.
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name="inventory_snapshots",
+        null=True,
+        blank=True,
+        db_index=False,
+    )
+    variant = models.ForeignKey(
+        Variant,
+        on_delete=models.CASCADE,
+        related_name="inventory_snapshots",
+        null=True,
+        blank=True,
+        db_index=False,
+    )
+    quantity = models.IntegerField()
+    movement_id = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=Q(product__isnull=False, variant__isnull=True)
+                | Q(product__isnull=True, variant__isnull=False),
+                name="inventory_snapshot_one_item",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["product", "movement_id"], name="snapshot_product_pos_idx"),
+            models.Index(fields=["variant", "movement_id"], name="snapshot_variant_pos_idx"),
+        ]
+
+    def __str__(self):
+        item = f"variant #{self.variant_id}" if self.variant_id else f"product #{self.product_id}"
+        return f"Stock of {item} at movement #{self.movement_id}"
+
+
 class ContractForm(models.Model):
     name = models.CharField(max_length=100, blank=True, null=True)
     phone= models.CharField(max_length=100, blank=True, null=True)
@@ -257,6 +477,141 @@ class ContractForm(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
+class CategorySnapshot(models.Model):
+    # Pre-rendered CategoryDetailSerializer output, see api/snapshots.py
+    category = models.OneToOneField(
+        Category, on_delete=models.CASCADE, related_name="snapshot"
+    )
+    schema_version = models.PositiveIntegerField(default=1)
+    version = models.PositiveIntegerField(default=0)
+    payload = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Snapshot of category #{self.category_id} v{self.version}"
+
+
+class SearchDocument(models.Model):
+    # Per-product entry of the search index, see api/search.py
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, related_name="search_document"
+    )
+    length = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Search document of product #{self.product_id}"
+
+
+class SearchPosting(models.Model):
+    term = models.CharField(max_length=64)
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="search_postings"
+    )
+    frequency = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["term", "product"], name="unique_search_posting"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> product #{self.product_id}"
+
+
+class FacetDocument(models.Model):
+    # Filter attributes of a product for the facet index, see api/facets.py.
+    # Outlives its product, with `data` null, so every process sees it go.
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+    )
+    data = models.JSONField(null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"Facets of product #{self.product_id}"
+
+
+class RollupPeriod(models.TextChoices):
+    HOUR = "hour"
+    DAY = "day"
+
+
+class SalesRollup(models.Model):
+    # Order totals per hour and day, see api/rollups.py
+    period = models.CharField(max_length=4, choices=RollupPeriod.choices)
+    start = models.DateTimeField()
+    orders = models.PositiveIntegerField(default=0)
+    gross_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    discount_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    shipping_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    net_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["period", "start"], name="unique_sales_rollup")
+        ]
+
+    def __str__(self):
+        return f"Sales for the {self.period} from {self.start}"
+
+
+class ItemSalesRollup(models.Model):
+    # Units sold per product and variant per hour and day.
+    period = models.CharField(max_length=4, choices=RollupPeriod.choices)
+    start = models.DateTimeField()
+    product = models.ForeignKey(
+        Product, on_delete=models.SET_NULL, related_name="+", null=True, blank=True
+    )
+    variant = models.ForeignKey(
+        Variant, on_delete=models.SET_NULL, related_name="+", null=True, blank=True
+    )
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["period", "start"], name="item_rollup_start_idx")
+        ]
+
+    def __str__(self):
+        return f"Units sold in the {self.period} from {self.start}"
+
+
+class PaymentRollup(models.Model):
+    # Payments and successful payments per method per hour and day.
+    period = models.CharField(max_length=4, choices=RollupPeriod.choices)
+    start = models.DateTimeField()
+    payment_method = models.CharField(max_length=100, null=True, blank=True)
+    payments = models.PositiveIntegerField(default=0)
+    succeeded = models.PositiveIntegerField(default=0)
+    amount = models.FloatField(default=0)
+    succeeded_amount = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["period", "start"], name="payment_rollup_start_idx")
+        ]
+
+    def __str__(self):
+        return f"{self.payment_method} payments in the {self.period} from {self.start}"
+
+
+class RollupChange(models.Model):
+    # An hour whose rollups are out of date, written in the same transaction
+    # as the change; `refresh_rollups` rebuilds the hour and deletes the row.
+    hour = models.DateTimeField()
+
+    def __str__(self):
+        return f"Rollups of the hour from {self.hour}"
+
+
 # Signals to generate slug for Category, SubCategory, and Product
 @receiver(pre_save, sender=Category)
 @receiver(pre_save, sender=SubCategory)
@@ -0,0 +1,211 @@
+"""
+N+1 query detection.
+
+Within a request (NPlusOneMiddleware) or a `detect_n_plus_one()` block, every
+SELECT is reduced to its shape: its SQL with parameters left out and IN lists
+collapsed. When one shape has run with `THRESHOLD` different sets of
+parameters (the same query repeated verbatim is a duplicate, not an N+1), the
+query that got there is traced back to its cause, the innermost serializer
+field or ModelAdmin method on the stack, and the model `__str__` it went
+through if any:
+
+    SubCategorySerializer.category
+    ProductSerializer.images
+    Variant.__str__ via OrderItemAdmin.changelist_view
+    ProductAdmin.get_categories
+
+`NPLUSONE["MODE"]` decides what happens next. "raise" raises NPlusOneError
+there and then; the test runner (api/test_runner.py) uses it so the suite
+fails on new N+1s. "log" watches a `SAMPLE_RATE` fraction of requests and
+logs one warning per repeated shape when the request ends. "off" does
+nothing.
+
+Loops that repeat a query on purpose, one per chunk say, are wrapped in
+`allow_repeated_queries()`.
+"""
+
+import logging
+import random
+import re
+import sys
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.admin import ModelAdmin
+from django.db import models
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework import fields, serializers
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "MODE": "log",
+    "THRESHOLD": 3,
+    "SAMPLE_RATE": 0.05,
+}
+
+_current = ContextVar("nplusone", default=None)
+
+_IN_LIST_RE = re.compile(r"%s(?:, %s)+")
+_APP_DIR = str(Path(__file__).resolve().parent)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "NPLUSONE", {})}
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+def query_shape(sql):
+    return _IN_LIST_RE.sub("%s...", sql)
+
+
+def find_cause(frame):
+    """
+    Describe what ran the query executing in `frame`: the innermost
+    serializer field or ModelAdmin method on the stack, after the model
+    `__str__` it went through, or else the innermost frame in this app.
+    """
+    model_str = None
+    in_app = None
+    while frame is not None:
+        owner = frame.f_locals.get("self")
+        name = frame.f_code.co_name
+        if isinstance(owner, fields.Field):
+            field, parent = owner, owner.parent
+            if isinstance(parent, serializers.ListSerializer):
+                # A child of `many=True`: name the list field.
+                field, parent = parent, parent.parent
+            if parent is not None:
+                cause = f"{type(parent).__name__}.{field.field_name}"
+                break
+        elif isinstance(owner, ModelAdmin) and not name.startswith("_"):
+            cause = f"{type(owner).__name__}.{name}"
+            break
+        elif name == "__str__" and isinstance(owner, models.Model) and model_str is None:
+            model_str = f"{type(owner).__name__}.__str__"
+        elif (
+            in_app is None
+            and frame.f_code.co_filename.startswith(_APP_DIR)
+            and frame.f_code.co_filename != __file__
+            and frame.f_code.co_name != "record_query"
+        ):
+            in_app = f"{Path(frame.f_code.co_filename).name}:{frame.f_lineno} in {name}"
+        frame = frame.f_back
+    else:
+        cause = None
+    if model_str is not None:
+        return f"{model_str} via {cause}" if cause else model_str
+    return cause or in_app or "unknown"
+
+
+class Tracker:
+    def __init__(self, mode, threshold):
+        self.mode = mode
+        self.threshold = threshold
+        self.shapes = defaultdict(set)
+        self.causes = {}
+        self.allowed = 0
+
+    def query(self, sql, params):
+        shape = query_shape(sql)
+        seen = self.shapes[shape]
+        seen.add(repr(params))
+        if len(seen) != self.threshold or shape in self.causes:
+            return
+        cause = find_cause(sys._getframe())
+        self.causes[shape] = cause
+        if self.mode == "raise":
+            raise NPlusOneError(
+                f"{self.threshold} queries of the same shape from {cause}: {shape}"
+            )
+
+    def report(self, label):
+        for shape, cause in self.causes.items():
+            logger.warning(
+                "N+1 queries in %s: %d x %s from %s", label, len(self.shapes[shape]), shape, cause
+            )
+
+
+def record_query(execute, sql, params, many, context):
+    tracker = _current.get()
+    if (
+        tracker is not None
+        and not tracker.allowed
+        and not many
+        and sql.lstrip()[:6].upper() == "SELECT"
+    ):
+        tracker.query(sql, params)
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_on_connect(sender, connection, **kwargs):
+    # Wrappers outlive the connection they were added on; add it once.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def detect_n_plus_one(mode=None, threshold=None):
+    config = get_config()
+    tracker = Tracker(mode or config["MODE"], threshold or config["THRESHOLD"])
+    token = _current.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def allow_repeated_queries():
+    tracker = _current.get()
+    if tracker is None:
+        yield
+        return
+    tracker.allowed += 1
+    try:
+        yield
+    finally:
+        tracker.allowed -= 1
+
+
+class NPlusOneMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def watches(self):
+        config = get_config()
+        if config["MODE"] == "off":
+            return False
+        return config["MODE"] == "raise" or random.random() < config["SAMPLE_RATE"]
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.watches():
+            return self.get_response(request)
+        with detect_n_plus_one() as tracker:
+            response = self.get_response(request)
+        tracker.report(f"{request.method} {request.path}")
+        return response
+
+    async def __acall__(self, request):
+        if not self.watches():
+            return await self.get_response(request)
+        with detect_n_plus_one() as tracker:
+            response = await self.get_response(request)
+        tracker.report(f"{request.method} {request.path}")
+        return response
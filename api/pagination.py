@@ -0,0 +1,99 @@
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class PageQuery(Exception):
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+
+class PageQuerySet:
+    """
+    Stands in for the queryset given to CursorPagination.paginate_queryset().
+    Ordering and filtering go through to the real queryset. Taking the page
+    slice raises PageQuery with the query it would run or, given the `rows`
+    that query returned, answers with them.
+    """
+
+    def __init__(self, queryset, rows=None):
+        self.queryset = queryset
+        self.rows = rows
+
+    def __getattr__(self, name):
+        return getattr(self.queryset, name)
+
+    def order_by(self, *fields):
+        return PageQuerySet(self.queryset.order_by(*fields), self.rows)
+
+    def filter(self, *args, **kwargs):
+        return PageQuerySet(self.queryset.filter(*args, **kwargs), self.rows)
+
+    def __getitem__(self, key):
+        if self.rows is None:
+            raise PageQuery(self.queryset[key])
+        return self.rows
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the `-id` ordering every viewset already uses, so
+    deep pages cost the same as the first one. The total is only counted when
+    a client asks for it with `?count=true`.
+    """
+
+    ordering = "-id"
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    count_query_param = "count"
+
+    def wants_count(self, request):
+        return bool(self.count_query_param) and request.query_params.get(
+            self.count_query_param, ""
+        ).lower() in ("1", "true", "yes")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = queryset.count() if self.wants_count(request) else None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """
+        The query paginate_queryset() would read the page with (one row more
+        than the page), or None when the request isn't paginated.
+        """
+        try:
+            super().paginate_queryset(PageQuerySet(queryset), request, view)
+        except PageQuery as page:
+            return page.queryset
+        return None
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset() for async views, with the queries run through the
+        async ORM.
+        """
+        self.count = await queryset.acount() if self.wants_count(request) else None
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        if page_queryset is None:
+            return None
+        rows = [obj async for obj in page_queryset]
+        return super().paginate_queryset(PageQuerySet(queryset, rows), request, view)
+
+    def get_paginated_response(self, data):
+        if self.count is None:
+            return super().get_paginated_response(data)
+        return Response(
+            {
+                "count": self.count,
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["properties"]["count"] = {
+            "type": "integer",
+            "example": 123,
+        }
+        return response_schema
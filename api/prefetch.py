@@ -0,0 +1,108 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField
+
+
+def active_queryset(model):
+    # Nested collections only ever show rows that are switched on in the
+    # admin, oldest first (the order api.fastpath renders them in too).
+    queryset = model._default_manager.order_by("pk")
+    try:
+        model._meta.get_field("is_active")
+    except FieldDoesNotExist:
+        return queryset
+    return queryset.filter(is_active=True)
+
+
+def _nested_serializer(field):
+    if isinstance(field, serializers.ListSerializer):
+        field = field.child
+    if isinstance(field, serializers.ModelSerializer):
+        return field
+    return None
+
+
+def _model_field(model, field):
+    if field.write_only or field.source == "*" or "." in field.source:
+        return None
+    try:
+        model_field = model._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        return None
+    return model_field if model_field.is_relation else None
+
+
+def get_related_lookups(serializer, prefix=""):
+    """
+    Walk a serializer's fields and return the (select_related,
+    prefetch_related) lookups needed to render it without extra queries.
+    """
+    select, prefetch = [], []
+    model = serializer.Meta.model
+    for field in serializer.fields.values():
+        model_field = _model_field(model, field)
+        if model_field is None:
+            continue
+        path = prefix + field.source
+        nested = _nested_serializer(field)
+
+        if model_field.many_to_many or model_field.one_to_many:
+            if nested is not None:
+                queryset = prefetch_for_serializer(
+                    active_queryset(model_field.related_model), nested
+                )
+                prefetch.append(Prefetch(path, queryset=queryset))
+            elif isinstance(field, ManyRelatedField):
+                prefetch.append(path)
+        elif nested is not None:
+            # Forward foreign keys and one-to-ones; plain related fields only
+            # read the `<name>_id` column, so they never need a join.
+            select.append(path)
+            nested_select, nested_prefetch = get_related_lookups(
+                nested, prefix=path + "__"
+            )
+            select.extend(nested_select)
+            prefetch.extend(nested_prefetch)
+    return select, prefetch
+
+
+def get_nested_models(serializer):
+    """
+    Return the models of every nested serializer below `serializer`.
+    """
+    models = []
+    for field in serializer.fields.values():
+        nested = _nested_serializer(field)
+        if nested is None or field.write_only:
+            continue
+        for model in [nested.Meta.model] + get_nested_models(nested):
+            if model not in models:
+                models.append(model)
+    return models
+
+
+def prefetch_for_serializer(queryset, serializer):
+    if isinstance(serializer, type):
+        serializer = serializer()
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    select, prefetch = get_related_lookups(serializer)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+class PrefetchSerializerMixin:
+    """
+    Plan `select_related` / `prefetch_related` from the view's serializer so
+    nested representations cost a fixed number of queries per request. The
+    serializer is built with the request context, so sparse fieldsets only
+    load what they show.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        return prefetch_for_serializer(queryset, self.get_serializer())
@@ -0,0 +1,305 @@
+"""
+Sales rollups.
+
+Hourly and daily totals for the admin reports (`/api/reports/...`):
+
+    SalesRollup       orders, and gross, discount, shipping and net amounts
+    ItemSalesRollup   units and revenue per product and variant
+    PaymentRollup     payments and successful payments per payment method
+
+Buckets start on the hour or at midnight UTC. A write to an order, order item
+or payment appends a RollupChange for its hour in its own transaction, which
+costs the writer one INSERT and takes no lock another writer waits on. The
+`refresh_rollups` command, run every minute or so, recomputes the hours with
+changes from their rows and their days from the days' hours, then deletes
+the changes it handled. Reports lag writes by that much. Recomputing instead
+of adding deltas keeps the tables exact whatever was edited. The
+`backfill_rollups` command rebuilds past buckets the same way, a chunk of
+days at a time.
+"""
+
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import (
+    ItemSalesRollup,
+    Order,
+    OrderItem,
+    Payment,
+    PaymentRollup,
+    RollupChange,
+    RollupPeriod,
+    SalesRollup,
+)
+
+# Payments whose `payment_status` is one of these count as successful.
+SUCCESS_STATUSES = ("paid", "success", "succeeded", "completed")
+
+_successful = Q(payment_status__in=SUCCESS_STATUSES)
+
+# Changes handled per refresh_changed() round.
+CHANGE_BATCH_SIZE = 10000
+
+STEPS = {RollupPeriod.HOUR: timedelta(hours=1), RollupPeriod.DAY: timedelta(days=1)}
+TRUNCATE = {RollupPeriod.HOUR: TruncHour, RollupPeriod.DAY: TruncDay}
+
+# Per rollup: the rows it sums, the time they count at, the columns it is
+# grouped by, and its measures.
+SOURCES = {
+    SalesRollup: (
+        Order,
+        "created_at",
+        (),
+        {
+            "orders": Count("pk"),
+            "gross_amount": Sum("gross_amount"),
+            "discount_amount": Sum("discount_amount"),
+            "shipping_amount": Sum("shipping_amount"),
+            "net_amount": Sum("net_amount"),
+        },
+    ),
+    ItemSalesRollup: (
+        OrderItem,
+        "order__created_at",
+        ("product", "variant"),
+        {
+            "units": Sum("quantity"),
+            "revenue": Sum(
+                F("price") * F("quantity"),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+        },
+    ),
+    PaymentRollup: (
+        Payment,
+        "created_at",
+        ("payment_method",),
+        {
+            "payments": Count("pk"),
+            "succeeded": Count("pk", filter=_successful),
+            "amount": Sum("amount"),
+            "succeeded_amount": Sum("amount", filter=_successful),
+        },
+    ),
+}
+
+
+def floor(moment, period):
+    moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if period == RollupPeriod.DAY else moment
+
+
+def ceil(moment, period):
+    start = floor(moment, period)
+    return start if start == moment else start + STEPS[period]
+
+
+def _aggregate(model, period, start, end):
+    source, time_field, groups, measures = SOURCES[model]
+    if period == RollupPeriod.DAY:
+        # Days add up their hours.
+        time_field = "start"
+        measures = {name: Sum(name) for name in measures}
+        rows = model.objects.filter(period=RollupPeriod.HOUR)
+    else:
+        rows = source.objects.all()
+    rows = (
+        rows.filter(**{f"{time_field}__gte": start, f"{time_field}__lt": end})
+        .annotate(bucket=TRUNCATE[period](time_field, tzinfo=dt_timezone.utc))
+        .values("bucket", *groups)
+        # Named apart from the columns they sum.
+        .annotate(**{f"total_{name}": measure for name, measure in measures.items()})
+        .order_by()
+    )
+    columns = {group: model._meta.get_field(group).attname for group in groups}
+    return [
+        model(
+            period=period,
+            start=row["bucket"],
+            **{column: row[group] for group, column in columns.items()},
+            **{name: row[f"total_{name}"] or 0 for name in measures},
+        )
+        for row in rows
+    ]
+
+
+def rebuild(period, start, end):
+    """Recompute the `period` buckets between `start` and `end`."""
+    start, end = floor(start, period), ceil(end, period)
+    step = STEPS[period]
+    starts = [start + step * i for i in range((end - start) // step)]
+    with transaction.atomic():
+        # Lock the buckets, creating missing ones, before reading anything:
+        # concurrent rebuilds of a bucket take turns, and each one reads
+        # what the one before it committed.
+        SalesRollup.objects.bulk_create(
+            [SalesRollup(period=period, start=moment) for moment in starts],
+            ignore_conflicts=True,
+        )
+        list(
+            SalesRollup.objects.select_for_update()
+            .filter(period=period, start__gte=start, start__lt=end)
+            .order_by("start")
+            .values_list("pk", flat=True)
+        )
+        for model in SOURCES:
+            rows = _aggregate(model, period, start, end)
+            if model is SalesRollup:
+                # One row per bucket, empty ones included, so charts have no gaps.
+                found = {row.start for row in rows}
+                rows += [
+                    SalesRollup(period=period, start=moment)
+                    for moment in starts
+                    if moment not in found
+                ]
+            model.objects.filter(period=period, start__gte=start, start__lt=end).delete()
+            model.objects.bulk_create(rows, batch_size=1000)
+
+
+def refresh(start, end):
+    """Recompute the hours between `start` and `end`, then their days."""
+    rebuild(RollupPeriod.HOUR, start, end)
+    rebuild(RollupPeriod.DAY, start, end)
+
+
+def refresh_hours(hours):
+    # One refresh per run of consecutive hours.
+    step = STEPS[RollupPeriod.HOUR]
+    run_start = run_end = None
+    for hour in hours:
+        if run_end is not None and hour != run_end:
+            refresh(run_start, run_end)
+            run_start = None
+        if run_start is None:
+            run_start = hour
+        run_end = hour + step
+    if run_start is not None:
+        refresh(run_start, run_end)
+
+
+# Reports
+
+def _range(model, period, start, end):
+    return model.objects.filter(
+        period=period, start__gte=floor(start, period), start__lt=ceil(end, period)
+    )
+
+
+def _money(value):
+    return str(round(value or 0, 2))
+
+
+def sales_report(period, start, end):
+    buckets = list(
+        _range(SalesRollup, period, start, end)
+        .order_by("start")
+        .values("start", *SOURCES[SalesRollup][3])
+    )
+    totals = {
+        name: sum((bucket[name] for bucket in buckets), 0)
+        for name in SOURCES[SalesRollup][3]
+    }
+    for row in [*buckets, totals]:
+        for name in ("gross_amount", "discount_amount", "shipping_amount", "net_amount"):
+            row[name] = _money(row[name])
+    return {"buckets": buckets, "totals": totals}
+
+
+def item_report(period, start, end, limit=20):
+    rows = (
+        _range(ItemSalesRollup, period, start, end)
+        .values("product", "variant")
+        .annotate(total_units=Sum("units"), total_revenue=Sum("revenue"))
+        .order_by("-total_units", "product", "variant")[:limit]
+    )
+    return {
+        "results": [
+            {
+                "product": row["product"],
+                "variant": row["variant"],
+                "units": row["total_units"],
+                "revenue": _money(row["total_revenue"]),
+            }
+            for row in rows
+        ]
+    }
+
+
+def payment_report(period, start, end):
+    measures = ("payments", "succeeded", "amount", "succeeded_amount")
+    rows = (
+        _range(PaymentRollup, period, start, end)
+        .values("payment_method")
+        .annotate(**{f"total_{name}": Sum(name) for name in measures})
+        .order_by("-total_payments", "payment_method")
+    )
+    results = []
+    for row in rows:
+        payments, succeeded = row["total_payments"], row["total_succeeded"]
+        results.append(
+            {
+                "payment_method": row["payment_method"],
+                "payments": payments,
+                "succeeded": succeeded,
+                "success_rate": round(succeeded / payments, 4) if payments else None,
+                "amount": round(row["total_amount"], 2),
+                "succeeded_amount": round(row["total_succeeded_amount"], 2),
+            }
+        )
+    return {"results": results}
+
+
+# Incremental maintenance
+
+
+def mark_changed(moments):
+    RollupChange.objects.bulk_create(
+        RollupChange(hour=floor(moment, RollupPeriod.HOUR))
+        for moment in moments
+        if moment is not None
+    )
+
+
+def refresh_changed(batch_size=CHANGE_BATCH_SIZE):
+    """
+    Recompute the hours with recorded changes, and their days. Returns the
+    number of changes handled.
+    """
+    handled = 0
+    while True:
+        changes = list(
+            RollupChange.objects.order_by("pk").values_list("pk", "hour")[:batch_size]
+        )
+        if not changes:
+            return handled
+        refresh_hours(sorted({hour for _, hour in changes}))
+        # Only the rows read: a change committed meanwhile, even with a
+        # lower id, waits for the next round.
+        RollupChange.objects.filter(pk__in=[pk for pk, _ in changes]).delete()
+        handled += len(changes)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def order_or_payment_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        mark_changed([instance.created_at])
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def order_item_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Gone already when the order's deletion took its items along; the
+    # order marks its own hour then.
+    mark_changed(
+        Order.objects.filter(pk=instance.order_id).values_list("created_at", flat=True)
+    )
@@ -0,0 +1,157 @@
+"""
+Read replicas for catalog GETs.
+
+    DATABASES = {"default": {...}, "replica": {...}}
+    DATABASE_ROUTERS = ["api.routers.ReplicaRouter"]
+    DATABASE_REPLICATION = {"REPLICAS": ["replica"], ...}
+
+Views with ReplicaReadMixin run safe-method requests with `use_replicas` set,
+and ReplicaRouter sends their reads to a replica whose replication lag is
+within `MAX_LAG` seconds, or to the primary when none is. Everything else,
+writes and reads inside a transaction on the primary included, stays on the
+primary.
+
+Views with PrimaryPinMixin (orders and checkout) set a cookie on successful
+writes, so that the user's reads go to the primary for `PIN_SECONDS` and see
+their own order and the stock it reserved, whatever the replicas' lag.
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+DEFAULTS = {
+    "REPLICAS": [],
+    "MAX_LAG": 5,
+    "LAG_CHECK_INTERVAL": 10,
+    "PIN_SECONDS": 10,
+    "PIN_COOKIE": "read_primary",
+}
+
+use_replicas = ContextVar("use_replicas", default=False)
+
+_lags = {}
+_lags_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "DATABASE_REPLICATION", {})}
+
+
+def replica_settle_seconds():
+    """
+    How long a committed write may take to show up in what this request
+    reads, or 0 when it only reads from the primary.
+    """
+    config = get_config()
+    if not use_replicas.get() or not config["REPLICAS"]:
+        return 0
+    # A replica's lag is only checked every LAG_CHECK_INTERVAL seconds.
+    return config["MAX_LAG"] + config["LAG_CHECK_INTERVAL"]
+
+
+def replica_lag(alias):
+    """
+    Seconds the replica `alias` is behind its primary. A database that isn't
+    replicating (like a local stand-in) has no lag.
+    """
+    connection = connections[alias]
+    if connection.vendor != "mysql":
+        return 0
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except DatabaseError:
+            # Before MySQL 8.0.22.
+            cursor.execute("SHOW SLAVE STATUS")
+        row = cursor.fetchone()
+        if row is None:
+            return 0
+        columns = [column[0] for column in cursor.description]
+    status = dict(zip(columns, row))
+    lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+    # NULL while replication is stopped.
+    return float("inf") if lag is None else lag
+
+
+def get_lag(alias, interval):
+    now = time.monotonic()
+    with _lags_lock:
+        checked_at, lag = _lags.get(alias, (None, None))
+    if checked_at is not None and now - checked_at < interval:
+        return lag
+    try:
+        lag = replica_lag(alias)
+    except Exception:
+        lag = float("inf")
+    with _lags_lock:
+        _lags[alias] = (now, lag)
+    return lag
+
+
+def get_replica():
+    config = get_config()
+    healthy = [
+        alias
+        for alias in config["REPLICAS"]
+        if get_lag(alias, config["LAG_CHECK_INTERVAL"]) <= config["MAX_LAG"]
+    ]
+    return random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def reading_from_replicas(enabled=True):
+    token = use_replicas.set(enabled)
+    try:
+        yield
+    finally:
+        use_replicas.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not use_replicas.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return get_replica()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+
+class ReplicaReadMixin:
+    def replica_reads(self, request):
+        """A context for handling `request`, reading from replicas if it can."""
+        config = get_config()
+        return reading_from_replicas(
+            request.method in SAFE_METHODS and config["PIN_COOKIE"] not in request.COOKIES
+        )
+
+    def dispatch(self, request, *args, **kwargs):
+        with self.replica_reads(request):
+            return super().dispatch(request, *args, **kwargs)
+
+
+class PrimaryPinMixin:
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            config = get_config()
+            if config["REPLICAS"]:
+                response.set_cookie(
+                    config["PIN_COOKIE"],
+                    "1",
+                    max_age=config["PIN_SECONDS"],
+                    httponly=True,
+                    samesite="Lax",
+                )
+        return response
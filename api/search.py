@@ -0,0 +1,192 @@
+"""
+Product search.
+
+An inverted index over product names, descriptions and the names of their
+categories and subcategories lives in `SearchPosting` (one row per term and
+product, with a field-weighted frequency) and `SearchDocument` (weighted
+document length). Results are ranked with BM25; the last query term also
+matches as a prefix for typeahead. Prefixes are looked up as a
+`term >= prefix AND term < prefix + U+FFFF` range so the (term, product)
+index serves them on both SQLite and MySQL.
+"""
+
+import math
+import re
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Avg
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+
+from .deferred import CommitBatch
+from .models import Category, Product, SearchDocument, SearchPosting, SubCategory
+from .signals import catalog_bulk_changed
+
+FIELD_WEIGHTS = {"name": 3, "category": 2, "subcategory": 2, "description": 1}
+STOP_WORDS = {"a", "an", "and", "for", "in", "of", "on", "or", "the", "to", "with"}
+MAX_TERM_LENGTH = 64
+MAX_PREFIX_EXPANSIONS = 50
+INDEX_BATCH_SIZE = 500
+K1 = 1.2
+B = 0.75
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text, stop_words=STOP_WORDS):
+    return [
+        token[:MAX_TERM_LENGTH]
+        for token in TOKEN_RE.findall((text or "").lower())
+        if token not in stop_words
+    ]
+
+
+def product_terms(product):
+    fields = {
+        "name": product.name,
+        "description": product.description,
+        "category": " ".join(category.name for category in product.category.all()),
+        "subcategory": " ".join(
+            subcategory.name for subcategory in product.subcategory.all()
+        ),
+    }
+    terms = Counter()
+    for field, text in fields.items():
+        for token in tokenize(text):
+            terms[token] += FIELD_WEIGHTS[field]
+    return terms
+
+
+def index_products(product_ids):
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), INDEX_BATCH_SIZE):
+        batch = product_ids[start:start + INDEX_BATCH_SIZE]
+        products = Product.objects.filter(pk__in=batch).prefetch_related(
+            "category", "subcategory"
+        )
+        documents, postings = [], []
+        for product in products:
+            terms = product_terms(product)
+            documents.append(
+                SearchDocument(product=product, length=sum(terms.values()))
+            )
+            postings.extend(
+                SearchPosting(term=term, product=product, frequency=frequency)
+                for term, frequency in terms.items()
+            )
+        with transaction.atomic():
+            SearchPosting.objects.filter(product_id__in=batch).delete()
+            SearchDocument.objects.filter(product_id__in=batch).delete()
+            SearchDocument.objects.bulk_create(documents)
+            SearchPosting.objects.bulk_create(postings, batch_size=INDEX_BATCH_SIZE)
+
+
+def search_products(query, limit=20):
+    """
+    Return `[(product_id, score), ...]` for active products, best first.
+    """
+    words = tokenize(query, stop_words=())
+    if not words:
+        return []
+    prefix = None
+    if not query[-1:].isspace():
+        # The word being typed, stop word or not: "drill for" must not widen
+        # "drill" into every term it starts.
+        prefix = words.pop()
+    terms = [word for word in words if word not in STOP_WORDS]
+
+    # Each query slot maps to the index terms that satisfy it.
+    slots = [[term] for term in dict.fromkeys(terms)]
+    if prefix:
+        expansions = list(
+            SearchPosting.objects.filter(term__gte=prefix, term__lt=prefix + "\uffff")
+            .order_by("term")
+            .values_list("term", flat=True)
+            .distinct()[:MAX_PREFIX_EXPANSIONS]
+        )
+        if expansions:
+            slots.append(expansions)
+    if not slots:
+        return []
+
+    postings = defaultdict(dict)
+    for term, product_id, frequency in SearchPosting.objects.filter(
+        term__in={term for slot in slots for term in slot},
+        product__is_active=True,
+    ).values_list("term", "product_id", "frequency"):
+        postings[term][product_id] = frequency
+    if not postings:
+        return []
+
+    total = SearchDocument.objects.filter(product__is_active=True)
+    document_count = total.count()
+    average_length = total.aggregate(average=Avg("length"))["average"] or 1
+    lengths = dict(
+        SearchDocument.objects.filter(
+            product_id__in={pk for matches in postings.values() for pk in matches}
+        ).values_list("product_id", "length")
+    )
+
+    scores = Counter()
+    for slot in slots:
+        slot_scores = {}
+        for term in slot:
+            matches = postings.get(term, {})
+            idf = math.log(
+                1 + (document_count - len(matches) + 0.5) / (len(matches) + 0.5)
+            )
+            for product_id, frequency in matches.items():
+                norm = K1 * (1 - B + B * lengths.get(product_id, 0) / average_length)
+                score = idf * frequency * (K1 + 1) / (frequency + norm)
+                slot_scores[product_id] = max(slot_scores.get(product_id, 0), score)
+        scores.update(slot_scores)
+    return scores.most_common(limit)
+
+
+# Incremental indexing
+
+stale_products = CommitBatch(index_products)
+
+
+@receiver(post_save, sender=Product)
+def reindex_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        stale_products.add({instance.pk})
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=SubCategory)
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=SubCategory)
+def reindex_group_products(sender, instance, raw=False, **kwargs):
+    # Deleting the group drops its membership rows without m2m_changed.
+    if raw:
+        return
+    if sender is Category:
+        products = instance.products_in_category
+    else:
+        products = instance.products_in_subcategory
+    stale_products.add(products.values_list("pk", flat=True))
+
+
+@receiver(m2m_changed, sender=Product.category.through)
+@receiver(m2m_changed, sender=Product.subcategory.through)
+def reindex_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        stale_products.add({instance.pk})
+    elif action == "pre_clear":
+        if sender is Product.category.through:
+            products = instance.products_in_category
+        else:
+            products = instance.products_in_subcategory
+        stale_products.add(products.values_list("pk", flat=True))
+    else:
+        stale_products.add(pk_set)
+
+
+@receiver(catalog_bulk_changed, sender=Product)
+def reindex_bulk_products(sender, pks, **kwargs):
+    stale_products.add(pks)
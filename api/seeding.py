@@ -0,0 +1,347 @@
+"""
+Synthetic catalog and order data for benchmarks and query plan checks.
+
+Rows are written with `bulk_create` in batches, so no model signals fire;
+`seed_catalog` announces the new catalog rows through `catalog_bulk_changed`
+afterwards, which refreshes caches, category snapshots and the search index
+exactly like any other bulk change, and rebuilds the sales rollups of the
+hours the orders were inserted in.
+"""
+
+import random
+import uuid
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    Category,
+    Discount,
+    Image,
+    InventoryMovement,
+    Order,
+    OrderItem,
+    Payment,
+    Product,
+    ShippingAddress,
+    SubCategory,
+    User,
+    Variant,
+)
+from .rollups import refresh as refresh_rollups
+from .signals import catalog_bulk_changed
+
+SCALES = {
+    "small": {
+        "categories": 20,
+        "subcategories": 5,
+        "products": 2_000,
+        "variants": 3,
+        "images": 2,
+        "orders": 500,
+        "items": 3,
+        "users": 200,
+    },
+    "large": {
+        "categories": 2_000,
+        "subcategories": 5,
+        "products": 200_000,
+        "variants": 3,
+        "images": 2,
+        "orders": 100_000,
+        "items": 3,
+        "users": 20_000,
+    },
+}
+
+WORDS = (
+    "steel cordless compact heavy duty pro mini smart rapid precision electric "
+    "manual digital industrial classic portable magnetic adjustable"
+).split()
+NOUNS = (
+    "drill hammer wrench saw grinder sander level clamp ladder toolbox "
+    "screwdriver pliers chisel cutter blower pump"
+).split()
+COLORS = ["red", "blue", "black", "yellow", "green", "orange"]
+CITIES = ["Dhaka", "Chattogram", "Khulna", "Rajshahi", "Sylhet", "Barishal"]
+
+
+def _insert(model, rows, batch_size):
+    """
+    bulk_create `rows` and return the new primary keys in insertion order.
+    The keys are read back because bulk_create doesn't set them on MySQL.
+    """
+    last_id = model._default_manager.order_by("-pk").values_list("pk", flat=True).first()
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            model._default_manager.bulk_create(batch)
+            batch = []
+    if batch:
+        model._default_manager.bulk_create(batch)
+    return list(
+        model._default_manager.filter(pk__gt=last_id or 0)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+
+def _price(rng, low=5, high=5000):
+    return Decimal(rng.randrange(low * 100, high * 100)) / 100
+
+
+def seed_catalog(
+    categories,
+    subcategories,
+    products,
+    variants,
+    images,
+    orders,
+    items,
+    users,
+    batch_size=1000,
+    seed=0,
+    refresh=True,
+    log=None,
+):
+    """
+    Insert a synthetic dataset and return the number of rows per model.
+
+    `subcategories`, `variants`, `images` and `items` are per parent row.
+    Set `refresh=False` to skip rebuilding snapshots, the search index and
+    the sales rollups.
+    """
+    rng = random.Random(seed)
+    run = uuid.uuid4().hex[:8]
+    started = timezone.now()
+    counts = {}
+
+    def insert(model, rows):
+        pks = _insert(model, rows, batch_size)
+        counts[model._meta.model_name] = len(pks)
+        if log:
+            log(f"{model._meta.label}: {len(pks)}")
+        return pks
+
+    with transaction.atomic():
+        discount_ids = insert(
+            Discount,
+            (
+                Discount(discount_value=Decimal(rng.choice([5, 10, 15, 20, 25])))
+                for _ in range(max(1, categories // 10))
+            ),
+        )
+        category_ids = insert(
+            Category,
+            (
+                Category(name=f"Category {i}", slug=f"seed-{run}-category-{i}")
+                for i in range(categories)
+            ),
+        )
+        subcategory_ids = insert(
+            SubCategory,
+            (
+                SubCategory(
+                    name=f"Subcategory {i}.{j}",
+                    slug=f"seed-{run}-subcategory-{i}-{j}",
+                    category_id=category_id,
+                )
+                for i, category_id in enumerate(category_ids)
+                for j in range(subcategories)
+            ),
+        )
+        # Rows come back in insertion order, so parents line up by position.
+        subcategory_parents = dict(
+            zip(
+                subcategory_ids,
+                (pk for pk in category_ids for _ in range(subcategories)),
+            )
+        )
+
+        prices = []
+        product_stock = []
+
+        def product(i):
+            prices.append(_price(rng))
+            product_stock.append(rng.randrange(0, 500))
+            return Product(
+                name=f"{rng.choice(WORDS).title()} {rng.choice(NOUNS)} {i}",
+                slug=f"seed-{run}-product-{i}",
+                description=" ".join(rng.choices(WORDS + NOUNS, k=12)),
+                price=prices[-1],
+                quantity=product_stock[-1],
+                discount_id=rng.choice(discount_ids) if rng.random() < 0.3 else None,
+                is_active=rng.random() < 0.95,
+            )
+
+        product_ids = insert(Product, (product(i) for i in range(products)))
+
+        memberships = [
+            (product_id, rng.choice(subcategory_ids))
+            for product_id in (product_ids if subcategory_ids else [])
+        ]
+        insert(
+            Product.subcategory.through,
+            (
+                Product.subcategory.through(product_id=product_id, subcategory_id=sub_id)
+                for product_id, sub_id in memberships
+            ),
+        )
+        insert(
+            Product.category.through,
+            (
+                Product.category.through(
+                    product_id=product_id, category_id=subcategory_parents[sub_id]
+                )
+                for product_id, sub_id in memberships
+            ),
+        )
+
+        variant_stock = []
+
+        def variant(product_id, size):
+            color, price = rng.choice(COLORS), _price(rng)
+            variant_stock.append(rng.randrange(0, 100))
+            return Variant(
+                product_id=product_id,
+                size=size,
+                color=color,
+                price=price,
+                quantity=variant_stock[-1],
+                discount_id=rng.choice(discount_ids) if rng.random() < 0.1 else None,
+            )
+
+        variant_ids = insert(
+            Variant,
+            (variant(product_id, size) for product_id in product_ids for size in range(variants)),
+        )
+        insert(
+            InventoryMovement,
+            (
+                InventoryMovement(
+                    kind=InventoryMovement.Kind.ADJUSTMENT,
+                    **{field: pk},
+                    quantity=quantity,
+                    note="Opening stock",
+                )
+                for field, pks, stock in (
+                    ("product_id", product_ids, product_stock),
+                    ("variant_id", variant_ids, variant_stock),
+                )
+                for pk, quantity in zip(pks, stock)
+                if quantity
+            ),
+        )
+        image_ids = insert(
+            Image,
+            [
+                Image(product_id=product_id, image=f"images/seed/{product_id}-{n}.jpg")
+                for product_id in product_ids
+                for n in range(images)
+            ]
+            + [
+                Image(category_id=category_id, image=f"images/seed/c{category_id}.jpg")
+                for category_id in category_ids
+            ]
+            + [
+                Image(
+                    subcategory_id=subcategory_id,
+                    image=f"images/seed/s{subcategory_id}.jpg",
+                )
+                for subcategory_id in subcategory_ids
+            ],
+        )
+
+        user_ids = insert(
+            User,
+            (
+                User(username=f"seed-{run}-user-{i}", email=f"seed-{run}-user-{i}@example.com")
+                for i in range(users)
+            ),
+        )
+
+        # (product index, quantity) pairs per order, priced up front so the
+        # orders can be inserted with their totals.
+        baskets = [
+            [
+                (index, rng.randrange(1, 4))
+                for index in rng.sample(range(len(product_ids)), min(items, len(product_ids)))
+            ]
+            for _ in range(orders)
+        ]
+        totals = [
+            sum((prices[index] * quantity for index, quantity in basket), Decimal("0"))
+            for basket in baskets
+        ]
+        order_ids = insert(
+            Order,
+            (
+                Order(
+                    user_id=rng.choice(user_ids) if user_ids else None,
+                    gross_amount=total,
+                    total=total,
+                    net_amount=total,
+                    discount_amount=Decimal("0"),
+                    shipping_amount=Decimal("0"),
+                )
+                for total in totals
+            ),
+        )
+        insert(
+            OrderItem,
+            (
+                OrderItem(
+                    order_id=order_id,
+                    product_id=product_ids[index],
+                    quantity=quantity,
+                    price=prices[index],
+                )
+                for order_id, basket in zip(order_ids, baskets)
+                for index, quantity in basket
+            ),
+        )
+        insert(
+            ShippingAddress,
+            (
+                ShippingAddress(
+                    order_id=order_id,
+                    full_address=f"House {rng.randrange(1, 200)}, Road {rng.randrange(1, 40)}",
+                    city=rng.choice(CITIES),
+                    zip_code=str(rng.randrange(1000, 9999)),
+                )
+                for order_id in order_ids
+            ),
+        )
+        insert(
+            Payment,
+            (
+                Payment(
+                    order_id=order_id,
+                    payment_method=rng.choice(["bkash", "nagad", "card", "cash"]),
+                    payment_status="paid",
+                    amount=float(total),
+                    transaction_id=f"seed-{run}-txn-{order_id}",
+                    status="completed",
+                )
+                for order_id, total in zip(order_ids, totals)
+            ),
+        )
+
+        if refresh:
+            # Derived data (snapshots, search index, caches) is rebuilt after
+            # commit by the usual bulk change receivers. Chunked to stay under
+            # the database's query parameter limit.
+            for model, pks in (
+                (Category, category_ids),
+                (Product, product_ids),
+                (Variant, variant_ids),
+                (Image, image_ids),
+            ):
+                for start in range(0, len(pks), batch_size):
+                    catalog_bulk_changed.send(
+                        sender=model, pks=pks[start:start + batch_size]
+                    )
+            transaction.on_commit(lambda: refresh_rollups(started, timezone.now()))
+    return counts
@@ -1,3 +1,8 @@
+from collections import Counter
+from decimal import Decimal
+
+from django.core.files.storage import default_storage
+from django.db import transaction
 from rest_framework import serializers
 from .models import (
     Category,
@@ -12,10 +17,40 @@ from .models import (
     OrderItem,
     Payment,
     ContractForm,
+    InventoryMovement,
 )
-
-
-class ImageSerializer(serializers.HyperlinkedModelSerializer):
+from .bulk import BulkRowSerializer, fill_pks
+from .fieldsets import FieldsetSerializerMixin
+from .inventory import record_movements, set_stock
+
+
+class SrcsetField(serializers.Field):
+    """
+    Read-only `{format: "<url> 160w, <url> 320w, ..."}` map of an image's
+    derivatives (see api/derivatives.py), or None until they are rendered.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs["read_only"] = True
+        kwargs.setdefault("source", "derivatives")
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get("request")
+        srcset = {}
+        for name, files in value.get("files", {}).items():
+            entries = []
+            for width, path in sorted(files.items(), key=lambda item: int(item[0])):
+                url = default_storage.url(path)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                entries.append(f"{url} {width}w")
+            srcset[name] = ", ".join(entries)
+        return srcset or None
+
+
+class ImageSerializer(FieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
+    srcset = SrcsetField()
 
     class Meta:
         model = Image
@@ -27,35 +62,63 @@ class ImageSerializer(serializers.HyperlinkedModelSerializer):
             "category",
             "subcategory",
             "url",
+            "derivatives",
         ]
 
 
-class DiscountSerializer(serializers.HyperlinkedModelSerializer):
+class DiscountSerializer(FieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Discount
         exclude = ["created_at", "updated_at", "is_active"]
 
 
-class VariantSerializer(serializers.HyperlinkedModelSerializer):
+class StockSerializerMixin:
+    """
+    Changes to `quantity` are recorded in the inventory ledger as adjustments
+    (a new row's stock as its opening stock, see api/inventory.py).
+    """
+
+    def update(self, instance, validated_data):
+        if "quantity" not in validated_data:
+            return super().update(instance, validated_data)
+        quantity = validated_data.pop("quantity")
+        request = self.context.get("request")
+        user = request.user if request and request.user.is_authenticated else None
+        with transaction.atomic():
+            instance = super().update(instance, validated_data)
+            set_stock(instance, quantity, user=user)
+        return instance
+
+
+class VariantSerializer(
+    StockSerializerMixin, FieldsetSerializerMixin, serializers.HyperlinkedModelSerializer
+):
     discount = DiscountSerializer(many=False, read_only=True)
+    image_srcset = SrcsetField()
 
     class Meta:
         model = Variant
-        exclude = ["created_at", "updated_at", "is_active"]
+        exclude = ["created_at", "updated_at", "is_active", "derivatives"]
+        expandable_fields = {
+            "product": ("api.serializers.ProductSerializer", {"read_only": True}),
+        }
         extra_kwargs = {
             "id": {"read_only": False},  # Make 'id' field writable
         }
 
 
-class SubCategorySerializer(serializers.ModelSerializer):
+class SubCategorySerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     images = ImageSerializer(many=True, read_only=True)
+    bannerImage_srcset = SrcsetField()
 
     class Meta:
         model = SubCategory
-        exclude = ["created_at", "updated_at", "is_active"]
+        exclude = ["created_at", "updated_at", "is_active", "derivatives"]
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(
+    StockSerializerMixin, FieldsetSerializerMixin, serializers.ModelSerializer
+):
     images = ImageSerializer(many=True, read_only=True)
     variants = VariantSerializer(many=True, read_only=True)
     discount = DiscountSerializer(many=False, read_only=True)
@@ -63,15 +126,52 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         exclude = ["created_at", "updated_at", "is_active", "category", "subcategory"]
+        expandable_fields = {
+            "category": (
+                "api.serializers.CategoryListSerializer",
+                {"many": True, "read_only": True},
+            ),
+            "subcategory": (
+                "api.serializers.SubCategoryListSerializer",
+                {"many": True, "read_only": True},
+            ),
+        }
+
+
+class ProductBulkSerializer(BulkRowSerializer):
+    class Meta:
+        model = Product
+        fields = ["slug", "name", "description", "discount", "price", "quantity", "is_active"]
+
+
+class VariantBulkSerializer(BulkRowSerializer):
+    class Meta:
+        model = Variant
+        fields = ["id", "product", "discount", "size", "color", "price", "quantity", "is_active"]
+        extra_kwargs = {
+            "id": {"read_only": False, "required": False},
+        }
+
+
+class ImageBulkSerializer(BulkRowSerializer):
+    # The name of a file already in storage; uploads go through /api/image/.
+    image = serializers.CharField(max_length=100)
+
+    class Meta:
+        model = Image
+        fields = ["id", "product", "category", "subcategory", "image", "is_active"]
+        extra_kwargs = {
+            "id": {"read_only": False, "required": False},
+        }
 
 
-class ContractFormSerializer(serializers.ModelSerializer):
+class ContractFormSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = ContractForm
         exclude = ["created_at", "updated_at", "is_active"]
 
 
-class CategorySerializer(serializers.HyperlinkedModelSerializer):
+class CategorySerializer(FieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     images = ImageSerializer(many=True, read_only=True)
     products = ProductSerializer(many=True, read_only=True)
     subcategories = SubCategorySerializer(many=True, read_only=True)
@@ -81,7 +181,7 @@ class CategorySerializer(serializers.HyperlinkedModelSerializer):
         exclude = ["created_at", "updated_at", "is_active"]
 
 
-class CategoryDetailSerializer(serializers.ModelSerializer):
+class CategoryDetailSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     images = ImageSerializer(many=True, read_only=True)
     products = ProductSerializer(
         many=True, read_only=True, source="products_in_category"
@@ -101,7 +201,7 @@ class CategoryDetailSerializer(serializers.ModelSerializer):
         ]
 
 
-class CategoryListSerializer(serializers.ModelSerializer):
+class CategoryListSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     images = ImageSerializer(many=True, read_only=True)
 
     class Meta:
@@ -109,7 +209,7 @@ class CategoryListSerializer(serializers.ModelSerializer):
         fields = ["url", "name", "description", "slug", "images"]
 
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
+class UserSerializer(FieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     password = serializers.CharField(write_only=True)
 
     class Meta:
@@ -118,32 +218,50 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
         read_only_fields = ["id", "url"]
 
 
-class OrderSerializer(serializers.HyperlinkedModelSerializer):
+class OrderSerializer(FieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Order
         exclude = ["created_at", "updated_at", "is_active"]
+        expandable_fields = {
+            "order_items": (
+                "api.serializers.OrderItemSerializer",
+                {"many": True, "read_only": True},
+            ),
+            "shipping_address": (
+                "api.serializers.CheckoutAddressSerializer",
+                {"read_only": True},
+            ),
+            "payments": (
+                "api.serializers.PaymentSerializer",
+                {"many": True, "read_only": True},
+            ),
+        }
 
 
-class ShippingAddressSerializer(serializers.HyperlinkedModelSerializer):
+class ShippingAddressSerializer(FieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = ShippingAddress
         exclude = ["created_at", "updated_at", "is_active"]
 
 
-class OrderItemSerializer(serializers.HyperlinkedModelSerializer):
+class OrderItemSerializer(FieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = OrderItem
         exclude = ["created_at", "updated_at", "is_active"]
+        expandable_fields = {
+            "product": ("api.serializers.ProductSerializer", {"read_only": True}),
+            "variant": ("api.serializers.VariantSerializer", {"read_only": True}),
+        }
 
 
-class PaymentSerializer(serializers.HyperlinkedModelSerializer):
+class PaymentSerializer(FieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = Payment
         exclude = ["created_at", "updated_at", "is_active"]
 
 
-class SubCategoryDetailSerializer(serializers.ModelSerializer):
+class SubCategoryDetailSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     images = ImageSerializer(many=True, read_only=True)
     products = ProductSerializer(
         many=True, read_only=True, source="products_in_subcategory"
@@ -154,7 +272,7 @@ class SubCategoryDetailSerializer(serializers.ModelSerializer):
         fields = ["url", "images", "products", "name", "description", "slug", "id"]
 
 
-class SubCategoryListSerializer(serializers.ModelSerializer):
+class SubCategoryListSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     images = ImageSerializer(many=True, read_only=True)
 
     class Meta:
@@ -162,6 +280,132 @@ class SubCategoryListSerializer(serializers.ModelSerializer):
         fields = ["url", "name", "description", "slug", "images"]
 
 
+class CheckoutItemSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    variant = serializers.IntegerField(required=False, allow_null=True)
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class CheckoutAddressSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ShippingAddress
+        fields = ["full_address", "city", "zip_code"]
+
+
+class CheckoutSerializer(serializers.Serializer):
+    """
+    Places an order with its items and shipping address in one transaction.
+    Stock is reserved under row locks taken in primary key order (products
+    first, then variants) so concurrent checkouts cannot oversell. Items
+    with a variant draw on the variant's stock, others on the product's; each
+    item's sale is recorded in the inventory ledger.
+    """
+
+    items = CheckoutItemSerializer(many=True, allow_empty=False)
+    shipping_address = CheckoutAddressSerializer()
+    shipping_amount = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=Decimal("0"), default=Decimal("0.00")
+    )
+
+    def lock_rows(self, model, pks):
+        rows = model.objects.select_for_update().filter(pk__in=sorted(pks)).order_by("pk")
+        rows = {row.pk: row for row in rows}
+        discounts = Discount.objects.in_bulk(
+            {row.discount_id for row in rows.values() if row.discount_id}
+        )
+        for row in rows.values():
+            row.discount = discounts.get(row.discount_id)
+        return rows
+
+    def create(self, validated_data):
+        items = validated_data["items"]
+        request = self.context.get("request")
+        user = request.user if request and request.user.is_authenticated else None
+
+        with transaction.atomic():
+            products = self.lock_rows(Product, {item["product"] for item in items})
+            variants = self.lock_rows(
+                Variant, {item["variant"] for item in items if item.get("variant")}
+            )
+
+            errors, lines, reserved = [], [], Counter()
+            for index, item in enumerate(items):
+                product = products.get(item["product"])
+                variant = variants.get(item.get("variant"))
+                stock_row = variant if item.get("variant") else product
+                error = {}
+                if product is None or not product.is_active:
+                    error["product"] = ["Product is not available."]
+                elif item.get("variant") and (
+                    variant is None
+                    or not variant.is_active
+                    or variant.product_id != product.pk
+                ):
+                    error["variant"] = ["Variant is not available for this product."]
+                elif stock_row.price is None:
+                    error["product"] = ["Product has no price."]
+                errors.append(error)
+                if not error:
+                    key = (type(stock_row), stock_row.pk)
+                    reserved[key] += item["quantity"]
+                    lines.append((index, product, variant, stock_row, item["quantity"]))
+
+            for index, _, _, stock_row, _ in lines:
+                available = stock_row.quantity or 0
+                if available < reserved[(type(stock_row), stock_row.pk)]:
+                    errors[index]["quantity"] = [f"Only {available} left in stock."]
+            if any(errors):
+                raise serializers.ValidationError({"items": errors})
+
+            gross = sum(row.price * quantity for *_, row, quantity in lines)
+            total = sum(row.discounted_price * quantity for *_, row, quantity in lines)
+            shipping = validated_data["shipping_amount"]
+            order = Order.objects.create(
+                user=user,
+                gross_amount=gross,
+                total=total,
+                discount_amount=gross - total,
+                shipping_amount=shipping,
+                net_amount=total + shipping,
+            )
+            order_items = [
+                OrderItem(
+                    order=order,
+                    product=product,
+                    variant=variant,
+                    quantity=quantity,
+                    price=row.discounted_price,
+                )
+                for _, product, variant, row, quantity in lines
+            ]
+            OrderItem.objects.bulk_create(order_items)
+            fill_pks(OrderItem, order_items, ["order", "product", "variant", "quantity"])
+            ShippingAddress.objects.create(
+                order=order, **validated_data["shipping_address"]
+            )
+            # Takes the reserved stock off the locked rows.
+            record_movements(
+                InventoryMovement(
+                    kind=InventoryMovement.Kind.SALE,
+                    product=None if variant else product,
+                    variant=variant,
+                    quantity=-quantity,
+                    order_item=order_item,
+                    user=user,
+                )
+                for order_item, (_, product, variant, _, quantity) in zip(order_items, lines)
+            )
+        return order
+
+    def to_representation(self, order):
+        return {
+            **OrderSerializer(order, context=self.context).data,
+            "order_items": OrderItemSerializer(
+                order.order_items.all(), many=True, context=self.context
+            ).data,
+        }
+
+
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth import authenticate
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# Sent for writes that bypass Model.save()/delete() (bulk_create, bulk_update,
+# queryset updates) so derived data can catch up. Deletions are announced
+# before the rows go away. Arguments: sender (the model class), pks.
+catalog_bulk_changed = Signal()
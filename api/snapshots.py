@@ -0,0 +1,303 @@
+"""
+Materialized category trees.
+
+`CategoryDetailSerializer` walks the category's images, subcategories and
+every product with its variants, discounts and images. Instead of doing that
+on every request the rendered JSON is stored in `CategorySnapshot` and
+rebuilt after commit whenever one of the models it is made of changes.
+"""
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.http import Http404, HttpResponse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from .deferred import CommitBatch
+from .fieldsets import has_fieldset_params
+from .models import (
+    Category,
+    CategorySnapshot,
+    Discount,
+    Image,
+    Product,
+    SubCategory,
+    Variant,
+)
+from .prefetch import prefetch_for_serializer
+from .routers import reading_from_replicas
+from .serializers import CategoryDetailSerializer
+from .signals import catalog_bulk_changed
+
+# Bump whenever CategoryDetailSerializer (or anything nested in it) changes
+# shape; stored snapshots with an older schema are rebuilt on read.
+SCHEMA_VERSION = 2
+
+# Absolute URLs are rendered against this placeholder and swapped for the
+# scheme and host of the request serving the snapshot.
+BASE_URL_PLACEHOLDER = "__snapshot_base_url__"
+
+REBUILD_BATCH_SIZE = 100
+
+
+class SnapshotRequest:
+    # Just enough of a request for DRF to build absolute URLs.
+    GET = {}
+    versioning_scheme = None
+
+    def build_absolute_uri(self, location):
+        return BASE_URL_PLACEHOLDER + location
+
+
+def render_category(category):
+    serializer = CategoryDetailSerializer(
+        category, context={"request": SnapshotRequest()}
+    )
+    return JSONRenderer().render(serializer.data).decode()
+
+
+# What is written must not be read from a lagging replica, even when a
+# replica-served GET asks for the rebuild.
+@reading_from_replicas(False)
+def rebuild_category_snapshots(category_ids):
+    snapshots = []
+    category_ids = list(category_ids)
+    for start in range(0, len(category_ids), REBUILD_BATCH_SIZE):
+        queryset = prefetch_for_serializer(
+            Category.objects.filter(pk__in=category_ids[start:start + REBUILD_BATCH_SIZE]),
+            CategoryDetailSerializer,
+        )
+        for category in queryset:
+            payload = render_category(category)
+            with transaction.atomic():
+                snapshot, _ = CategorySnapshot.objects.get_or_create(
+                    category=category, defaults={"payload": ""}
+                )
+                # Bumped in SQL: concurrent rebuilds each get a version of
+                # their own. The row stays locked until commit, so reading
+                # it back sees this rebuild's version.
+                CategorySnapshot.objects.filter(pk=snapshot.pk).update(
+                    payload=payload,
+                    schema_version=SCHEMA_VERSION,
+                    version=F("version") + 1,
+                    updated_at=timezone.now(),
+                )
+                snapshot.refresh_from_db()
+            snapshots.append(snapshot)
+    if snapshots:
+        # The queryset update sends no post_save.
+        catalog_bulk_changed.send(
+            sender=CategorySnapshot, pks=[snapshot.pk for snapshot in snapshots]
+        )
+    return snapshots
+
+
+def current_snapshots(**lookup):
+    return CategorySnapshot.objects.filter(
+        schema_version=SCHEMA_VERSION,
+        **{f"category__{key}": value for key, value in lookup.items()},
+    )
+
+
+def get_category_snapshot(**lookup):
+    """
+    Return the current snapshot for the category matching `lookup`
+    (e.g. `pk=1` or `slug="tools"`), building it if needed, or None.
+    """
+    snapshot = current_snapshots(**lookup).first()
+    if snapshot is None:
+        with reading_from_replicas(False):
+            category_id = (
+                Category.objects.filter(**lookup).values_list("pk", flat=True).first()
+            )
+        if category_id is None:
+            return None
+        snapshot = rebuild_category_snapshots([category_id])[0]
+    return snapshot
+
+
+async def aget_category_snapshot(**lookup):
+    snapshot = await current_snapshots(**lookup).afirst()
+    if snapshot is None:
+        # Missing or outdated: build it the sync way, as rarely as that is.
+        snapshot = await sync_to_async(get_category_snapshot)(**lookup)
+    return snapshot
+
+
+def snapshot_response(request, snapshots, many=False):
+    base_url = f"{request.scheme}://{request.get_host()}"
+    payload = ",".join(snapshot.payload for snapshot in snapshots)
+    if many:
+        payload = f"[{payload}]"
+    return HttpResponse(
+        payload.replace(BASE_URL_PLACEHOLDER, base_url),
+        content_type="application/json",
+    )
+
+
+class CategorySnapshotMixin:
+    """
+    Serve `retrieve`/`list` from the category snapshot. List it after
+    ConditionalGetMixin and CachedResponseMixin so they wrap it. Requests
+    for a sparse fieldset are serialized live.
+    """
+
+    snapshot_lookup = "pk"
+
+    def get_snapshot_lookup(self):
+        return {self.snapshot_lookup: self.kwargs[self.snapshot_lookup]}
+
+    def get_snapshot(self):
+        if not hasattr(self, "_snapshot"):
+            self._snapshot = get_category_snapshot(**self.get_snapshot_lookup())
+        return self._snapshot
+
+    async def aget_snapshot(self):
+        if not hasattr(self, "_snapshot"):
+            self._snapshot = await aget_category_snapshot(**self.get_snapshot_lookup())
+        return self._snapshot
+
+    def retrieve(self, request, *args, **kwargs):
+        if has_fieldset_params(request):
+            return super().retrieve(request, *args, **kwargs)
+        return self.snapshot_response(request, self.get_snapshot(), many=False)
+
+    def list(self, request, *args, **kwargs):
+        if has_fieldset_params(request):
+            return super().list(request, *args, **kwargs)
+        return self.snapshot_response(request, self.get_snapshot(), many=True)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        if has_fieldset_params(request):
+            return await super().aretrieve(request, *args, **kwargs)
+        return self.snapshot_response(request, await self.aget_snapshot(), many=False)
+
+    async def alist(self, request, *args, **kwargs):
+        if has_fieldset_params(request):
+            return await super().alist(request, *args, **kwargs)
+        return self.snapshot_response(request, await self.aget_snapshot(), many=True)
+
+    def snapshot_response(self, request, snapshot, many):
+        if many:
+            return snapshot_response(request, [snapshot] if snapshot else [], many=True)
+        if snapshot is None:
+            raise Http404
+        return snapshot_response(request, [snapshot])
+
+
+class CategorySnapshotValidatorsMixin:
+    """
+    Conditional GET validators taken from the snapshot itself, which already
+    covers every nested row. List it before ConditionalGetMixin.
+    """
+
+    def get_root_validators(self, many):
+        return self.snapshot_validators(self.get_snapshot(), many)
+
+    async def aget_root_validators(self, many):
+        return self.snapshot_validators(await self.aget_snapshot(), many)
+
+    def snapshot_validators(self, snapshot, many):
+        if snapshot is None:
+            return (None, 0) if many else None
+        return snapshot.updated_at, (snapshot.category_id, snapshot.version)
+
+
+# Incremental rebuilds
+
+
+stale_categories = CommitBatch(rebuild_category_snapshots)
+mark_stale = stale_categories.add
+
+
+def _categories_of_products(product_ids):
+    return set(
+        Product.category.through.objects.filter(
+            product_id__in=[pk for pk in product_ids if pk is not None]
+        ).values_list("category_id", flat=True)
+    )
+
+
+def affected_categories(instance):
+    if isinstance(instance, Category):
+        return {instance.pk}
+    if isinstance(instance, SubCategory):
+        return {instance.category_id}
+    if isinstance(instance, Product):
+        return _categories_of_products([instance.pk])
+    if isinstance(instance, Variant):
+        return _categories_of_products([instance.product_id])
+    if isinstance(instance, Image):
+        category_ids = {instance.category_id}
+        if instance.subcategory_id is not None:
+            category_ids.update(
+                SubCategory.objects.filter(pk=instance.subcategory_id).values_list(
+                    "category_id", flat=True
+                )
+            )
+        return category_ids | _categories_of_products([instance.product_id])
+    if isinstance(instance, Discount):
+        product_ids = set(instance.product.values_list("pk", flat=True))
+        product_ids.update(instance.variants.values_list("product_id", flat=True))
+        return _categories_of_products(product_ids)
+    return set()
+
+
+def affected_categories_in_bulk(model, pks):
+    queryset = model._default_manager.filter(pk__in=pks)
+    if model is Category:
+        return set(pks)
+    if model is SubCategory:
+        return set(queryset.values_list("category_id", flat=True))
+    if model is Product:
+        return _categories_of_products(pks)
+    if model is Variant:
+        return _categories_of_products(queryset.values_list("product_id", flat=True))
+    if model is Image:
+        rows = list(queryset.values_list("category_id", "subcategory__category_id", "product_id"))
+        category_ids = {row[0] for row in rows} | {row[1] for row in rows}
+        return category_ids | _categories_of_products([row[2] for row in rows])
+    return set()
+
+
+SNAPSHOT_MODELS = (Category, SubCategory, Product, Variant, Image, Discount)
+
+
+@receiver(pre_save)
+def mark_previous_state_stale(sender, instance, raw=False, **kwargs):
+    # Catches rows moving away from a category, e.g. a subcategory re-parented.
+    if raw or sender not in SNAPSHOT_MODELS or instance.pk is None:
+        return
+    if sender is Category or sender is Product:
+        return
+    previous = sender._default_manager.filter(pk=instance.pk).first()
+    if previous is not None:
+        mark_stale(affected_categories(previous))
+
+
+@receiver(post_save)
+@receiver(pre_delete)
+def mark_current_state_stale(sender, instance, raw=False, **kwargs):
+    if raw or sender not in SNAPSHOT_MODELS:
+        return
+    if sender is Category and kwargs.get("signal") is pre_delete:
+        return
+    mark_stale(affected_categories(instance))
+
+
+@receiver(catalog_bulk_changed)
+def mark_bulk_changes_stale(sender, pks, **kwargs):
+    mark_stale(affected_categories_in_bulk(sender, pks))
+
+
+@receiver(m2m_changed, sender=Product.category.through)
+def mark_membership_stale(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        mark_stale({instance.pk})
+    elif action == "pre_clear":
+        mark_stale(_categories_of_products([instance.pk]))
+    elif action in ("post_add", "post_remove"):
+        mark_stale(pk_set)
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class NPlusOneTestRunner(DiscoverRunner):
+    """Django's runner, with the N+1 detector (api/nplusone.py) raising."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.nplusone = override_settings(
+            NPLUSONE={**getattr(settings, "NPLUSONE", {}), "MODE": "raise"}
+        )
+        self.nplusone.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.nplusone.disable()
+        super().teardown_test_environment(**kwargs)
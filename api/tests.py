@@ -1,3 +1,1507 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+import os
+import shutil
+import tempfile
+import warnings
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import F
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse as django_reverse
+from unittest import mock
+from django.utils import timezone
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+
+from .models import (
+    Category,
+    CategorySnapshot,
+    SubCategory,
+    Discount,
+    Product,
+    Image,
+    InventoryMovement,
+    ItemSalesRollup,
+    PaymentRollup,
+    RollupChange,
+    SalesRollup,
+    Variant,
+    Order,
+    OrderItem,
+    Payment,
+    User,
+)
+from .backends.pool import ConnectionPool, PoolTimeout, _pools, get_pool_stats
+from .backends.sqlite3.base import DatabaseWrapper as PooledSQLiteWrapper
+from .benchmark import RouteBenchmark, ThroughputBenchmark, asgi_get, discover_routes
+from .bulk import fill_pks
+from .caching import get_cache_stats
+from .derivatives import build_derivatives, pending
+from .exports import ExportMixin
+from .facets import facet_index
+from .admin import OrderItemAdmin
+from .fastpath import FastListMixin
+from .instrumentation import Histogram, reset_view_stats
+from .inventory import find_drift, ledger_quantity, set_stock, take_snapshots
+from .nplusone import NPlusOneError, allow_repeated_queries, detect_n_plus_one
+from .prefetch import prefetch_for_serializer
+from .rollups import refresh_changed
+from . import routers, snapshots
+from .seeding import seed_catalog
+from .serializers import CategoryDetailSerializer, ProductSerializer
+from .signals import catalog_bulk_changed
+from .views import ProductViewSet
+
+
+def create_catalog(products=3, variants=2, images=2, name="Tools"):
+    category = Category.objects.create(name=name)
+    subcategory = SubCategory.objects.create(name=f"{name} drills", category=category)
+    discount = Discount.objects.create(discount_value=Decimal("10.00"))
+    for i in range(products):
+        product = Product.objects.create(
+            name=f"{name} product {i}", price=Decimal("100.00"), discount=discount
+        )
+        product.category.add(category)
+        product.subcategory.add(subcategory)
+        for j in range(images):
+            Image.objects.create(product=product, image=f"images/{i}-{j}.jpg")
+        for j in range(variants):
+            Variant.objects.create(
+                product=product, discount=discount, price=Decimal("90.00"), size=j
+            )
+    return category, subcategory
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+
+
+class PrefetchPlanTests(APITestCase):
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_product_list_query_count_is_flat(self):
+        create_catalog(products=2)
+        few = self.count_queries("/api/product/")
+        create_catalog(products=10, name="Paint")
+        self.assertEqual(self.count_queries("/api/product/"), few)
+
+    def test_subcategory_detail_query_count_is_flat(self):
+        _, subcategory = create_catalog(products=2)
+        few = self.count_queries(f"/api/subcategory/{subcategory.pk}/")
+        for product in Product.objects.all():
+            product.pk = None
+            product.slug = None
+            product.save()
+            product.subcategory.add(subcategory)
+        self.assertEqual(
+            self.count_queries(f"/api/subcategory/{subcategory.pk}/"), few
+        )
+
+    def test_nested_collections_skip_inactive_rows(self):
+        create_catalog(products=1, images=2)
+        Image.objects.filter(pk=Image.objects.first().pk).update(is_active=False)
+        product = prefetch_for_serializer(
+            Product.objects.all(), ProductSerializer
+        ).get()
+        self.assertEqual(len(product.images.all()), 1)
+
+
+class CursorPaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_catalog(products=5, variants=0, images=0)
+
+    def test_pages_follow_id_order_without_counting(self):
+        response = self.client.get("/api/product/", {"page_size": 2})
+        self.assertNotIn("count", response.data)
+        ids = [row["id"] for row in response.data["results"]]
+        while response.data["next"]:
+            response = self.client.get(response.data["next"])
+            ids += [row["id"] for row in response.data["results"]]
+        expected = list(Product.objects.order_by("-id").values_list("id", flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_count_is_opt_in(self):
+        response = self.client.get("/api/product/", {"count": "true"})
+        self.assertEqual(response.data["count"], 5)
+
+
+class CategorySnapshotTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.category, _ = create_catalog(products=2)
+
+    def live_payload(self):
+        request = self.client.get("/api/category/").wsgi_request
+        category = prefetch_for_serializer(
+            Category.objects.filter(pk=self.category.pk), CategoryDetailSerializer
+        ).get()
+        serializer = CategoryDetailSerializer(category, context={"request": request})
+        return JSONRenderer().render(serializer.data)
+
+    def test_snapshot_matches_live_serializer(self):
+        response = self.client.get(f"/api/category/{self.category.pk}/")
+        self.assertEqual(response.content, self.live_payload())
+        response = self.client.get(f"/api/category/slug/{self.category.slug}/")
+        self.assertEqual(response.content, b"[" + self.live_payload() + b"]")
+
+    def test_served_from_storage(self):
+        self.client.get(f"/api/category/{self.category.pk}/")
+        with self.assertNumQueries(1):
+            self.client.get(f"/api/category/{self.category.pk}/")
+
+    def test_rebuilt_after_commit(self):
+        self.client.get(f"/api/category/{self.category.pk}/")
+        variant = Variant.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            variant.price = Decimal("42.00")
+            variant.save()
+        snapshot = CategorySnapshot.objects.get(category=self.category)
+        self.assertEqual(snapshot.version, 2)
+        self.assertIn('"42.00"', snapshot.payload)
+
+    def test_rebuilds_bump_the_stored_version(self):
+        self.client.get(f"/api/category/{self.category.pk}/")
+        render = snapshots.render_category
+
+        def render_during_another_rebuild(category):
+            CategorySnapshot.objects.update(version=F("version") + 1)
+            return render(category)
+
+        with mock.patch.object(snapshots, "render_category", render_during_another_rebuild):
+            (snapshot,) = snapshots.rebuild_category_snapshots([self.category.pk])
+        self.assertEqual(snapshot.version, 3)
+        self.assertEqual(CategorySnapshot.objects.get().version, 3)
+
+    def test_missing_category(self):
+        self.assertEqual(self.client.get("/api/category/999/").status_code, 404)
+        self.assertEqual(self.client.get("/api/category/slug/nope/").content, b"[]")
+
+
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category, self.subcategory = create_catalog(products=1)
+
+    def test_hit_after_miss(self):
+        before = get_cache_stats().get("SubCategoryListView", {})
+        first = self.client.get("/api/subcategory/")
+        self.assertEqual(first["X-Cache"], "MISS")
+        # Only the conditional GET validator touches the database.
+        with self.assertNumQueries(1):
+            second = self.client.get("/api/subcategory/")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(first.content, second.content)
+        after = get_cache_stats()["SubCategoryListView"]
+        self.assertEqual(after["hits"] - before.get("hits", 0), 1)
+        self.assertEqual(after["misses"] - before.get("misses", 0), 1)
+
+    def test_query_params_are_part_of_the_key(self):
+        self.client.get("/api/subcategory/", {"a": 1, "b": 2})
+        self.assertEqual(
+            self.client.get("/api/subcategory/", {"b": 2, "a": 1})["X-Cache"], "HIT"
+        )
+        self.assertEqual(self.client.get("/api/subcategory/")["X-Cache"], "MISS")
+
+    def test_model_signals_invalidate_tagged_views(self):
+        url = f"/api/subcategory/slug/{self.subcategory.slug}/"
+        self.client.get(url)
+        self.client.get("/api/category/")
+        variant = Variant.objects.first()
+        variant.price = Decimal("12.34")
+        with self.captureOnCommitCallbacks(execute=True):
+            variant.save()
+            # Not until the write commits.
+            self.assertEqual(self.client.get(url)["X-Cache"], "HIT")
+        response = self.client.get(url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertIn(b'"12.34"', response.content)
+        self.assertEqual(self.client.get("/api/category/")["X-Cache"], "HIT")
+
+    def test_snapshot_rebuilds_invalidate_the_category_slug_view(self):
+        url = f"/api/category/slug/{self.category.slug}/"
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)["X-Cache"], "HIT")
+        variant = Variant.objects.first()
+        variant.price = Decimal("12.34")
+        with self.captureOnCommitCallbacks(execute=True):
+            variant.save()
+        response = self.client.get(url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertIn(b'"12.34"', response.content)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.category, self.subcategory = create_catalog(products=2)
+        self.product = Product.objects.first()
+
+    def revalidate(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+    def test_not_modified_skips_serialization(self):
+        url = f"/api/product/{self.product.pk}/"
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_catalog_endpoints_revalidate(self):
+        for url in [
+            "/api/product/",
+            "/api/variant/",
+            f"/api/variant/{Variant.objects.first().pk}/",
+            "/api/category/",
+            f"/api/category/{self.category.pk}/",
+            f"/api/category/slug/{self.category.slug}/",
+            "/api/subcategory/",
+            f"/api/subcategory/{self.subcategory.pk}/",
+            f"/api/subcategory/slug/{self.subcategory.slug}/",
+        ]:
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url).status_code, 304)
+
+    def test_nested_change_changes_validator(self):
+        url = f"/api/product/{self.product.pk}/"
+        etag = self.client.get(url)["ETag"]
+        Image.objects.create(product=self.product, image="images/new.jpg")
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200
+        )
+
+    def test_list_validator_tracks_deletes(self):
+        etag = self.client.get("/api/product/")["ETag"]
+        Product.objects.last().delete()
+        response = self.client.get("/api/product/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_validators_come_from_the_database(self):
+        url = f"/api/product/{self.product.pk}/"
+        first = self.client.get(url)
+        cache.clear()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["Last-Modified"], first["Last-Modified"])
+
+    def test_list_validator_reads_only_the_page(self):
+        url = "/api/product/?page_size=1"
+        etag = self.client.get(url)["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        (query,) = queries.captured_queries
+        # No price join, no count of the table, and the page's two keys.
+        self.assertNotIn("JOIN", query["sql"])
+        self.assertNotIn('COUNT("api_product"', query["sql"])
+        self.assertIn("LIMIT 2", query["sql"])
+
+    def test_membership_change_changes_validator(self):
+        loose = Product.objects.create(name="Loose", price=Decimal("1"))
+        url = f"/api/subcategory/{self.subcategory.pk}/"
+        etag = self.client.get(url)["ETag"]
+        self.subcategory.products_in_subcategory.add(loose)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CheckoutTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_catalog(products=2, variants=1, images=0)
+        self.product = Product.objects.first()
+        set_stock(self.product, 5)
+        self.variant = Variant.objects.exclude(product=self.product).first()
+        set_stock(self.variant, 1)
+
+    def checkout(self, *items):
+        return self.client.post(
+            "/api/checkout/",
+            {
+                "items": list(items),
+                "shipping_address": {"full_address": "1 Main St", "city": "Dhaka"},
+                "shipping_amount": "60.00",
+            },
+            format="json",
+        )
+
+    def test_places_order_and_reserves_stock(self):
+        response = self.checkout(
+            {"product": self.product.pk, "quantity": 2},
+            {"product": self.variant.product_id, "variant": self.variant.pk, "quantity": 1},
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data["gross_amount"], "290.00")
+        self.assertEqual(response.data["total"], "261.00")
+        self.assertEqual(response.data["discount_amount"], "29.00")
+        self.assertEqual(response.data["net_amount"], "321.00")
+        self.assertEqual(len(response.data["order_items"]), 2)
+        self.product.refresh_from_db()
+        self.variant.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.variant.quantity), (3, 0))
+
+    def test_rejects_oversell_without_side_effects(self):
+        response = self.checkout(
+            {"product": self.product.pk, "quantity": 3},
+            {"product": self.product.pk, "quantity": 3},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("quantity", response.data["items"][0])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 5)
+        self.assertFalse(Order.objects.exists())
+
+    def test_rejects_variant_of_other_product(self):
+        response = self.checkout(
+            {"product": self.product.pk, "variant": self.variant.pk, "quantity": 1}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("variant", response.data["items"][0])
+
+
+class EffectivePriceTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_catalog(products=3, variants=0, images=0)
+        cheap, full, expired = Product.objects.order_by("id")
+        cheap.price = Decimal("50.00")
+        cheap.save()
+        full.discount = None
+        full.save()
+        expired.discount = Discount.objects.create(
+            discount_value=Decimal("50.00"),
+            end_date=timezone.now() - timedelta(days=1),
+        )
+        expired.save()
+        self.cheap, self.full, self.expired = cheap, full, expired
+
+    def test_annotation_matches_property(self):
+        for product in Product.objects.with_effective_price():
+            fresh = Product.objects.get(pk=product.pk)
+            self.assertEqual(product.effective_price, fresh.discounted_price)
+        self.assertEqual(
+            Product.objects.with_effective_price().get(pk=self.expired.pk).effective_price,
+            Decimal("100.00"),
+        )
+
+    def test_filter_and_order_by_price(self):
+        response = self.client.get(
+            "/api/product/", {"min_price": "60", "max_price": "100", "ordering": "-price"}
+        )
+        ids = [row["id"] for row in response.data["results"]]
+        self.assertEqual(ids, [self.expired.pk, self.full.pk])
+
+        response = self.client.get("/api/product/", {"ordering": "price", "page_size": 1})
+        self.assertEqual(response.data["results"][0]["id"], self.cheap.pk)
+        response = self.client.get(response.data["next"])
+        self.assertEqual(response.data["results"][0]["id"], self.expired.pk)
+
+    def test_invalid_bound(self):
+        response = self.client.get("/api/product/", {"min_price": "cheap"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductSearchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            category, subcategory = create_catalog(products=0, name="Garden")
+            self.hose = Product.objects.create(
+                name="Garden hose", description="Flexible hose", price=Decimal("20.00")
+            )
+            self.mower = Product.objects.create(
+                name="Lawn mower",
+                description="Leaves a neat garden lawn",
+                price=Decimal("200.00"),
+            )
+            self.hammer = Product.objects.create(name="Claw hammer", price=Decimal("15.00"))
+            self.hose.category.add(category)
+
+    def search(self, q, **params):
+        response = self.client.get("/api/product/search/", {"q": q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [row["id"] for row in response.data["results"]]
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.search("garden "), [self.hose.pk, self.mower.pk])
+        self.assertEqual(self.search("garden ", limit=1), [self.hose.pk])
+
+    def test_last_term_matches_as_prefix(self):
+        self.assertEqual(self.search("ham"), [self.hammer.pk])
+        self.assertEqual(self.search("ham "), [])
+        # A trailing stop word is the word being typed; "ham" stays whole.
+        self.assertEqual(self.search("ham for"), [])
+        self.assertEqual(self.search("claw for"), [self.hammer.pk])
+        self.assertEqual(self.search(""), [])
+
+    def test_index_follows_changes_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hammer.name = "Sledge"
+            self.hammer.save()
+        self.assertEqual(self.search("sledge "), [self.hammer.pk])
+        self.assertEqual(self.search("hammer "), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hammer.is_active = False
+            self.hammer.save()
+        self.assertEqual(self.search("sledge "), [])
+
+    def test_deleted_groups_leave_the_index(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            orchard = Category.objects.create(name="Orchard")
+            self.hammer.category.add(orchard)
+        self.assertEqual(self.search("orchard "), [self.hammer.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            orchard.delete()
+        self.assertEqual(self.search("orchard "), [])
+
+
+TINY_CATALOG = {
+    "categories": 2,
+    "subcategories": 2,
+    "products": 12,
+    "variants": 2,
+    "images": 1,
+    "orders": 4,
+    "items": 2,
+    "users": 3,
+}
+
+
+class SeedCatalogTests(APITestCase):
+    def test_seeds_related_rows_and_derived_data(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            counts = seed_catalog(**TINY_CATALOG, batch_size=5)
+        self.assertEqual(counts["product"], 12)
+        self.assertEqual(counts["variant"], 24)
+        self.assertEqual(counts["orderitem"], 8)
+        self.assertFalse(Product.objects.filter(category=None).exists())
+        self.assertEqual(CategorySnapshot.objects.count(), 2)
+        response = self.client.get("/api/product/search/", {"q": "category"})
+        self.assertTrue(response.data["results"])
+
+
+class RouteBenchmarkTests(TestCase):
+    def test_every_route_is_measured(self):
+        seed_catalog(**TINY_CATALOG, refresh=False)
+        report = RouteBenchmark(iterations=2, warmup=0).run()
+        routes = {
+            ("GET" if "GET" in methods else "POST") + " " + route
+            for route, name, view_class, methods in discover_routes()
+        }
+        self.assertEqual(set(report["routes"]), routes)
+        for route, row in report["routes"].items():
+            self.assertLess(row["status"], 500, route)
+            self.assertGreater(row["queries"], 0, route)
+        self.assertIn("GET /api/product/<pk>/", routes)
+
+
+class HotQueryIndexTests(TestCase):
+    def test_hot_queries_use_their_indexes(self):
+        seed_catalog(**TINY_CATALOG, refresh=False)
+        out = StringIO()
+        call_command("explain_hot_queries", stdout=out, no_color=True)
+        plans = out.getvalue()
+        for name in ("product_slug_active_idx", "payment_transaction_idx", "user_email_idx"):
+            self.assertIn(name, plans)
+
+
+def png_upload(width=800, height=600):
+    from PIL import Image as PILImage
+
+    buffer = BytesIO()
+    PILImage.new("RGB", (width, height), "orange").save(buffer, "PNG")
+    return SimpleUploadedFile("photo.png", buffer.getvalue(), content_type="image/png")
+
+
+class ImageDerivativeTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            IMAGE_DERIVATIVES={"SIZES": [160, 320, 1280], "FORMATS": ["jpeg", "webp"], "INLINE": True},
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.product = Product.objects.create(name="Lamp", price=Decimal("10.00"))
+
+    def test_rendered_after_commit_and_exposed_as_srcset(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = Image.objects.create(product=self.product, image=png_upload())
+        image.refresh_from_db()
+        self.assertEqual(image.derivatives["source"], image.image.name)
+        self.assertEqual(sorted(image.derivatives["files"]["webp"], key=int), ["160", "320"])
+        for name in image.derivatives["files"]["webp"].values():
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+
+        srcset = self.client.get(f"/api/image/{image.pk}/").data["srcset"]
+        self.assertRegex(srcset["webp"], r"^http://testserver/media/derivatives/.+/160\.webp 160w, ")
+        self.assertIn("320.jpg 320w", srcset["jpeg"])
+
+        # Saving without a new file doesn't render again.
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            image.save()
+        self.assertNotIn(pending[Image].flush, callbacks)
+
+    def test_process_pool(self):
+        image = Image.objects.create(product=self.product, image=png_upload(200, 100))
+        with self.settings(
+            IMAGE_DERIVATIVES={"SIZES": [160], "FORMATS": ["webp"], "WORKERS": 1}
+        ):
+            self.assertEqual(build_derivatives(Image, [image.pk], wait=True), 1)
+        image.refresh_from_db()
+        self.assertEqual(list(image.derivatives["files"]["webp"]), ["160"])
+
+
+class SparseFieldsetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.category, self.subcategory = create_catalog(products=2)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(ctx.captured_queries)
+
+    def test_fields_prune_output_and_queries(self):
+        full, full_queries = self.get("/api/product/")
+        slim, slim_queries = self.get("/api/product/", fields="id,name,price")
+        self.assertEqual(set(slim["results"][0]), {"id", "name", "price"})
+        self.assertLess(slim_queries, full_queries)
+
+    def test_nested_fields_and_omit(self):
+        data, _ = self.get(
+            "/api/product/",
+            fields="name,variants.price,variants.discount",
+            omit="variants.discount.description",
+        )
+        product = data["results"][0]
+        self.assertEqual(set(product), {"name", "variants"})
+        self.assertEqual(set(product["variants"][0]), {"price", "discount"})
+        self.assertNotIn("description", product["variants"][0]["discount"])
+
+        product_id = Product.objects.first().pk
+        data, _ = self.get(f"/api/product/{product_id}/", omit="images,variants")
+        self.assertNotIn("images", data)
+        self.assertIn("discount", data)
+
+    def test_expand(self):
+        data, _ = self.get("/api/product/", expand="category", fields="name")
+        self.assertEqual(data["results"][0]["category"][0]["slug"], self.category.slug)
+
+    def test_snapshot_views_serialize_sparse_requests_live(self):
+        data, _ = self.get(f"/api/category/{self.category.pk}/", fields="name,slug")
+        self.assertEqual(data, {"name": "Tools", "slug": self.category.slug})
+        data, _ = self.get(f"/api/category/slug/{self.category.slug}/", omit="products")
+        self.assertNotIn("products", data[0])
+        self.assertIn("subcategories", data[0])
+
+    def test_writes_ignore_fieldsets(self):
+        user = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_authenticate(user)
+        response = self.client.patch(
+            f"/api/product/{Product.objects.first().pk}/?fields=id",
+            {"name": "Renamed", "price": "5.00"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["name"], "Renamed")
+
+
+class FastListTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_catalog(products=3, variants=2, images=2)
+        create_catalog(products=2, variants=1, images=1, name="Paint")
+        Discount.objects.update(start_date=timezone.now() - timedelta(days=2))
+        Variant.objects.filter(pk=Variant.objects.first().pk).update(discount=None)
+        Image.objects.filter(pk=Image.objects.first().pk).update(is_active=False)
+        Image.objects.filter(pk=Image.objects.last().pk).update(
+            derivatives={"files": {"webp": {"320": "derivatives/ab/x/320.webp"}}}
+        )
+
+    def assertSameBytes(self, url, **params):
+        fast = self.client.get(url, params)
+        self.assertEqual(fast.status_code, 200)
+        cache.clear()
+        with mock.patch.object(FastListMixin, "fast_list", False):
+            slow = self.client.get(url, params)
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_matches_serializer_output(self):
+        for url in ("/api/product/", "/api/variant/", "/api/image/", "/api/discount/"):
+            with self.subTest(url=url):
+                self.assertSameBytes(url)
+        self.assertSameBytes("/api/product/", ordering="-price", page_size=2)
+        self.assertSameBytes("/api/product/", expand="category,subcategory")
+        self.assertSameBytes("/api/product/", fields="name,variants.url,images")
+        self.assertSameBytes("/api/variant/", expand="product", omit="product.images")
+
+    def test_hyperlinks_are_reversed_once_per_field(self):
+        calls = []
+        for page_size in (1, 5):
+            cache.clear()
+            with mock.patch("rest_framework.reverse.django_reverse", wraps=django_reverse) as reverse:
+                response = self.client.get("/api/variant/", {"page_size": page_size})
+            self.assertEqual(len(response.json()["results"]), page_size)
+            calls.append(reverse.call_count)
+        self.assertEqual(calls[0], calls[1])
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_catalog(products=1, variants=0, images=0)
+        product = Product.objects.get()
+        for days_ago in (40, 20, 1):
+            order = Order.objects.create(total=Decimal("100.00"))
+            rows = [
+                order,
+                OrderItem.objects.create(order=order, product=product, quantity=1, price=Decimal("100.00")),
+                Payment.objects.create(order=order, amount=100.0, transaction_id=f"t{days_ago}", status="paid"),
+            ]
+            for row in rows:
+                type(row).objects.filter(pk=row.pk).update(
+                    created_at=timezone.now() - timedelta(days=days_ago)
+                )
+        user = User.objects.create_user(username="finance", email="finance@example.com", password="x")
+        self.client.force_authenticate(user)
+
+    def export(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content)
+
+    @mock.patch.object(ExportMixin, "export_chunk_size", 2)
+    def test_json_array_matches_list(self):
+        body = self.export("/api/order/export/", fields="url,total,order_items")
+        listed = self.client.get("/api/order/", {"fields": "url,total,order_items"})
+        self.assertEqual(body, JSONRenderer().render(listed.data["results"]))
+
+    def test_ndjson_with_created_range(self):
+        since = (timezone.now() - timedelta(days=30)).date().isoformat()
+        for url in ("/api/order/export/", "/api/order-item/export/", "/api/payment/export/"):
+            with self.subTest(url=url):
+                body = self.export(url, format="ndjson", created_after=since)
+                lines = body.decode().splitlines()
+                self.assertEqual(len(lines), 2)
+                self.assertTrue(all(line.startswith("{") for line in lines))
+
+        response = self.client.get("/api/payment/export/", {"created_before": "soon"})
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch.object(ExportMixin, "export_chunk_size", 2)
+    def test_streams_under_asgi(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            status, body = async_to_sync(asgi_get)(
+                ASGIHandler(), "/api/payment/export/", "format=ndjson"
+            )
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body.decode().splitlines()), 3)
+        # Django buffers sync iterators on ASGI, and says so.
+        self.assertEqual([str(warning.message) for warning in caught], [])
+
+
+class BulkWriteTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_catalog(products=2, variants=1, images=0)
+        self.user = User.objects.create_superuser("sync", "sync@example.com", "x")
+        self.client.force_authenticate(self.user)
+
+    def test_upserts_products_on_slug(self):
+        existing = Product.objects.order_by("pk").first()
+        response = self.client.post(
+            "/api/product/bulk/",
+            [
+                {"slug": existing.slug, "price": "120.00"},
+                {"name": "Angle grinder", "price": "75.50", "quantity": 4},
+                {"name": "Broken", "price": "cheap"},
+                {"slug": existing.slug, "quantity": 1},
+            ],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            [row["status"] for row in response.data["results"]],
+            ["updated", "created", "error", "error"],
+        )
+        self.assertEqual((response.data["created"], response.data["updated"]), (1, 1))
+        self.assertIn("price", response.data["results"][2]["errors"])
+        existing.refresh_from_db()
+        self.assertEqual((existing.price, existing.name), (Decimal("120.00"), "Tools product 0"))
+        created = Product.objects.get(slug="angle-grinder")
+        self.assertEqual(response.data["results"][1]["id"], created.pk)
+        self.assertEqual(created.quantity, 4)
+
+    def test_variants_update_by_id_and_check_references(self):
+        variant = Variant.objects.first()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/api/variant/bulk/",
+                [{"id": variant.pk, "price": "80.00"}]
+                + [{"product": variant.product_id, "size": i, "price": "10.00"} for i in range(20)]
+                + [{"id": 999999, "price": "1.00"}, {"product": 999999, "price": "1.00"}],
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            (response.data["updated"], response.data["created"], response.data["error"]),
+            (1, 20, 2),
+        )
+        self.assertEqual(response.data["results"][-1]["errors"]["product"][0][:11], "Invalid pk ")
+        self.assertLess(len(queries), 20)
+        variant.refresh_from_db()
+        self.assertEqual(variant.price, Decimal("80.00"))
+        self.assertEqual(Variant.objects.filter(product=variant.product_id).count(), 21)
+
+    def test_delete_and_permissions(self):
+        slugs = list(Product.objects.values_list("slug", flat=True))
+        response = self.client.delete("/api/product/bulk/", [slugs[0], "missing"], format="json")
+        self.assertEqual([row["status"] for row in response.data["results"]], ["deleted", "error"])
+        self.assertFalse(Product.objects.filter(slug=slugs[0]).exists())
+
+        self.client.force_authenticate(User.objects.create_user("clerk", "clerk@example.com", "x"))
+        response = self.client.post("/api/product/bulk/", [{"name": "Nope"}], format="json")
+        self.assertEqual(response.status_code, 403)
+
+    def test_fill_pks_reads_new_rows_back_on_mysql(self):
+        first, other = Product.objects.all()
+        variants = [
+            Variant.objects.create(product=first, size=1, price=Decimal("10.00")),
+            # Not one of ours: the ids of a multi-row INSERT can be interleaved.
+            Variant.objects.create(product=other, size=1, price=Decimal("10.00")),
+            Variant.objects.create(product=first, size=2, price=Decimal("10.00")),
+            Variant.objects.create(product=first, size=1, price=Decimal("10.00")),
+        ]
+        del variants[1]
+        pks = [variant.pk for variant in variants]
+        for variant in variants:
+            variant.pk = None
+        fill_pks(Variant, variants, ["product", "size", "price"])
+        self.assertEqual([variant.pk for variant in variants], [None] * 3)
+
+        connection.ensure_connection()
+        connection.connection.create_function("LAST_INSERT_ID", 0, lambda: pks[0])
+        with mock.patch.object(connection, "vendor", "mysql"):
+            fill_pks(Variant, variants, ["product", "size", "price"])
+        self.assertEqual([variant.pk for variant in variants], pks)
+
+
+class AsyncReadPathTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.category, self.subcategory = create_catalog(products=3, variants=2, images=1)
+        self.async_client = AsyncClient()
+
+    def get_async(self, url, **params):
+        cache.clear()
+        with override_settings(ROOT_URLCONF="mistrytech.async_urls"):
+            return async_to_sync(self.async_client.get)(url, params)
+
+    def headers(self, response):
+        # Timings differ from one request to the next.
+        return {
+            header: value for header, value in response.items() if header != "Server-Timing"
+        }
+
+    def test_matches_sync_responses(self):
+        product = Product.objects.first()
+        first_page = self.client.get("/api/product/", {"page_size": 2}).data
+        urls = [
+            ("/api/product/", {}),
+            ("/api/product/", {"page_size": 2}),
+            (first_page["next"], {}),
+            ("/api/product/", {"fields": "name,variants.price", "count": "true"}),
+            (f"/api/product/{product.pk}/", {}),
+            ("/api/category/", {}),
+            (f"/api/category/{self.category.pk}/", {}),
+            (f"/api/category/slug/{self.category.slug}/", {}),
+            (f"/api/category/{self.category.pk}/", {"omit": "products"}),
+            ("/api/subcategory/", {}),
+            (f"/api/subcategory/{self.subcategory.pk}/", {}),
+            (f"/api/subcategory/slug/{self.subcategory.slug}/", {}),
+        ]
+        for url, params in urls:
+            with self.subTest(url=url, params=params):
+                async_response = self.get_async(url, **params)
+                cache.clear()
+                sync_response = self.client.get(url, params)
+                self.assertEqual(async_response.status_code, 200)
+                self.assertEqual(async_response.content, sync_response.content)
+                self.assertEqual(self.headers(async_response), self.headers(sync_response))
+
+    def test_sync_views_are_not_called(self):
+        refuse = mock.Mock(side_effect=AssertionError("served synchronously"))
+        with mock.patch.object(ProductViewSet, "list", refuse), mock.patch.object(
+            ProductViewSet, "retrieve", refuse
+        ):
+            self.assertEqual(self.get_async("/api/product/").status_code, 200)
+            product = Product.objects.first()
+            response = self.get_async(f"/api/product/{product.pk}/")
+            self.assertEqual(response.status_code, 200)
+            etag = response["ETag"]
+            with override_settings(ROOT_URLCONF="mistrytech.async_urls"):
+                response = async_to_sync(self.async_client.get)(
+                    f"/api/product/{product.pk}/", headers={"if-none-match": etag}
+                )
+            self.assertEqual(response.status_code, 304)
+
+    def test_falls_back_to_drf(self):
+        for url in ("/api/product/999999/", "/api/category/999999/"):
+            with self.subTest(url=url):
+                response = self.get_async(url)
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.content, self.client.get(url).content)
+        # Writes to the same URLs go to the DRF view's other actions.
+        with override_settings(ROOT_URLCONF="mistrytech.async_urls"):
+            response = async_to_sync(self.async_client.post)("/api/product/", {})
+        sync_response = self.client.post("/api/product/", {})
+        self.assertEqual(response.status_code, sync_response.status_code)
+        self.assertEqual(self.headers(response), self.headers(sync_response))
+
+    def test_checks_permissions_and_throttles(self):
+        with mock.patch.object(ProductViewSet, "permission_classes", [IsAdminUser]):
+            response = self.get_async("/api/product/")
+            sync_response = self.client.get("/api/product/")
+        self.assertEqual(response.content, sync_response.content)
+        self.assertEqual(self.headers(response), self.headers(sync_response))
+        self.assertEqual(response.status_code, 401)
+
+        throttle = mock.Mock(allow_request=mock.Mock(return_value=False), wait=lambda: 30)
+        with mock.patch.object(ProductViewSet, "get_throttles", return_value=[throttle]):
+            response = self.get_async("/api/product/")
+        self.assertEqual((response.status_code, response["Retry-After"]), (429, "30"))
+
+
+class ThroughputBenchmarkTests(TransactionTestCase):
+    def test_compares_wsgi_and_asgi(self):
+        # No images: their (missing) files would be queued for derivatives.
+        create_catalog(products=2, variants=1, images=0)
+        report = ThroughputBenchmark(requests=4, concurrency=2, host="testserver").run()
+        self.assertIn("/api/product/<pk>/", report["routes"])
+        for route, row in report["routes"].items():
+            self.assertEqual(row["statuses"], [200], route)
+            self.assertGreater(row["wsgi_rps"], 0)
+            self.assertGreater(row["asgi_rps"], 0)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.healthy = True
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(TestCase):
+    def make_pool(self, **options):
+        def check(conn):
+            if not conn.healthy:
+                raise OSError("gone")
+
+        return ConnectionPool(FakeConnection, check, **{"timeout": 0.05, **options})
+
+    def test_reuses_connections_up_to_max_size(self):
+        pool = self.make_pool(min_size=1, max_size=2)
+        first, initialized = pool.acquire()
+        self.assertFalse(initialized)
+        pool.mark_initialized(first)
+        pool.release(first)
+        self.assertEqual(pool.acquire(), (first, True))
+        second, _ = pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        stats = pool.get_stats()
+        self.assertEqual((stats["size"], stats["in_use"], stats["created"]), (2, 2, 2))
+        self.assertEqual((stats["waited"], stats["timeouts"]), (1, 1))
+        self.assertGreaterEqual(stats["wait_ms_max"], 50)
+
+        pool.release(second, reusable=False)
+        self.assertTrue(second.closed)
+        self.assertEqual(pool.get_stats()["size"], 1)
+
+    def test_replaces_unhealthy_and_expired_connections(self):
+        pool = self.make_pool(check_after=0)
+        conn, _ = pool.acquire()
+        conn.healthy = False
+        pool.release(conn)
+        replacement, initialized = pool.acquire()
+        self.assertIsNot(replacement, conn)
+        self.assertFalse(initialized)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.get_stats()["failed_checks"], 1)
+
+        pool.max_lifetime = 0
+        pool.release(replacement)
+        self.assertTrue(replacement.closed)
+        self.assertEqual(pool.get_stats()["size"], 0)
+
+
+class PooledBackendTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings_dict = {
+            **connection.settings_dict,
+            "ENGINE": "api.backends.sqlite3",
+            "NAME": os.path.join(directory, "pooled.sqlite3"),
+            "OPTIONS": {"pool": {"max_size": 1, "timeout": 0.05}},
+        }
+        self.wrapper = PooledSQLiteWrapper(settings_dict, alias="pooled")
+        self.addCleanup(lambda: _pools.pop("pooled").close_idle())
+
+    def test_close_returns_the_connection_to_the_pool(self):
+        with self.wrapper.cursor() as cursor:
+            cursor.execute("CREATE TABLE t (x integer)")
+        raw = self.wrapper.connection
+        self.wrapper.close()
+        self.assertIsNone(self.wrapper.connection)
+        self.assertEqual(get_pool_stats()["pooled"]["idle"], 1)
+
+        # A connection closed mid-transaction is rolled back before reuse.
+        self.wrapper.set_autocommit(False)
+        self.assertIs(self.wrapper.connection, raw)
+        with self.wrapper.cursor() as cursor:
+            cursor.execute("INSERT INTO t VALUES (1)")
+        self.wrapper.close()
+        with self.wrapper.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM t")
+            self.assertEqual(cursor.fetchone(), (0,))
+        self.assertIs(self.wrapper.connection, raw)
+        stats = get_pool_stats()["pooled"]
+        self.assertEqual((stats["created"], stats["acquired"]), (1, 3))
+
+    def test_pool_timeout_is_an_operational_error(self):
+        self.wrapper.ensure_connection()
+        other = PooledSQLiteWrapper(self.wrapper.settings_dict, alias="pooled")
+        with self.assertRaises(OperationalError):
+            other.ensure_connection()
+        self.wrapper.close()
+        other.ensure_connection()
+        other.close()
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Catalog reads against a second, separately migrated SQLite database. Not
+    a TestCase: reads inside its transaction would stay on the primary.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Added after the test runner has set up its databases, so it is
+        # neither created nor wrapped in a transaction by it.
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.settings["replica"] = {
+            **connections["default"].settings_dict,
+            "NAME": os.path.join(cls.replica_dir, "replica.sqlite3"),
+        }
+        call_command("migrate", database="replica", verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.settings["replica"]
+        shutil.rmtree(cls.replica_dir, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+        routers._lags.clear()
+        create_catalog(products=2, variants=1, images=0)
+        Product.objects.update(quantity=5)
+        replication = override_settings(DATABASE_REPLICATION={"REPLICAS": ["replica"]})
+        replication.enable()
+        self.addCleanup(replication.disable)
+
+    def product_count(self):
+        response = self.client.get("/api/product/")
+        self.assertEqual(response.status_code, 200)
+        return len(response.data["results"])
+
+    def test_catalog_reads_go_to_the_replica(self):
+        # The catalog was only written to the primary.
+        self.assertEqual(self.product_count(), 0)
+        self.assertEqual(self.client.get("/api/category/").json(), [])
+        with self.settings(ROOT_URLCONF="mistrytech.async_urls"):
+            response = async_to_sync(AsyncClient().get)("/api/product/")
+        self.assertEqual(response.json()["results"], [])
+
+    def test_lagging_replicas_are_skipped(self):
+        with mock.patch("api.routers.replica_lag", return_value=60) as replica_lag:
+            self.assertEqual(self.product_count(), 2)
+            self.assertEqual(self.product_count(), 2)
+        # Probed once per LAG_CHECK_INTERVAL.
+        replica_lag.assert_called_once_with("replica")
+
+    def test_order_writes_pin_reads_to_the_primary(self):
+        response = self.client.post(
+            "/api/checkout/",
+            {
+                "items": [{"product": Product.objects.first().pk, "quantity": 1}],
+                "shipping_address": {"full_address": "1 Main St", "city": "Dhaka"},
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.cookies["read_primary"]["max-age"], 10)
+        self.assertEqual(self.product_count(), 2)
+
+    def test_snapshot_rebuilds_read_from_the_primary(self):
+        category = Category.objects.first()
+        response = self.client.get(f"/api/category/slug/{category.slug}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()[0]["products"]), 2)
+
+    def test_fills_are_not_cached_while_the_replica_may_lag(self):
+        # The tags were versioned just now, by this request.
+        self.assertEqual(self.client.get("/api/category/")["X-Cache"], "MISS")
+        self.assertEqual(self.client.get("/api/category/")["X-Cache"], "MISS")
+        config = {"REPLICAS": ["replica"], "MAX_LAG": 0, "LAG_CHECK_INTERVAL": 0}
+        with self.settings(DATABASE_REPLICATION=config):
+            self.client.get("/api/category/")
+            self.assertEqual(self.client.get("/api/category/")["X-Cache"], "HIT")
+
+
+class PerformanceMiddlewareTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        reset_view_stats()
+        create_catalog(products=2, variants=1, images=0)
+
+    def test_server_timing_follows_debug(self):
+        # Tests run with DEBUG off.
+        self.assertNotIn("Server-Timing", self.client.get("/api/category/"))
+        with self.settings(API_PERFORMANCE={"SERVER_TIMING": True}):
+            self.assertIn("Server-Timing", APIClient().get("/api/category/"))
+
+    @override_settings(API_PERFORMANCE={"SERVER_TIMING": True})
+    def test_reports_timings_per_view(self):
+        response = self.client.get("/api/product/")
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="[1-9]\d* queries", serialize;dur=[\d.]+, ')
+        self.client.get("/api/product/", {"fields": "name"})
+        self.client.get("/api/category/")
+
+        self.assertEqual(self.client.get("/api/perf/").status_code, 401)
+        self.client.force_authenticate(User.objects.create_superuser("ops", "ops@example.com", "x"))
+        views = self.client.get("/api/perf/").data["views"]
+        stats = views["GET product-list"]
+        self.assertEqual(stats["count"], 2)
+        self.assertGreater(stats["queries"]["mean"], 0)
+        self.assertGreater(stats["bytes"]["max"], 0)
+        self.assertLessEqual(stats["wall_ms"]["p50"], stats["wall_ms"]["p99"])
+        self.assertGreater(stats["serialize_ms"]["max"], 0)
+        self.assertEqual(views["GET category-list"]["count"], 1)
+
+    def test_histogram_percentiles(self):
+        histogram = Histogram()
+        for value in range(1, 101):
+            histogram.add(value)
+        self.assertAlmostEqual(histogram.percentile(50), 50, delta=5)
+        self.assertAlmostEqual(histogram.percentile(99), 99, delta=10)
+        self.assertEqual(histogram.summary()["max"], 100)
+
+
+class NPlusOneDetectorTests(TestCase):
+    def setUp(self):
+        for name in ("Tools", "Paint", "Garden"):
+            create_catalog(products=1, variants=1, images=1, name=name)
+
+    def test_names_the_serializer_field(self):
+        request = APIRequestFactory().get("/api/product/")
+        serializer = ProductSerializer(
+            Product.objects.all(), many=True, context={"request": request}
+        )
+        with self.assertRaisesRegex(NPlusOneError, r"from ProductSerializer\.images: SELECT"):
+            with detect_n_plus_one(mode="raise"):
+                serializer.data
+
+    def test_logs_model_str_and_allows_intended_repeats(self):
+        subcategories = list(SubCategory.objects.all())
+        with self.assertLogs("api.nplusone", "WARNING") as logs:
+            with detect_n_plus_one(mode="log") as tracker:
+                [str(subcategory) for subcategory in subcategories]
+            tracker.report("test")
+        self.assertIn("3 x SELECT", logs.output[0])
+        self.assertIn("from SubCategory.__str__", logs.output[0])
+
+        with detect_n_plus_one(mode="raise"), allow_repeated_queries():
+            [str(subcategory) for subcategory in SubCategory.objects.all()]
+        # The same query three times is a duplicate, not an N+1.
+        with detect_n_plus_one(mode="raise"):
+            for _ in range(3):
+                Product.objects.filter(pk=1).first()
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.client.force_login(
+            User.objects.create_superuser("admin", "admin@example.com", "x"),
+            backend="django.contrib.auth.backends.ModelBackend",
+        )
+
+    def changelist_queries(self, model):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/admin/api/{model}/")
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_budget_does_not_grow_with_rows(self):
+        create_catalog(products=3, variants=1, images=2)
+        small = {
+            model: self.changelist_queries(model)
+            for model in ("product", "category", "subcategory", "variant")
+        }
+        create_catalog(products=20, variants=2, images=3, name="Paint")
+        for model, count in small.items():
+            with self.subTest(model=model):
+                self.assertEqual(self.changelist_queries(model), count)
+        # Session and user, a page of each lazy filter, two counts, the rows,
+        # one query per prefetched relation and the permissions.
+        with self.assertNumQueries(12):
+            self.client.get("/admin/api/product/")
+
+    def test_lazy_filter_lists_a_bounded_page_of_choices(self):
+        for i in range(3):
+            create_catalog(products=1, variants=0, images=0, name=f"Cat{i}")
+        last = Category.objects.order_by("id").first()
+        with mock.patch("api.admin.LazyRelatedFieldListFilter.max_choices", 2):
+            response = self.client.get(
+                "/admin/api/product/", {"category__id__exact": last.pk}
+            )
+        spec = next(
+            spec for spec in response.context["cl"].filter_specs
+            if spec.field_path == "category"
+        )
+        # The first two in CategoryAdmin's ordering, and the selected one.
+        self.assertEqual(
+            [pk for pk, _ in spec.lookup_choices],
+            list(Category.objects.order_by("-id").values_list("pk", flat=True)[:2]) + [last.pk],
+        )
+
+    def create_order_items(self, count):
+        create_catalog(products=1, variants=0, images=0, name="Bulk")
+        product = Product.objects.get(name="Bulk product 0")
+        for _ in range(count):
+            order = Order.objects.create(total=Decimal("10.00"))
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=Decimal("10.00"))
+        return order
+
+    @mock.patch.object(OrderItemAdmin, "estimated_count_threshold", 2)
+    def test_large_tables_are_counted_from_statistics(self):
+        self.create_order_items(3)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/admin/api/orderitem/")
+        self.assertEqual(response.context["cl"].result_count, 3)
+        self.assertIsNone(response.context["cl"].full_result_count)
+        self.assertFalse([q for q in queries if "COUNT(" in q["sql"]])
+
+        # Filtered changelists are counted exactly.
+        response = self.client.get("/admin/api/orderitem/", {"is_active__exact": "1"})
+        self.assertEqual(response.context["cl"].result_count, 3)
+
+    def test_numeric_search_is_an_exact_id_lookup(self):
+        order = self.create_order_items(12)
+        item = order.order_items.get()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/admin/api/orderitem/", {"q": str(order.pk)})
+        self.assertEqual(list(response.context["cl"].result_list), [item])
+        self.assertFalse([q for q in queries if "LIKE" in q["sql"]])
+        response = self.client.get("/admin/api/orderitem/", {"q": "abc"})
+        self.assertEqual(response.context["cl"].result_count, 0)
+
+
+class InventoryLedgerTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_catalog(products=2, variants=1, images=0)
+        self.product = Product.objects.order_by("pk").first()
+        self.variant = Variant.objects.exclude(product=self.product).first()
+        set_stock(self.product, 10)
+        set_stock(self.variant, 4)
+
+    def test_checkout_records_sales_against_order_items(self):
+        response = self.client.post(
+            "/api/checkout/",
+            {
+                "items": [
+                    {"product": self.product.pk, "quantity": 3},
+                    {"product": self.variant.product_id, "variant": self.variant.pk, "quantity": 1},
+                ],
+                "shipping_address": {"full_address": "1 Main St", "city": "Dhaka"},
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        sales = InventoryMovement.objects.filter(kind="sale").order_by("pk")
+        self.assertEqual(
+            [(m.product_id, m.variant_id, m.quantity) for m in sales],
+            [(self.product.pk, None, -3), (None, self.variant.pk, -1)],
+        )
+        self.assertEqual(
+            set(sales.values_list("order_item__order", flat=True)), {Order.objects.get().pk}
+        )
+        self.assertEqual(Product.objects.get(pk=self.product.pk).quantity, 7)
+        self.assertEqual(ledger_quantity(self.product), 7)
+        self.assertEqual(ledger_quantity(self.variant), 3)
+        with self.assertRaises(ValueError):
+            sales[0].delete()
+
+    def test_stale_saves_keep_stock_and_writes_become_adjustments(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        set_stock(self.product, 12)
+        stale.name = "Renamed"
+        stale.save()
+        stale.refresh_from_db()
+        self.assertEqual((stale.name, stale.quantity), ("Renamed", 12))
+
+        self.client.force_authenticate(User.objects.create_superuser("stock", "s@example.com", "x"))
+        response = self.client.patch(
+            f"/api/product/{self.product.pk}/", {"quantity": 9}, format="json"
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["quantity"], 9)
+        adjustment = self.product.inventory_movements.latest("pk")
+        self.assertEqual((adjustment.kind, adjustment.quantity), ("adjustment", -3))
+        self.assertEqual(ledger_quantity(self.product), 9)
+
+        created = Product.objects.create(name="Level", quantity=6)
+        self.assertEqual(ledger_quantity(created), 6)
+        self.assertFalse(find_drift(Product).exists())
+
+    def test_snapshots_cover_moved_items_and_check_finds_drift(self):
+        self.assertEqual(take_snapshots(settle=timedelta(0)), 2)
+        self.assertEqual(take_snapshots(settle=timedelta(0)), 0)
+        set_stock(self.product, 15)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(ledger_quantity(self.product), 15)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(take_snapshots(settle=timedelta(0)), 1)
+        self.assertEqual(self.product.inventory_snapshots.latest("movement_id").quantity, 15)
+        self.assertEqual(ledger_quantity(self.product), 15)
+
+        Product.objects.filter(pk=self.product.pk).update(quantity=1)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("snapshot_inventory", "--check", stdout=out)
+        self.assertIn(f"product #{self.product.pk}: quantity 1, ledger 15", out.getvalue())
+
+
+@mock.patch("api.facets.REFRESH_INTERVAL", 0)
+class FacetIndexTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        facet_index.clear()
+        self.addCleanup(facet_index.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tools, self.drills = create_catalog(products=2, variants=0, images=0)
+            self.paint, _ = create_catalog(products=1, variants=0, images=0, name="Paint")
+        self.drill, self.saw = Product.objects.filter(category=self.tools).order_by("pk")
+        self.can = Product.objects.get(category=self.paint)
+        with self.captureOnCommitCallbacks(execute=True):
+            for product, color, size in [
+                (self.drill, "Red", 8),
+                (self.drill, "blue", 10),
+                (self.saw, "red", 12),
+                (self.can, "Blue", 1),
+            ]:
+                Variant.objects.create(product=product, color=color, size=size, price=Decimal("5"))
+            set_stock(self.saw, 3)
+
+    def listed(self, **params):
+        response = self.client.get("/api/product/", params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return {row["id"] for row in response.data["results"]}
+
+    def test_filters_intersect_facets(self):
+        self.assertEqual(self.listed(color="red"), {self.drill.pk, self.saw.pk})
+        self.assertEqual(self.listed(color="blue,red", category=self.paint.pk), {self.can.pk})
+        self.assertEqual(self.listed(color="red", min_size=11), {self.saw.pk})
+        # Facets describe products: a red variant and a size 10 one will do.
+        self.assertEqual(self.listed(color="red", min_size=9), {self.drill.pk, self.saw.pk})
+        self.assertEqual(self.listed(in_stock="true"), {self.saw.pk})
+        self.assertEqual(self.listed(subcategory=self.drills.pk, in_stock="false"), {self.drill.pk})
+        response = self.client.get("/api/product/", {"category": "tools"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_counts_leave_out_the_facets_own_selection(self):
+        response = self.client.get("/api/product/facets/", {"color": "red", "max_price": "90"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 2)
+        # Every product is 90.00 after its 10% discount.
+        self.assertEqual(
+            response.data["color"], [{"value": "blue", "count": 2}, {"value": "red", "count": 2}]
+        )
+        self.assertEqual(response.data["category"], [{"value": self.tools.pk, "count": 2}])
+        self.assertEqual(response.data["in_stock"], {"true": 1, "false": 1})
+        self.assertEqual(response.data["price"], {"min": "90.00", "max": "90.00"})
+
+    def test_writes_reach_the_index(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Variant.objects.filter(product=self.saw).update(color="green")
+            catalog_bulk_changed.send(
+                sender=Variant, pks=list(self.saw.variants.values_list("pk", flat=True))
+            )
+            self.drill.delete()
+            self.can.discount = None
+            self.can.save()
+        self.assertEqual(self.listed(color="red"), set())
+        self.assertEqual(self.listed(color="green"), {self.saw.pk})
+        response = self.client.get("/api/product/facets/", {"min_price": "95"})
+        self.assertEqual(response.data["count"], 1)
+        self.assertEqual(response.data["category"], [{"value": self.paint.pk, "count": 1}])
+
+    def test_index_writes_without_a_conflict_target(self):
+        # MySQL names no conflict target; ON DUPLICATE KEY UPDATE matches on
+        # the product's unique key, which SQLite has to be told about.
+        suffix = connection.ops.on_conflict_suffix_sql
+
+        def on_duplicate_key(fields, on_conflict, update_fields, unique_fields):
+            if on_conflict is None:
+                return suffix(fields, on_conflict, update_fields, unique_fields)
+            self.assertEqual(list(unique_fields), [])
+            updates = ", ".join(f"{field} = EXCLUDED.{field}" for field in update_fields)
+            return f"ON CONFLICT(product_id) DO UPDATE SET {updates}"
+
+        with mock.patch.object(
+            connection.features, "supports_update_conflicts_with_target", False
+        ), mock.patch.object(connection.ops, "on_conflict_suffix_sql", on_duplicate_key):
+            with self.captureOnCommitCallbacks(execute=True):
+                Variant.objects.create(product=self.can, color="Green", size=2, price=Decimal("5"))
+        self.assertEqual(self.listed(color="green"), {self.can.pk})
+
+
+class SalesRollupTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_catalog(products=2, variants=1, images=0)
+        self.product, self.other = Product.objects.order_by("pk")
+        self.variant = self.other.variants.get()
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.order = self.place_order(self.hour, "100.00", "10.00", [(self.product, None, 2)])
+        self.place_order(
+            self.hour - timedelta(days=1), "50.00", "0.00", [(self.other, self.variant, 1)]
+        )
+        payments = [("card", "paid", 100), ("card", "failed", 100), ("cash", "paid", 40)]
+        for method, status, amount in payments:
+            Payment.objects.create(
+                order=self.order,
+                payment_method=method,
+                payment_status=status,
+                amount=amount,
+                transaction_id=f"{method}-{status}",
+            )
+        call_command("refresh_rollups", stdout=StringIO())
+        self.admin = User.objects.create_superuser("boss", "boss@example.com", "x")
+        self.client.force_authenticate(self.admin)
+
+    def place_order(self, created_at, net, discount, lines):
+        order = Order.objects.create(net_amount=Decimal(net), discount_amount=Decimal(discount))
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        order.refresh_from_db()
+        for product, variant, quantity in lines:
+            OrderItem.objects.create(
+                order=order,
+                product=product,
+                variant=variant,
+                quantity=quantity,
+                price=Decimal("45.00"),
+            )
+        # The update above moved the order to another hour.
+        order.save()
+        return order
+
+    def test_rollups_follow_writes(self):
+        today = SalesRollup.objects.get(period="day", start=self.hour.replace(hour=0))
+        self.assertEqual(
+            (today.orders, today.net_amount, today.discount_amount),
+            (1, Decimal("100.00"), Decimal("10.00")),
+        )
+        self.assertEqual(SalesRollup.objects.filter(period="hour", orders=1).count(), 2)
+        item = ItemSalesRollup.objects.get(period="hour", start=self.hour)
+        self.assertEqual(
+            (item.product_id, item.variant_id, item.units, item.revenue),
+            (self.product.pk, None, 2, Decimal("90.00")),
+        )
+
+        self.order.order_items.get().delete()
+        self.order.net_amount = Decimal("0.00")
+        self.order.save()
+        # Writers only record the hour; the rollups catch up on refresh.
+        self.assertEqual(RollupChange.objects.count(), 2)
+        self.assertTrue(ItemSalesRollup.objects.filter(start=self.hour).exists())
+        self.assertEqual(refresh_changed(), 2)
+        self.assertFalse(RollupChange.objects.exists())
+        self.assertFalse(ItemSalesRollup.objects.filter(start=self.hour).exists())
+        self.assertEqual(SalesRollup.objects.get(period="hour", start=self.hour).net_amount, 0)
+
+    def test_reports(self):
+        start = (self.hour - timedelta(days=2)).isoformat()
+        response = self.client.get("/api/reports/sales/", {"start": start})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["totals"]["orders"], 2)
+        self.assertEqual(response.data["totals"]["net_amount"], "150.00")
+
+        response = self.client.get("/api/reports/products/", {"period": "hour", "start": start})
+        self.assertEqual(
+            [(row["product"], row["units"]) for row in response.data["results"]],
+            [(self.product.pk, 2), (self.other.pk, 1)],
+        )
+
+        response = self.client.get("/api/reports/payments/")
+        card, cash = response.data["results"]
+        self.assertEqual(
+            (card["payment_method"], card["payments"], card["success_rate"]), ("card", 2, 0.5)
+        )
+        self.assertEqual((cash["succeeded_amount"], cash["success_rate"]), (40, 1))
+
+        self.assertEqual(self.client.get("/api/reports/sales/", {"period": "week"}).status_code, 400)
+        self.client.force_authenticate(User.objects.create_user("clerk", "clerk@example.com", "x"))
+        self.assertEqual(self.client.get("/api/reports/sales/").status_code, 403)
+
+    def test_backfill_rebuilds_the_tables(self):
+        expected = sorted(SalesRollup.objects.values_list("period", "start", "orders", "net_amount"))
+        SalesRollup.objects.all().delete()
+        ItemSalesRollup.objects.all().delete()
+        PaymentRollup.objects.all().delete()
+        call_command("backfill_rollups", stdout=StringIO())
+        rebuilt = SalesRollup.objects.filter(orders__gt=0)
+        self.assertEqual(
+            sorted(rebuilt.values_list("period", "start", "orders", "net_amount")),
+            [row for row in expected if row[2]],
+        )
+        self.assertEqual(ItemSalesRollup.objects.filter(period="day").count(), 2)
+        self.assertEqual(PaymentRollup.objects.filter(period="hour").count(), 2)
@@ -17,7 +17,12 @@ from .views import (
     SubCategoryDetailViewSlag,
     CategoryDetailViewSlag,
     ContractFormViewSet,
-    OrderItemViewSet
+    OrderItemViewSet,
+    CheckoutView,
+    PerformanceView,
+    SalesReportView,
+    ItemSalesReportView,
+    PaymentReportView,
 )
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from .serializers import CustomTokenObtainPairSerializer
@@ -55,6 +60,11 @@ urlpatterns = [
         SubCategoryDetailViewSlag.as_view(),
         name="subcategory-detail-slug",
     ),
+    path("checkout/", CheckoutView.as_view(), name="checkout"),
+    path("perf/", PerformanceView.as_view(), name="performance"),
+    path("reports/sales/", SalesReportView.as_view(), name="sales-report"),
+    path("reports/products/", ItemSalesReportView.as_view(), name="item-sales-report"),
+    path("reports/payments/", PaymentReportView.as_view(), name="payment-report"),
     path(
         "token/",
         TokenObtainPairView.as_view(serializer_class=CustomTokenObtainPairSerializer),
@@ -1,7 +1,14 @@
+from datetime import timedelta
+
 from django.shortcuts import render
 from rest_framework import viewsets
 from django.contrib.auth.hashers import make_password
-from rest_framework.generics import RetrieveAPIView, ListAPIView
+from django.utils import timezone
+from django.utils.text import slugify
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import RetrieveAPIView, ListAPIView, CreateAPIView
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView
 from .serializers import (
     CategorySerializer,
     SubCategorySerializer,
@@ -18,7 +25,11 @@ from .serializers import (
     CategoryListSerializer,
     SubCategoryDetailSerializer,
     SubCategoryListSerializer,
-    ContractFormSerializer
+    ContractFormSerializer,
+    CheckoutSerializer,
+    ProductBulkSerializer,
+    VariantBulkSerializer,
+    ImageBulkSerializer,
     )
 from .models import (
     Category,
@@ -32,11 +43,26 @@ from .models import (
     ShippingAddress,
     OrderItem,
     Payment,
-    ContractForm
+    ContractForm,
+    RollupPeriod,
 )
 from rest_framework.response import Response  # Import Response
 from rest_framework.decorators import action 
 from .authentication import PostRequestPermission ,PostAndGetRequestPermission
+from .prefetch import PrefetchSerializerMixin, prefetch_for_serializer
+from .fastpath import AsyncReadMixin, FastListMixin
+from .snapshots import CategorySnapshotMixin, CategorySnapshotValidatorsMixin
+from .caching import CachedResponseMixin
+from .conditional import ConditionalGetMixin
+from .filters import CreatedAtRangeFilter, FacetFilter, PriceRangeFilter, PriceOrderingFilter
+from .exports import ExportMixin
+from .bulk import BulkMixin
+from .search import search_products
+from .facets import facet_counts
+from .routers import PrimaryPinMixin, ReplicaReadMixin
+from .instrumentation import get_view_stats, reset_view_stats
+from .backends.pool import get_pool_stats
+from .rollups import item_report, payment_report, sales_report
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -57,7 +83,7 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer.save()
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ReplicaReadMixin, PrefetchSerializerMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all().order_by('-id')
     serializer_class = CategorySerializer
     def retrieve(self, request, *args, **kwargs):
@@ -68,33 +94,94 @@ class CategoryViewSet(viewsets.ModelViewSet):
     @action(detail=True, url_path='products')
     def get_category_products(self, request, pk=None):
         category = self.get_object()
-        products = Product.objects.filter(subcategory__category=category)
-        serializer = ProductSerializer(products, many=True)
+        context = self.get_serializer_context()
+        products = prefetch_for_serializer(
+            Product.objects.filter(subcategory__category=category),
+            ProductSerializer(context=context),
+        )
+        serializer = ProductSerializer(products, many=True, context=context)
         return Response(serializer.data)
-class SubCategoryViewSet(viewsets.ModelViewSet):
+class SubCategoryViewSet(ReplicaReadMixin, PrefetchSerializerMixin, viewsets.ModelViewSet):
     queryset = SubCategory.objects.all().order_by('-id')
     serializer_class = SubCategorySerializer
 
-class DiscountViewSet(viewsets.ModelViewSet):
+class DiscountViewSet(ReplicaReadMixin, FastListMixin, PrefetchSerializerMixin, viewsets.ModelViewSet):
     queryset = Discount.objects.all().order_by('-id')
     serializer_class = DiscountSerializer
     
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ReplicaReadMixin, ConditionalGetMixin, FastListMixin, PrefetchSerializerMixin, BulkMixin, AsyncReadMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all().order_by('-id')
     serializer_class = ProductSerializer
-class ImageViewSet(viewsets.ModelViewSet):
+    bulk_serializer_class = ProductBulkSerializer
+    bulk_lookup_field = "slug"
+    filter_backends = [FacetFilter, PriceRangeFilter, PriceOrderingFilter]
+    ordering_fields = ["effective_price", "name", "id"]
+    ordering = ["-id"]
+
+    def get_queryset(self):
+        return super().get_queryset().with_effective_price()
+
+    def get_validator_queryset(self):
+        # Without the price annotation and its discount join.
+        return super().get_queryset()
+
+    def get_bulk_key(self, row):
+        # Same fallback as the generate_slug signal, which bulk_create skips.
+        return super().get_bulk_key(row) or slugify(row.get("name") or "") or None
+
+    @action(detail=False, url_path="search")
+    def search(self, request):
+        query = request.query_params.get("q", "")
+        try:
+            limit = max(1, min(int(request.query_params.get("limit", 20)), 100))
+        except ValueError:
+            limit = 20
+        ranked = search_products(query, limit=limit)
+        products = self.get_queryset().in_bulk([pk for pk, _ in ranked])
+        results = []
+        for pk, score in ranked:
+            if pk in products:
+                data = self.get_serializer(products[pk]).data
+                data["score"] = round(score, 4)
+                results.append(data)
+        return Response({"results": results})
+
+    @action(detail=False, url_path="facets")
+    def facets(self, request):
+        """Match and value counts for the facet selection in the query string."""
+        return Response(facet_counts(request.query_params))
+
+
+class ImageViewSet(ReplicaReadMixin, FastListMixin, PrefetchSerializerMixin, BulkMixin, viewsets.ModelViewSet):
     queryset = Image.objects.all().order_by('-id')
     serializer_class = ImageSerializer
+    bulk_serializer_class = ImageBulkSerializer
     
 
-class VariantViewSet(viewsets.ModelViewSet):
+class VariantViewSet(ReplicaReadMixin, ConditionalGetMixin, FastListMixin, PrefetchSerializerMixin, BulkMixin, viewsets.ModelViewSet):
     queryset = Variant.objects.all().order_by('-id')
     serializer_class = VariantSerializer
+    bulk_serializer_class = VariantBulkSerializer
+    filter_backends = [PriceRangeFilter, PriceOrderingFilter]
+    ordering_fields = ["effective_price", "size", "id"]
+    ordering = ["-id"]
 
-class OrderViewSet(viewsets.ModelViewSet):
+    def get_queryset(self):
+        return super().get_queryset().with_effective_price()
+
+    def get_validator_queryset(self):
+        # Without the price annotation and its discount join.
+        return super().get_queryset()
+
+class OrderViewSet(PrimaryPinMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all().order_by('-id')
     serializer_class = OrderSerializer
     permission_classes = [PostRequestPermission]
+    filter_backends = [CreatedAtRangeFilter]
+
+class CheckoutView(PrimaryPinMixin, CreateAPIView):
+    serializer_class = CheckoutSerializer
+    permission_classes = [PostRequestPermission]
 
 class ContractFormViewSet(viewsets.ModelViewSet):
     queryset = ContractForm.objects.all().order_by('-id')
@@ -106,43 +193,160 @@ class ShippingAddressViewSet(viewsets.ModelViewSet):
     queryset = ShippingAddress.objects.all().order_by('-id')
     serializer_class = ShippingAddressSerializer
 
-class OrderItemViewSet(viewsets.ModelViewSet):
+class OrderItemViewSet(PrimaryPinMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = OrderItem.objects.all().order_by('-id')
     serializer_class = OrderItemSerializer
     permission_classes = [PostAndGetRequestPermission]
+    filter_backends = [CreatedAtRangeFilter]
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(ExportMixin, viewsets.ModelViewSet):
     queryset = Payment.objects.all().order_by('-id')
     serializer_class = PaymentSerializer
+    filter_backends = [CreatedAtRangeFilter]
     
 
-class CategoryDetailView(RetrieveAPIView):
+class CategoryDetailView(
+    ReplicaReadMixin,
+    CategorySnapshotValidatorsMixin,
+    ConditionalGetMixin,
+    CategorySnapshotMixin,
+    PrefetchSerializerMixin,
+    AsyncReadMixin,
+    RetrieveAPIView,
+):
     queryset = Category.objects.all().order_by('-id')
     serializer_class = CategoryDetailSerializer
 
-class CategoryListView(ListAPIView):
+class CategoryListView(
+    ReplicaReadMixin,
+    ConditionalGetMixin, CachedResponseMixin, PrefetchSerializerMixin, AsyncReadMixin, ListAPIView
+):
     queryset = Category.objects.all().order_by('-id')
     serializer_class = CategoryListSerializer
+    pagination_class = None
+    cache_tags = ("category", "image")
 
 
-class SubCategoryDetailView(RetrieveAPIView):
+class SubCategoryDetailView(ReplicaReadMixin, ConditionalGetMixin, PrefetchSerializerMixin, AsyncReadMixin, RetrieveAPIView):
     queryset = SubCategory.objects.all().order_by('-id')
     serializer_class = SubCategoryDetailSerializer
 
-class SubCategoryListView(ListAPIView):
+class SubCategoryListView(
+    ReplicaReadMixin,
+    ConditionalGetMixin, CachedResponseMixin, PrefetchSerializerMixin, AsyncReadMixin, ListAPIView
+):
     queryset = SubCategory.objects.all().order_by('-id')
     serializer_class = SubCategoryListSerializer
+    pagination_class = None
+    cache_tags = ("subcategory", "image")
 
-class SubCategoryDetailViewSlag(ListAPIView):
+class SubCategoryDetailViewSlag(
+    ReplicaReadMixin,
+    ConditionalGetMixin, CachedResponseMixin, PrefetchSerializerMixin, AsyncReadMixin, ListAPIView
+):
+    queryset = SubCategory.objects.all()
     serializer_class = SubCategoryDetailSerializer
+    pagination_class = None
+    cache_tags = ("subcategory", "product", "variant", "discount", "image")
 
     def get_queryset(self):
         subcategory_slug = self.kwargs['slug']
-        return SubCategory.objects.filter(slug=subcategory_slug)
+        return super().get_queryset().filter(slug=subcategory_slug)
 
-class CategoryDetailViewSlag(ListAPIView):
+class CategoryDetailViewSlag(
+    ReplicaReadMixin,
+    CategorySnapshotValidatorsMixin,
+    ConditionalGetMixin,
+    CachedResponseMixin,
+    CategorySnapshotMixin,
+    PrefetchSerializerMixin,
+    AsyncReadMixin,
+    ListAPIView,
+):
+    queryset = Category.objects.all()
     serializer_class = CategoryDetailSerializer
+    pagination_class = None
+    snapshot_lookup = "slug"
+    # Served from CategorySnapshot, which is re-saved whenever its tree changes.
+    cache_tags = ("category", "categorysnapshot")
 
     def get_queryset(self):
         category_slug = self.kwargs['slug']
-        return Category.objects.filter(slug=category_slug)
\ No newline at end of file
+        return super().get_queryset().filter(slug=category_slug)
+
+class PerformanceView(APIView):
+    """
+    Request timings per view since the process started (or the last DELETE),
+    from PerformanceMiddleware, and the state of the connection pools.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({"views": get_view_stats(), "pools": get_pool_stats()})
+
+    def delete(self, request):
+        reset_view_stats()
+        return Response(status=204)
+
+
+class RollupReportView(APIView):
+    """
+    Base of the sales reports, read from the rollups of api/rollups.py:
+    `?period=hour|day` (default day) from `?start=` (inclusive) to `?end=`
+    (exclusive), as ISO dates or datetimes. The range defaults to the last 30
+    days, or 48 hours by the hour.
+    """
+
+    permission_classes = [IsAdminUser]
+    default_spans = {
+        RollupPeriod.HOUR: timedelta(hours=48),
+        RollupPeriod.DAY: timedelta(days=30),
+    }
+
+    def get_report(self, request, period, start, end):
+        raise NotImplementedError
+
+    def get(self, request):
+        period = request.query_params.get("period", RollupPeriod.DAY)
+        if period not in RollupPeriod.values:
+            raise ValidationError({"period": ["Must be hour or day."]})
+        parser = CreatedAtRangeFilter()
+        end = request.query_params.get("end")
+        end = parser.parse("end", end) if end else timezone.now()
+        start = request.query_params.get("start")
+        start = parser.parse("start", start) if start else end - self.default_spans[period]
+        return Response(
+            {
+                "period": period,
+                "start": start,
+                "end": end,
+                **self.get_report(request, period, start, end),
+            }
+        )
+
+
+class SalesReportView(RollupReportView):
+    """Orders and revenue per hour or day, with totals."""
+
+    def get_report(self, request, period, start, end):
+        return sales_report(period, start, end)
+
+
+class ItemSalesReportView(RollupReportView):
+    """The products and variants that sold the most units, `?limit=` of them."""
+
+    def get_report(self, request, period, start, end):
+        try:
+            limit = max(1, min(int(request.query_params.get("limit", 20)), 100))
+        except ValueError:
+            limit = 20
+        return item_report(period, start, end, limit=limit)
+
+
+class PaymentReportView(RollupReportView):
+    """Payments, successful payments and their success rate per method."""
+
+    def get_report(self, request, period, start, end):
+        return payment_report(period, start, end)
+
@@ -0,0 +1,11 @@
+"""
+URL configuration used under ASGI (see asgi.py): the async catalog views of
+api/async_urls.py first, then everything in urls.py.
+"""
+from django.urls import include, path
+
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path("api/", include("api.async_urls")),
+] + sync_urlpatterns
@@ -58,6 +58,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack (api/instrumentation.py).
+    "api.instrumentation.PerformanceMiddleware",
+    "api.nplusone.NPlusOneMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -103,16 +106,99 @@ else:
 
     DATABASES = {
         "default": {
-            "ENGINE": "django.db.backends.mysql",
+            # The MySQL backend with a per-process connection pool
+            # (api/backends/pool.py). Connections go back to the pool at the
+            # end of each request, so CONN_MAX_AGE stays 0.
+            "ENGINE": "api.backends.mysql",
             "NAME": "aminexco_mistrytech",
             "USER": "aminexco_dev",
             "PASSWORD": "(j{mL7D$P_@7",
             "HOST": "localhost",  # Or your MySQL server IP address
             "PORT": "3306",  # MySQL default port
+            "CONN_MAX_AGE": 0,
+            "OPTIONS": {
+                "pool": {
+                    "min_size": 2,
+                    "max_size": 10,
+                    "timeout": 10,
+                    "max_lifetime": 1800,
+                    "max_idle": 300,
+                    "check_after": 30,
+                },
+            },
         }
     }
 
 
+# Catalog GETs read from these replicas (api/routers.py), each defined in
+# DATABASES like "default", while their lag is within MAX_LAG seconds. A
+# write to an order pins that user's reads to the primary for PIN_SECONDS.
+DATABASE_ROUTERS = ["api.routers.ReplicaRouter"]
+
+DATABASE_REPLICATION = {
+    "REPLICAS": [],
+    "MAX_LAG": 5,
+    "LAG_CHECK_INTERVAL": 10,
+    "PIN_SECONDS": 10,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# LocMemCache evicts least recently used entries beyond MAX_ENTRIES. It is
+# per process, so point this at a shared backend (e.g. FileBasedCache) when
+# running several workers.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "mistrytech",
+        "OPTIONS": {
+            "MAX_ENTRIES": 1000,
+        },
+    }
+}
+
+# Response cache for the read-only catalog views (api/caching.py).
+# TIMEOUTS are in seconds, keyed by view class name.
+API_RESPONSE_CACHE = {
+    "ALIAS": "default",
+    "DEFAULT_TIMEOUT": 300,
+    "TIMEOUTS": {
+        "CategoryListView": 600,
+        "SubCategoryListView": 600,
+        "CategoryDetailViewSlag": 300,
+        "SubCategoryDetailViewSlag": 300,
+    },
+}
+
+# Request timings per view (api/instrumentation.py), reported at /api/perf/.
+# SERVER_TIMING adds them to each response as a Server-Timing header; it is
+# left unset here so that it follows DEBUG and stays off in production.
+API_PERFORMANCE = {}
+
+# N+1 query detection (api/nplusone.py): a warning naming the serializer field
+# or admin method behind THRESHOLD same-shape queries, for a SAMPLE_RATE
+# fraction of requests. The test runner raises instead.
+NPLUSONE = {
+    "MODE": "log",
+    "THRESHOLD": 3,
+    "SAMPLE_RATE": 0.05,
+}
+
+TEST_RUNNER = "api.test_runner.NPlusOneTestRunner"
+
+# Thumbnails and WebP/AVIF copies of uploaded images (api/derivatives.py),
+# rendered by a pool of WORKERS processes. AVIF is skipped when Pillow can't
+# write it.
+IMAGE_DERIVATIVES = {
+    "SIZES": [160, 320, 640, 1280],
+    "FORMATS": ["jpeg", "webp", "avif"],
+    "QUALITY": 80,
+    "WORKERS": 2,
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -176,6 +262,10 @@ REST_FRAMEWORK = {
         "rest_framework.renderers.JSONRenderer",
         # Add any other renderers you need here
     ),
+    # Keyset pagination on "-id"; clients can pass ?page_size= (max 100) and
+    # ?count=true when they need the total.
+    "DEFAULT_PAGINATION_CLASS": "api.pagination.IdCursorPagination",
+    "PAGE_SIZE": 20,
 }
 
 